@@ -0,0 +1 @@
+"""Benchmarks for the XP and leaderboard hot paths, run with `python -m benchmarks` (see benchmarks/run.py)"""
@@ -0,0 +1,166 @@
+"""Just enough of discord.py's Guild/Member/Role/channel surface for the bot's hot paths
+
+Nothing here talks to Discord - sends and role edits complete immediately and are counted,
+so a benchmark measures the bot's own work (caches, scoring, database) and not the network.
+"""
+import itertools
+from typing import Dict, Iterable, List, Optional
+
+_message_ids = itertools.count(1)
+
+
+class FakePermissions:
+    send_messages = True
+
+
+class FakeRole:
+    __slots__ = ('id', 'name', 'guild', 'position')
+
+    def __init__(self, role_id: int, name: str, guild: 'FakeGuild', position: int = 1):
+        self.id = role_id
+        self.name = name
+        self.guild = guild
+        self.position = position
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+
+    def is_default(self) -> bool:
+        return self.id == self.guild.id
+
+    @property
+    def mention(self) -> str:
+        return f"<@&{self.id}>"
+
+    @property
+    def members(self) -> List['FakeMember']:
+        return [member for member in self.guild.members if self in member.roles]
+
+
+class FakeMember:
+    __slots__ = ('id', 'name', 'guild', 'roles', 'bot')
+
+    def __init__(self, user_id: int, guild: 'FakeGuild', roles: Iterable[FakeRole]):
+        self.id = user_id
+        self.name = f"member{user_id}"
+        self.guild = guild
+        self.roles = list(roles)
+        self.bot = False
+
+    @property
+    def display_name(self) -> str:
+        return self.name
+
+    @property
+    def mention(self) -> str:
+        return f"<@{self.id}>"
+
+    async def edit(self, *, roles: Optional[List[FakeRole]] = None, reason: Optional[str] = None, **kwargs):
+        self.guild.role_edits += 1
+        if roles is not None:
+            self.roles = [self.guild.default_role] + [role for role in roles if not role.is_default()]
+
+
+class FakeMessage:
+    __slots__ = ('id', 'channel', 'guild')
+
+    def __init__(self, channel: 'FakeChannel'):
+        self.id = next(_message_ids)
+        self.channel = channel
+        self.guild = channel.guild
+
+    async def delete(self):
+        pass
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild: 'FakeGuild'):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"channel{channel_id}"
+        self.sent = 0
+
+    def permissions_for(self, member) -> FakePermissions:
+        return FakePermissions()
+
+    def get_partial_message(self, message_id: int) -> FakeMessage:
+        return FakeMessage(self)
+
+    async def send(self, *args, **kwargs) -> FakeMessage:
+        self.sent += 1
+        return FakeMessage(self)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, name: str):
+        self.id = guild_id
+        self.name = name
+        self.roles: List[FakeRole] = [FakeRole(guild_id, "@everyone", self, position=0)]
+        self._roles: Dict[int, FakeRole] = {guild_id: self.roles[0]}
+        self._members: Dict[int, FakeMember] = {}
+        self.text_channels = [FakeChannel(guild_id + 1, self)]
+        self.me = None
+        self.chunked = True
+        self.role_edits = 0
+
+    @property
+    def default_role(self) -> FakeRole:
+        return self.roles[0]
+
+    @property
+    def members(self) -> List[FakeMember]:
+        return list(self._members.values())
+
+    @property
+    def member_count(self) -> int:
+        return len(self._members)
+
+    def add_role(self, role_id: int, name: str) -> FakeRole:
+        role = FakeRole(role_id, name, self, position=len(self.roles))
+        self.roles.append(role)
+        self._roles[role_id] = role
+        return role
+
+    def add_member(self, member: FakeMember):
+        self._members[member.id] = member
+
+    def get_role(self, role_id: int) -> Optional[FakeRole]:
+        return self._roles.get(role_id)
+
+    def get_member(self, user_id: int) -> Optional[FakeMember]:
+        return self._members.get(user_id)
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return next((channel for channel in self.text_channels if channel.id == channel_id), None)
+
+    async def chunk(self, *, cache: bool = True) -> List[FakeMember]:
+        return self.members
+
+    async def fetch_member(self, user_id: int) -> FakeMember:
+        return self._members[user_id]
+
+
+class FakeEmoji:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class FakeReactionPayload:
+    """The fields on_raw_reaction_add reads from a RawReactionActionEvent"""
+
+    def __init__(self, message_id: int, channel: FakeChannel, member: FakeMember, emoji: str = '✅'):
+        self.message_id = message_id
+        self.channel_id = channel.id
+        self.guild_id = channel.guild.id
+        self.user_id = member.id
+        self.member = member
+        self.emoji = FakeEmoji(emoji)
@@ -0,0 +1,268 @@
+"""Benchmark the XP and leaderboard hot paths against synthetic guilds
+
+    python -m benchmarks                          # 1k, 10k and 100k members, compared to baseline.json
+    python -m benchmarks --sizes 1000 10000 --samples 500
+    python -m benchmarks --lean                   # lean member cache (LEAN_MEMBER_CACHE=1)
+    python -m benchmarks --save-baseline          # record this run as the new baseline
+    python -m benchmarks --strict                 # exit 1 on regressions (same machine as the baseline)
+
+baseline.json holds absolute timings from the machine that recorded it, so regressions are
+only warnings unless --strict is given. On other hardware, save a local baseline first.
+
+The bot runs against a throwaway SQLite database in a temp directory. Discord calls go to
+the fakes, so the numbers cover the bot's own work: caches, scoring and the database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import FakeReactionPayload  # noqa: E402
+from benchmarks.seed import build_guild, write_rows  # noqa: E402
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+DEFAULT_SAMPLES = 1_000
+# Cold leaderboard builds score the whole guild, so they get fewer repetitions
+LEADERBOARD_BUILDS = 5
+QUESTS = 20
+DEFAULT_BASELINE = os.path.join(REPO_ROOT, 'benchmarks', 'baseline.json')
+# p50/p99 this much slower than the baseline is reported as a regression
+REGRESSION_TOLERANCE = 0.25
+# ...unless it is also less than this much slower in absolute terms (timer noise on cache hits)
+NOISE_FLOOR_MS = 0.1
+
+
+class QueryCounter:
+    """sqlite3 trace callback counting statements, leaving out transaction control"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement: str):
+        if not statement.lstrip()[:8].upper().startswith(('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')):
+            self.count += 1
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def load_bot(lean: bool, workdir: str):
+    """Import bot.py with its database in workdir - the module creates quest_bot.db on import"""
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['LEAN_MEMBER_CACHE'] = '1' if lean else ''
+    os.chdir(workdir)
+    import bot
+    return bot
+
+
+class Runner:
+    def __init__(self, bot_module, samples: int, seed: int):
+        self.b = bot_module
+        self.quest_bot = bot_module.quest_bot
+        self.samples = samples
+        self.rng = random.Random(seed)
+        self.guilds = {}
+        self.channels = {}
+        self.queries = QueryCounter()
+        self.results: List[dict] = []
+
+        # Route the bot's lookups to the fakes; bot.user is read by the member update handler
+        bot = bot_module.bot
+        bot.get_guild = self.guilds.get
+        bot.get_channel = self.channels.get
+        bot._connection.user = type('BenchmarkUser', (), {'id': 1, 'bot': True})()
+        self.quest_bot.db.run_sync(lambda connection: connection.set_trace_callback(self.queries))
+
+    async def measure(self, name: str, size: int, op: Callable[[int], Awaitable],
+                      count: int, prepare: Optional[Callable[[int], None]] = None):
+        latencies = []
+        queries = self.queries.count
+        elapsed = 0.0
+        for i in range(count):
+            if prepare:
+                prepare(i)
+            started = time.perf_counter()
+            await op(i)
+            latency = time.perf_counter() - started
+            latencies.append(latency)
+            elapsed += latency
+        await self.drain()
+        latencies.sort()
+        result = {
+            "name": name,
+            "size": size,
+            "ops": count,
+            "ops_per_sec": count / elapsed if elapsed else 0.0,
+            "p50_ms": _percentile(latencies, 0.50) * 1000,
+            "p99_ms": _percentile(latencies, 0.99) * 1000,
+            "queries_per_op": (self.queries.count - queries) / count,
+        }
+        self.results.append(result)
+        return result
+
+    async def drain(self):
+        """Let the work a benchmark queued (level role edits, digests) finish outside the timings"""
+        for guild in self.guilds.values():
+            await self.quest_bot.notifications.flush(guild)
+        while len(self.quest_bot.level_roles) or len(self.quest_bot.outbound) or self.quest_bot.outbound.in_flight:
+            await asyncio.sleep(0.05)
+
+    async def setup_guild(self, size: int):
+        seeded = build_guild(size, size, self.rng, self.quest_bot.calculate_level)
+        guild = seeded.guild
+        self.guilds[guild.id] = guild
+        for channel in guild.text_channels:
+            self.channels[channel.id] = channel
+        self.quest_bot.db.run_sync(write_rows, seeded)
+        self.quest_bot.role_xp_assignments[guild.id] = seeded.assignments
+        self.quest_bot.role_tables.pop(guild.id, None)
+        if self.quest_bot.members.lean:
+            await self.quest_bot.members.load(guild, self.quest_bot.get_role_table(guild.id).relevant)
+        return seeded
+
+    async def run_size(self, size: int):
+        seeded = await self.setup_guild(size)
+        guild = seeded.guild
+        quest_bot = self.quest_bot
+        member_ids = [member.id for member in guild.members]
+        sample = self.rng.sample(member_ids, min(self.samples, len(member_ids)))
+
+        # calculate_total_user_xp - cold loads the member from the database, warm is a cache hit
+        await self.measure("calculate_total_user_xp (cold)", size,
+                           lambda i: quest_bot.calculate_total_user_xp(sample[i], guild.id), len(sample),
+                           prepare=lambda i: quest_bot.xp_cache.invalidate_member(guild.id, sample[i]))
+        await self.measure("calculate_total_user_xp (warm)", size,
+                           lambda i: quest_bot.calculate_total_user_xp(sample[i], guild.id), len(sample))
+
+        # get_leaderboard - cold builds the guild's index from one bulk load, warm reads it
+        await self.measure("get_leaderboard (cold)", size,
+                           lambda i: quest_bot.get_leaderboard(guild.id, 10), LEADERBOARD_BUILDS,
+                           prepare=lambda i: quest_bot.invalidate_guild_xp(guild.id))
+        await self.measure("get_leaderboard (warm)", size,
+                           lambda i: quest_bot.get_leaderboard(guild.id, 10), self.samples)
+
+        # Member updates gaining an XP role - mostly badges, some streak roles
+        updates = []
+        for user_id in sample:
+            member = guild.get_member(user_id)
+            pool = seeded.streak_roles if self.rng.random() < 0.3 else seeded.badge_roles
+            candidates = [role for role in pool if role not in member.roles]
+            if candidates:
+                updates.append((member, self.rng.choice(candidates)))
+        if quest_bot.members.lean:
+            # Lean mode reads member updates from the raw gateway event
+            def member_update(i):
+                member, role = updates[i]
+                member.roles.append(role)
+                # Compact separators, like the gateway sends
+                return self.b.on_socket_raw_receive(json.dumps({"t": "GUILD_MEMBER_UPDATE", "d": {
+                    "guild_id": str(guild.id), "user": {"id": str(member.id), "username": member.name},
+                    "roles": [str(r.id) for r in member.roles if not r.is_default()]}}, separators=(',', ':')))
+            await self.measure("on_socket_raw_receive (member update)", size, member_update, len(updates))
+        else:
+            def member_update(i):
+                member, role = updates[i]
+                before = type(member)(member.id, guild, member.roles)
+                member.roles.append(role)
+                return self.b.on_member_update(before, member)
+            await self.measure("on_member_update", size, member_update, len(updates))
+
+        # ✅ reactions on quests, each a first completion
+        channel = guild.text_channels[0]
+        quest_ids = []
+        for n in range(QUESTS):
+            message = await channel.send()
+            await quest_bot.add_quest(message.id, guild.id, channel.id, f"Quest {n}", "Benchmark quest")
+            quest_ids.append(message.id)
+        # Sampled members are distinct, so every reaction is a first completion
+        payloads = [FakeReactionPayload(self.rng.choice(quest_ids), channel, guild.get_member(user_id)) for user_id in sample]
+        await self.measure("on_raw_reaction_add", size, lambda i: self.b.on_raw_reaction_add(payloads[i]), len(payloads))
+
+
+def compare(results: List[dict], baseline: Dict[str, dict], tolerance: float) -> int:
+    """Print the results table next to the baseline, returns the number of regressions"""
+    regressions = 0
+    header = f"{'hot path':40} {'members':>8} {'ops':>6} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'queries/op':>10}  vs baseline (p50 / p99)"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        line = (f"{result['name']:40} {result['size']:>8,} {result['ops']:>6} {result['ops_per_sec']:>10,.0f} "
+                f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['queries_per_op']:>10.2f}")
+        base = baseline.get(f"{result['name']}@{result['size']}")
+        if base:
+            keys = ('p50_ms', 'p99_ms')
+            changes = [(result[key] - base[key]) / base[key] if base[key] else 0.0 for key in keys]
+            flag = ""
+            if any(change > tolerance and result[key] - base[key] > NOISE_FLOOR_MS for key, change in zip(keys, changes)):
+                flag = "  REGRESSION"
+                regressions += 1
+            line += f"  {changes[0]:+.0%} / {changes[1]:+.0%}{flag}"
+        print(line)
+    return regressions
+
+
+async def run(args) -> int:
+    workdir = tempfile.mkdtemp(prefix="questbot-bench-")
+    bot_module = load_bot(args.lean, workdir)
+    runner = Runner(bot_module, args.samples, args.seed)
+    try:
+        for size in args.sizes:
+            await runner.run_size(size)
+    finally:
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+        bot_module.quest_bot.db.close()
+        bot_module.log_listener.stop()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    mode = "lean" if args.lean else "default"
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get(mode, {})
+    regressions = compare(runner.results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = json.load(f)
+        stored[mode] = {f"{result['name']}@{result['size']}": result for result in runner.results}
+        with open(args.baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline to {args.baseline}")
+    elif regressions:
+        print(f"Warning: {regressions} hot path(s) more than {args.tolerance:.0%} slower than the baseline")
+        if args.strict:
+            return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark QuestBot's XP and leaderboard hot paths")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="guild sizes (members)")
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help="operations per hot path")
+    parser.add_argument('--seed', type=int, default=1, help="random seed for the synthetic guilds")
+    parser.add_argument('--lean', action='store_true', help="use the lean member cache")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE, help="allowed slowdown before a regression is reported")
+    parser.add_argument('--strict', action='store_true', help="exit with status 1 when a regression is reported")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Synthetic guilds with a realistic spread of badges, streaks and quest XP
+
+Badge popularity follows a Zipf curve, badges and quest completions per member are
+exponentially distributed (most members have a few, a long tail has many), about a third
+of members have streak history, and every member with XP holds the level role their
+total XP earns. A few percent of XP rows belong to users who have left the guild.
+"""
+import random
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.fakes import FakeGuild, FakeMember, FakeRole
+from role_xp import RoleXPTable
+
+AUTO_BADGES = 40          # "... Badge" roles without an assignment (5 XP each)
+ASSIGNED_BADGE_XP = (25, 50, 50, 100, 100, 150, 200, 250, 300, 500)
+STREAK_XP = (10, 20, 30, 50, 75, 100, 150, 200)
+COSMETIC_ROLES = 20       # colour/ping roles that never count towards XP
+
+QUEST_SHARE = 0.65        # members who have completed at least one quest
+MEAN_QUESTS = 4
+MEAN_BADGES = 2
+STREAK_SHARE = 0.3        # members with any streak role history
+MEAN_STREAK_GAINS = 3
+DEPARTED_SHARE = 0.05     # XP rows for users no longer in the guild
+
+
+class SeededGuild:
+    """A fake guild plus the rows that describe it in the database"""
+
+    def __init__(self, guild: FakeGuild, assignments: Dict[str, dict]):
+        self.guild = guild
+        self.assignments = assignments
+        self.badge_roles: List[FakeRole] = []
+        self.streak_roles: List[FakeRole] = []
+        self.user_rows: List[Tuple[int, int, int, int]] = []          # (guild_id, user_id, xp, level)
+        self.gain_rows: List[Tuple[int, int, int, str, int]] = []     # (user_id, guild_id, role_id, role_name, xp)
+
+
+def _zipf_weights(count: int) -> List[float]:
+    return [1 / (rank + 1) for rank in range(count)]
+
+
+def _pick_distinct(rng: random.Random, population: List, weights: List[float], count: int) -> set:
+    count = min(count, len(population))
+    picked = set()
+    while len(picked) < count:
+        picked.add(rng.choices(population, weights)[0])
+    return picked
+
+
+def build_guild(guild_id: int, size: int, rng: random.Random, calculate_level: Callable[[int], int]) -> SeededGuild:
+    guild = FakeGuild(guild_id, f"Benchmark {size:,}")
+    next_role_id = guild_id * 10_000
+
+    def add_role(name: str) -> FakeRole:
+        nonlocal next_role_id
+        next_role_id += 1
+        return guild.add_role(next_role_id, name)
+
+    level_roles = {level: add_role(f"Level {level}") for level in range(1, 11)}
+    assignments = {}
+    seeded = SeededGuild(guild, assignments)
+    for n in range(AUTO_BADGES):
+        seeded.badge_roles.append(add_role(f"Community {n} Badge"))
+    for n, xp in enumerate(ASSIGNED_BADGE_XP):
+        role = add_role(f"Event Winner {n}")
+        assignments[str(role.id)] = {"xp": xp, "type": "badge"}
+        seeded.badge_roles.append(role)
+    for xp in STREAK_XP:
+        role = add_role(f"{xp // 10 * 7}-Day Streak")
+        assignments[str(role.id)] = {"xp": xp, "type": "streak"}
+        seeded.streak_roles.append(role)
+    cosmetic_roles = [add_role(f"Colour {n}") for n in range(COSMETIC_ROLES)]
+
+    role_table = RoleXPTable(assignments, guild.roles)
+
+    # Shuffle so popular badges are a mix of auto and assigned ones
+    badge_order = list(seeded.badge_roles)
+    rng.shuffle(badge_order)
+    badge_weights = _zipf_weights(len(badge_order))
+    streak_weights = _zipf_weights(len(seeded.streak_roles))
+
+    for i in range(size):
+        user_id = guild_id * 1_000_000 + i
+        roles = {guild.default_role}
+        roles |= set(rng.sample(cosmetic_roles, rng.randint(0, 3)))
+        roles |= _pick_distinct(rng, badge_order, badge_weights, int(rng.expovariate(1 / MEAN_BADGES)))
+
+        base_xp = 0
+        if rng.random() < QUEST_SHARE:
+            base_xp = 50 * (1 + int(rng.expovariate(1 / MEAN_QUESTS)))
+
+        streak_xp = 0
+        if rng.random() < STREAK_SHARE:
+            for _ in range(1 + int(rng.expovariate(1 / MEAN_STREAK_GAINS))):
+                role = rng.choices(seeded.streak_roles, streak_weights)[0]
+                xp = assignments[str(role.id)]["xp"]
+                seeded.gain_rows.append((user_id, guild_id, role.id, role.name, xp))
+                streak_xp += xp
+            # Members keep the streak role they gained last
+            roles.add(role)
+
+        custom_role_xp, auto_role_xp = role_table.score({role.id for role in roles})
+        total_xp = base_xp + custom_role_xp + auto_role_xp + streak_xp
+        if total_xp:
+            level = calculate_level(total_xp)
+            roles.add(level_roles[level])
+            seeded.user_rows.append((guild_id, user_id, base_xp, level))
+        guild.add_member(FakeMember(user_id, guild, roles))
+
+    for i in range(int(size * DEPARTED_SHARE)):
+        seeded.user_rows.append((guild_id, guild_id * 1_000_000 + size + i, 50 * rng.randint(1, 20), 1))
+    return seeded
+
+
+def write_rows(connection, seeded: SeededGuild):
+    """Insert a seeded guild's XP and streak rows in one transaction (runs on the DB thread)"""
+    connection.execute('BEGIN')
+    connection.executemany('INSERT INTO users (guild_id, user_id, xp, level) VALUES (?, ?, ?, ?)', seeded.user_rows)
+    connection.executemany('INSERT INTO streak_role_gains (user_id, guild_id, role_id, role_name, xp_awarded) VALUES (?, ?, ?, ?, ?)',
+                           seeded.gain_rows)
+    connection.execute('''
+        INSERT INTO streak_xp_totals (guild_id, user_id, streak_xp)
+        SELECT guild_id, user_id, SUM(xp_awarded) FROM streak_role_gains WHERE guild_id = ?
+        GROUP BY guild_id, user_id
+    ''', (seeded.guild.id,))
+    connection.execute('COMMIT')
@@ -1,17 +1,57 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
-import sqlite3
 import asyncio
-from typing import Optional, Dict, List
+from typing import Optional, Dict
 import json
-import requests
+import time
 import os
-import webserver
+import signal
+import logging
+from database import Database
+from migrations import apply_migrations
+from xp_cache import MemberXP, TotalXPCache
+from role_xp import RoleXPTable
+from leaderboard_index import LeaderboardIndex
+from level_roles import LevelRoleReconciler
+from outbound import OutboundScheduler, QUEST, NOTIFICATION
+from notifications import RoleGain, RoleGainDigest, MAX_DIGEST_WINDOW
+from quest_index import ActiveQuestIndex
+from quest_views import QuestCompleteView
+from command_sync import command_fingerprint
+from members import MemberDirectory
+from loop_monitor import LoopLagMonitor
+from webserver import WebServer
+from logging_setup import setup_logging
+from metrics import REGISTRY, CONTENT_TYPE, timed
+from aiohttp import web
 
 # Bot configuration
 TOKEN = None  # Set this through environment variables
 PREFIX = '-'
+# Set to a guild ID to sync slash commands to that guild only (instant updates for staging)
+SYNC_GUILD_ID = os.getenv('SYNC_GUILD_ID')
+# Opt-in: keep only names and XP-relevant role IDs per member instead of full Member objects
+LEAN_MEMBER_CACHE = os.getenv('LEAN_MEMBER_CACHE', '').lower() in ('1', 'true', 'yes')
+# Opt-in: serve commands as slash commands only and stop receiving guild messages altogether
+SLASH_ONLY = os.getenv('SLASH_ONLY', '').lower() in ('1', 'true', 'yes')
+# In slash-only mode, guilds that keep the - prefix commands (comma separated IDs). Setting any
+# brings the message intents back for the whole bot, as Discord can't enable them per guild.
+PREFIX_GUILD_IDS = {int(guild_id) for guild_id in os.getenv('PREFIX_GUILD_IDS', '').split(',') if guild_id.strip()}
+
+# Guilds prepared (level roles checked, members chunked) at once during startup
+STARTUP_CONCURRENCY = 5
+
+# Seconds between sweeps for user rows left at the defaults (0 XP, Level 1) - startup sweeps too
+EMPTY_USER_CLEANUP_INTERVAL = 24 * 60 * 60
+
+# Times a member's XP is reloaded when writes keep racing the load, before it's returned uncached
+XP_LOAD_ATTEMPTS = 3
+
+# /readyz fails while the event loop is running this many seconds behind
+LOOP_LAG_THRESHOLD = 0.25
+# Event loop steps running longer than this many seconds are recorded for /botdiag
+SLOW_CALLBACK_THRESHOLD = float(os.getenv('SLOW_CALLBACK_THRESHOLD', '0.1'))
 
 # XP Level thresholds
 LEVEL_THRESHOLDS = {
@@ -27,29 +67,139 @@ LEVEL_THRESHOLDS = {
     10: 11700
 }
 
+# JSON log lines written by a background thread (LOG_LEVEL / LOG_LEVELS pick what is written)
+log_listener = setup_logging()
+log = logging.getLogger("questbot")
+# Per-member XP scoring detail, silent unless questbot.xp is set to DEBUG
+xp_log = logging.getLogger("questbot.xp")
+
+# Metrics served on /metrics
+EVENT_SECONDS = REGISTRY.histogram("questbot_event_seconds", "Gateway event handler run time", ["event"])
+COMMAND_SECONDS = REGISTRY.histogram("questbot_command_seconds", "Prefix and slash command run time", ["command", "kind", "outcome"])
+DB_SECONDS = REGISTRY.histogram("questbot_db_method_seconds", "QuestBot database method run time", ["method"])
+XP_AWARDED = REGISTRY.counter("questbot_xp_awarded_total", "XP awarded by source", ["source"])
+QUESTS_COMPLETED = REGISTRY.counter("questbot_quests_completed_total", "Quest completions recorded")
+LEVEL_CHANGES = REGISTRY.counter("questbot_level_changes_total", "Stored level changes")
+
+def timed_event(handler):
+    """Record an event handler's run time (goes below @bot.event)"""
+    return timed(EVENT_SECONDS, handler.__name__)(handler)
+
+def timed_db(method):
+    """Record a QuestBot database method's run time"""
+    return timed(DB_SECONDS, method.__name__)(method)
+
+class QuestCommandTree(app_commands.CommandTree):
+    """Times slash commands (including the slash side of hybrid commands)"""
+    
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras['started'] = time.perf_counter()
+        return True
+    
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        observe_slash_command(interaction, interaction.command, "error")
+        await super().on_error(interaction, error)
+
+def observe_slash_command(interaction: discord.Interaction, command, outcome: str):
+    started = interaction.extras.pop('started', None)
+    if started is not None and command is not None:
+        COMMAND_SECONDS.observe(time.perf_counter() - started, command.qualified_name, "slash", outcome)
+
 # Bot setup - With message content intent for full functionality
 # NOTE: Requires "Message Content Intent" enabled in Discord Developer Portal
+# Prefix commands are the only reason to receive guild messages - slash-only mode drops both intents
+PREFIX_COMMANDS = not SLASH_ONLY or bool(PREFIX_GUILD_IDS)
 intents = discord.Intents.none()
 intents.guilds = True
-intents.guild_messages = True
+intents.guild_messages = PREFIX_COMMANDS
 intents.guild_reactions = True
-intents.message_content = True  # Privileged intent - enable in Discord Developer Portal
+intents.message_content = PREFIX_COMMANDS  # Privileged intent - enable in Discord Developer Portal
 intents.members = True  # Privileged intent - enable in Discord Developer Portal to read member roles
 
-bot = commands.Bot(command_prefix=PREFIX, intents=intents)
+# Quest completions use raw reaction events, so no message cache is needed.
+# Members are chunked by the startup sequence (a few guilds at a time) rather than before on_ready.
+# Lean mode caches no Member objects at all; member updates are read from the raw gateway events.
+bot = commands.Bot(command_prefix=PREFIX, intents=intents, max_messages=None, chunk_guilds_at_startup=False,
+                   member_cache_flags=discord.MemberCacheFlags.none() if LEAN_MEMBER_CACHE else discord.MemberCacheFlags.from_intents(intents),
+                   enable_debug_events=LEAN_MEMBER_CACHE, tree_cls=QuestCommandTree)
 
 class QuestBot:
     def __init__(self):
-        self.db_connection = None
+        self.db = None
         self.quest_ping_role_id = None
         self.quest_channel_id = None
         self.role_xp_assignments = {}
+        self.xp_cache = TotalXPCache(on_change=self._xp_changed)
+        self.role_tables = {}
+        # Per-guild ranking by total XP, built on first use and kept current by xp_cache changes
+        self.leaderboards = {}
+        self._leaderboard_locks = {}
+        # Every outbound send/delete/role edit goes through here, ordered by priority class
+        self.outbound = OutboundScheduler()
+        # Member role lookups - discord.py's member cache, or compact records in lean mode
+        self.members = MemberDirectory(lean=LEAN_MEMBER_CACHE)
+        # Guilds whose lean member records are being reloaded
+        self._member_reloads = set()
+        # Coalesces level role changes per member into one role edit
+        self.level_roles = LevelRoleReconciler(bot, self.outbound, self.members, self.create_level_roles)
+        # Batches role gain announcements per guild
+        self.notifications = RoleGainDigest(self.outbound)
+        # Guilds with a bulk level role run in progress
+        self.level_role_runs = set()
+        # Active quest message IDs - reactions and button presses on anything else skip the database
+        self.quests = ActiveQuestIndex()
+        # Persistent Complete button view, created once the event loop is running (setup_hook)
+        self.quest_view = None
+        # One-time startup sequence, started by the first on_ready
+        self.startup_task = None
+        # Graceful shutdown started by SIGTERM
+        self.shutdown_task = None
+        # Samples event loop lag and records slow callbacks for the readiness check and /botdiag
+        self.loop_monitor = LoopLagMonitor(slow_threshold=SLOW_CALLBACK_THRESHOLD)
+        # HTTP endpoints, served on the bot's own event loop
+        self.web = WebServer()
+        # Fire-and-forget work (startup, member reloads) - referenced so it isn't collected mid-flight
+        self.background_tasks = set()
         self.init_database()
     
+    def spawn(self, coro) -> asyncio.Task:
+        """Run a coroutine in the background, cancelled by close() if still running"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+    
+    async def close(self):
+        """Post pending role gain digests, then cancel background work and outbound calls"""
+        await self.notifications.close()
+        for task in list(self.background_tasks):
+            task.cancel()
+        self.outbound.close()
+    
     def init_database(self):
         """Initialize SQLite database for storing user XP and quest data"""
-        self.db_connection = sqlite3.connect('quest_bot.db')
-        cursor = self.db_connection.cursor()
+        # All queries run on the Database worker thread so the event loop never blocks on SQLite
+        self.db = Database('quest_bot.db')
+        self.db.run_sync(self._create_schema)
+        # Bring older databases up to the current schema version
+        self.db.run_sync(apply_migrations)
+        
+        # Drop placeholder rows left behind by the old write-on-read get_user_data
+        removed = self.db.run_sync(self._delete_empty_users)
+        if removed:
+            log.info("Removed %d empty user row(s)", removed)
+        
+        self.quests.load(self.db.run_sync(self._load_active_quests))
+        log.info("Loaded %d active quest(s)", len(self.quests))
+    
+    @staticmethod
+    def _load_active_quests(connection):
+        return connection.execute('SELECT message_id, guild_id, title FROM quests').fetchall()
+    
+    @staticmethod
+    def _create_schema(connection):
+        """Create the base tables on the DB thread (runs once at startup) - later changes are migrations"""
+        cursor = connection.cursor()
         
         # Create users table for XP tracking
         cursor.execute('''
@@ -97,58 +247,112 @@ class QuestBot:
             )
         ''')
         
-        self.db_connection.commit()
+        connection.commit()
     
-    def get_user_data(self, user_id: int, guild_id: int):
-        """Get user XP and level data"""
-        if not self.db_connection:
+    @timed_db
+    async def get_user_data(self, user_id: int, guild_id: int):
+        """Get user XP and level data (read-only - unknown users get defaults without a row being created)"""
+        if not self.db:
             return {'xp': 0, 'level': 1}
-        cursor = self.db_connection.cursor()
-        cursor.execute('SELECT xp, level FROM users WHERE user_id = ? AND guild_id = ?', (user_id, guild_id))
-        result = cursor.fetchone()
+        result = await self.db.fetchone('SELECT xp, level FROM users WHERE guild_id = ? AND user_id = ?', (guild_id, user_id))
         if result:
             return {'xp': result[0], 'level': result[1]}
-        else:
-            # Create new user entry
-            cursor.execute('INSERT INTO users (user_id, guild_id, xp, level) VALUES (?, ?, 0, 1)', (user_id, guild_id))
-            self.db_connection.commit()
-            return {'xp': 0, 'level': 1}
+        return {'xp': 0, 'level': 1}
     
-    def update_user_xp(self, user_id: int, guild_id: int, xp_change: int):
-        """Update user base XP and recalculate level based on total XP"""
-        if not self.db_connection:
+    @timed_db
+    async def set_user_level(self, user_id: int, guild_id: int, level: int):
+        """Store a user's current level, creating their row on first change"""
+        if not self.db:
+            return
+        await self.db.execute('''
+            INSERT INTO users (guild_id, user_id, xp, level) VALUES (?, ?, 0, ?)
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET level = excluded.level
+        ''', (guild_id, user_id, level))
+        self.xp_cache.set_level(guild_id, user_id, level)
+        LEVEL_CHANGES.inc()
+    
+    @timed_db
+    async def set_user_levels(self, guild_id: int, levels: Dict[int, int]):
+        """Store levels for many users of one guild in a single write job"""
+        if not self.db:
+            return
+        await self.db.executemany('''
+            INSERT INTO users (guild_id, user_id, xp, level) VALUES (?, ?, 0, ?)
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET level = excluded.level
+        ''', [(guild_id, user_id, level) for user_id, level in levels.items()])
+        for user_id, level in levels.items():
+            self.xp_cache.set_level(guild_id, user_id, level)
+        LEVEL_CHANGES.inc(len(levels))
+    
+    @staticmethod
+    def _add_user_xp(connection, user_id: int, guild_id: int, xp_change: int) -> int:
+        """Atomically apply an XP change (clamped at 0), inserting the row lazily, returns the new base XP"""
+        cursor = connection.execute('UPDATE users SET xp = MAX(0, xp + ?) WHERE guild_id = ? AND user_id = ?',
+                                    (xp_change, guild_id, user_id))
+        if cursor.rowcount == 0:
+            if xp_change <= 0:
+                return 0
+            connection.execute('INSERT INTO users (guild_id, user_id, xp, level) VALUES (?, ?, ?, 1)',
+                               (guild_id, user_id, xp_change))
+        return connection.execute('SELECT xp FROM users WHERE guild_id = ? AND user_id = ?',
+                                  (guild_id, user_id)).fetchone()[0]
+    
+    @timed_db
+    async def cleanup_empty_users(self) -> int:
+        """Delete rows that only hold defaults (0 XP, Level 1), returns rows removed"""
+        if not self.db:
+            return 0
+        return await self.db.write(self._delete_empty_users)
+    
+    async def cleanup_empty_users_periodically(self, interval: float = EMPTY_USER_CLEANUP_INTERVAL):
+        """Keep sweeping empty user rows (e.g. members whose XP was taken back to 0) while the bot runs"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await self.cleanup_empty_users()
+                if removed:
+                    log.info("Removed %d empty user row(s)", removed)
+            except Exception:
+                log.exception("Error removing empty user rows")
+    
+    @staticmethod
+    def _delete_empty_users(connection) -> int:
+        return connection.execute('DELETE FROM users WHERE xp = 0 AND level = 1').rowcount
+    
+    @timed_db
+    async def update_user_xp(self, user_id: int, guild_id: int, xp_change: int, source: str = "manual"):
+        """Update user base XP and recalculate level based on total XP (source labels awarded XP in metrics)"""
+        if not self.db:
             return 0, 1
-        cursor = self.db_connection.cursor()
-        current_data = self.get_user_data(user_id, guild_id)
-        old_level = current_data['level']
-        new_base_xp = max(0, current_data['xp'] + xp_change)
+        if xp_change > 0:
+            XP_AWARDED.inc(xp_change, source)
+        old_level = await self.get_stored_level(user_id, guild_id)
         
-        # Update base XP in database first
-        cursor.execute('UPDATE users SET xp = ? WHERE user_id = ? AND guild_id = ?', 
-                      (new_base_xp, user_id, guild_id))
-        self.db_connection.commit()
+        # Update base XP in database first (skipped when nothing changes)
+        if xp_change:
+            new_base_xp = await self.db.write(self._add_user_xp, user_id, guild_id, xp_change)
+            self.xp_cache.set_base(guild_id, user_id, new_base_xp)
         
         # Calculate level based on TOTAL XP (including roles), not just base XP
-        total_xp = self.calculate_total_user_xp(user_id, guild_id)
+        total_xp = await self.calculate_total_user_xp(user_id, guild_id)
         new_level = self.calculate_level(total_xp)
         
         # Update level in database if changed
         if old_level != new_level:
-            cursor.execute('UPDATE users SET level = ? WHERE user_id = ? AND guild_id = ?', 
-                          (new_level, user_id, guild_id))
-            self.db_connection.commit()
-            asyncio.create_task(self.update_user_level_role(user_id, guild_id, old_level, new_level))
+            await self.set_user_level(user_id, guild_id, new_level)
+            self.level_roles.schedule(guild_id, user_id, new_level)
         
         return total_xp, new_level
     
     async def create_level_roles(self, guild):
         """Create level roles if they don't exist"""
         try:
+            # One pass over the guild's roles instead of a lookup per level
+            existing_names = {role.name for role in guild.roles}
             for level in range(1, 11):
                 role_name = f"Level {level}"
                 # Check if role already exists
-                existing_role = discord.utils.get(guild.roles, name=role_name)
-                if not existing_role:
+                if role_name not in existing_names:
                     # Create role with a color gradient from blue to gold
                     color_value = int(0x0099ff + (0xffd700 - 0x0099ff) * (level - 1) / 9)
                     await guild.create_role(
@@ -156,56 +360,74 @@ class QuestBot:
                         color=discord.Color(color_value),
                         reason=f"Auto-created level role for Level {level}"
                     )
-                    print(f"Created role: {role_name}")
+                    log.info("Created role: %s", role_name, extra={"guild_id": guild.id})
         except discord.Forbidden:
-            print("Bot lacks permission to create roles")
-        except Exception as e:
-            print(f"Error creating level roles: {e}")
+            log.warning("Bot lacks permission to create roles", extra={"guild_id": guild.id})
+        except Exception:
+            log.exception("Error creating level roles", extra={"guild_id": guild.id})
     
-    async def update_user_level_role(self, user_id: int, guild_id: int, old_level: int, new_level: int):
-        """Update user's level role when they level up/down"""
+    async def assign_all_level_roles(self, guild, progress=None):
+        """Bring every member with XP, a stored row or a level role to the right level role, resuming an interrupted run
+
+        Returns (checked, changed) totals for the whole run, or None if a run is already in progress.
+        """
+        if guild.id in self.level_role_runs:
+            return None
+        self.level_role_runs.add(guild.id)
         try:
-            guild = bot.get_guild(guild_id)
-            if not guild:
-                print(f"Guild {guild_id} not found")
-                return
+            index = await self.get_leaderboard_index(guild.id)
+            # Members with a stored row get Level 1 even at 0 XP, as they always have
+            stored_ids = {user_id for (user_id,) in await self.db.fetchall('SELECT user_id FROM users WHERE guild_id = ?', (guild.id,))}
+            desired_levels = {}
+            level_role_ids = {role.id for role in guild.roles if role.name.startswith("Level ")}
+            for user_id, role_ids in self.members.member_roles(guild):
+                total_xp = index.total(user_id)
+                if total_xp > 0 or user_id in stored_ids or role_ids & level_role_ids:
+                    desired_levels[user_id] = self.calculate_level(total_xp)
             
-            member = guild.get_member(user_id)
-            if not member:
-                print(f"Member {user_id} not found in guild {guild_id}")
-                return
-            
-            # Remove ALL existing level roles (not just the old one)
-            removed_roles = []
-            for role in member.roles:
-                if role.name.startswith("Level ") and role.name != f"Level {new_level}":
-                    removed_roles.append(role.name)
-                    await member.remove_roles(role, reason="Level changed - removing old level role")
+            # Keep stored levels in line so later level checks don't fire again
+            stale_levels = {}
+            for user_id, level in desired_levels.items():
+                entry = self.xp_cache.get(guild.id, user_id)
+                if entry and entry.level != level:
+                    stale_levels[user_id] = level
+            if stale_levels:
+                await self.set_user_levels(guild.id, stale_levels)
             
-            # Add new level role
-            new_role_name = f"Level {new_level}"
-            new_role = discord.utils.get(guild.roles, name=new_role_name)
-            if new_role:
-                if new_role not in member.roles:
-                    await member.add_roles(new_role, reason=f"Reached {new_role_name}")
-                    print(f"✅ {member.display_name}: Removed {removed_roles} → Added {new_role_name}")
-                else:
-                    print(f"ℹ️ {member.display_name}: Already has {new_role_name}, removed {removed_roles}")
+            job = await self.db.fetchone('SELECT last_user_id, checked, changed FROM level_role_jobs WHERE guild_id = ?', (guild.id,))
+            if job:
+                start_after, checked_before, changed_before = job
+                log.info("Resuming level role assignment for %s after user %s", guild.name, start_after, extra={"guild_id": guild.id})
             else:
-                # Create the role if it doesn't exist
-                print(f"Creating missing level roles...")
-                await self.create_level_roles(guild)
-                new_role = discord.utils.get(guild.roles, name=new_role_name)
-                if new_role:
-                    await member.add_roles(new_role, reason=f"Reached {new_role_name}")
-                    print(f"✅ {member.display_name}: Created and added {new_role_name}")
-                else:
-                    print(f"❌ Failed to create {new_role_name}")
-        except discord.Forbidden as e:
-            print(f"❌ Bot lacks permission to manage roles: {e}")
-            print(f"   Make sure bot role is higher than Level roles in server settings!")
-        except Exception as e:
-            print(f"❌ Error updating user level role: {e}")
+                start_after, checked_before, changed_before = 0, 0, 0
+                await self.db.execute('INSERT INTO level_role_jobs (guild_id) VALUES (?)', (guild.id,))
+            
+            async def checkpoint(last_user_id, checked, changed):
+                await self.db.execute('UPDATE level_role_jobs SET last_user_id = ?, checked = ?, changed = ? WHERE guild_id = ?',
+                                      (last_user_id, checked_before + checked, changed_before + changed, guild.id))
+            
+            async def report(checked, total, changed):
+                if progress:
+                    await progress(checked_before + checked, checked_before + total, changed_before + changed)
+            
+            checked, changed = await self.level_roles.reconcile_members(
+                guild, desired_levels, start_after, checkpoint=checkpoint, progress=report)
+            await self.db.execute('DELETE FROM level_role_jobs WHERE guild_id = ?', (guild.id,))
+            return checked_before + checked, changed_before + changed
+        finally:
+            self.level_role_runs.discard(guild.id)
+    
+    async def resume_level_role_runs(self):
+        """Finish bulk level role runs that were interrupted by a restart"""
+        if not self.db:
+            return
+        for (guild_id,) in await self.db.fetchall('SELECT guild_id FROM level_role_jobs'):
+            guild = bot.get_guild(guild_id)
+            if not guild:
+                continue
+            result = await self.assign_all_level_roles(guild)
+            if result:
+                log.info("Finished resumed level role assignment for %s: %d of %d members updated", guild.name, result[1], result[0], extra={"guild_id": guild.id})
     
     def calculate_level(self, xp: int) -> int:
         """Calculate level based on XP"""
@@ -214,338 +436,772 @@ class QuestBot:
                 return level
         return 1
     
-    def calculate_total_user_xp(self, user_id: int, guild_id: int) -> int:
+    def calculate_role_xp(self, guild_id: int, roles) -> tuple:
+        """Return (custom_role_xp, auto_badge_xp) contributed by a collection of roles"""
+        return self.get_role_table(guild_id).score({role.id for role in roles})
+    
+    async def get_member_xp(self, user_id: int, guild_id: int) -> Optional[MemberXP]:
+        """Get a member's cached XP breakdown, loading it on first use (None if not in the guild)"""
+        entry = self.xp_cache.get(guild_id, user_id)
+        if entry:
+            return entry
+        
+        guild = bot.get_guild(guild_id)
+        for _ in range(XP_LOAD_ATTEMPTS):
+            role_ids = self.members.role_ids(guild, user_id) if guild else None
+            if role_ids is None:
+                return None
+            
+            # A write for this member landing between our reads and the put would be lost
+            # (writes only touch cached entries), so end_load refuses the entry if one did
+            token = self.xp_cache.begin_load(guild_id, user_id)
+            entry = None
+            try:
+                user_data = await self.get_user_data(user_id, guild_id)
+                streak_xp = await self.get_accumulated_streak_xp(user_id, guild_id)
+                custom_role_xp, auto_role_xp = self.get_role_table(guild_id).score(role_ids)
+                entry = MemberXP(user_data['xp'], custom_role_xp, auto_role_xp, streak_xp, user_data['level'])
+            finally:
+                cached = self.xp_cache.end_load(guild_id, user_id, token, entry)
+            if cached:
+                # Per-member detail - only written with questbot.xp at DEBUG, and sampled even then
+                xp_log.debug("Loaded XP for user %s", user_id, extra={"guild_id": guild_id, "user_id": user_id, "auto_badge_xp": cached.badge, "streak_xp": cached.streak})
+                return cached
+        
+        # Writes kept landing mid-load - answer with the latest read without caching it
+        return entry
+    
+    async def get_stored_level(self, user_id: int, guild_id: int) -> int:
+        """Get the level last stored for a user (from the cache when possible)"""
+        entry = self.xp_cache.get(guild_id, user_id)
+        if entry:
+            return entry.level
+        user_data = await self.get_user_data(user_id, guild_id)
+        return user_data['level']
+    
+    async def calculate_total_user_xp(self, user_id: int, guild_id: int) -> int:
         """Calculate total XP including quest XP + role-based XP"""
         try:
-            guild = bot.get_guild(guild_id)
-            if not guild:
-                print(f"Guild {guild_id} not found")
-                user_data = self.get_user_data(user_id, guild_id)
-                return user_data.get('xp', 0)
-            
-            member = guild.get_member(user_id)
-            if not member:
-                print(f"Member {user_id} not found in guild {guild_id}")
-                user_data = self.get_user_data(user_id, guild_id)
-                return user_data.get('xp', 0)
-            
-            # Get base XP from database (quest completions and manual additions)
-            user_data = self.get_user_data(user_id, guild_id)
-            base_xp = user_data.get('xp', 0)
-            
-            # Add XP from custom assigned roles (excluding streak roles which use accumulated system)
-            custom_role_xp = 0
-            for role in member.roles:
-                # Skip level roles - they don't contribute to XP calculation to avoid circular dependency
-                if role.name.startswith("Level "):
-                    continue
-                    
-                role_xp_data = self.get_role_xp_and_type(guild_id, str(role.id))
-                if role_xp_data:
-                    xp_amount, role_type = role_xp_data
-                    # Skip streak roles since they now use accumulated XP system
-                    if role_type != "streak":
-                        custom_role_xp += xp_amount
-            
-            # Add XP from accumulated streak roles (historical gains)
-            accumulated_streak_xp = self.get_accumulated_streak_xp(user_id, guild_id)
-            
-            # Add XP from current badge roles (only for unassigned roles that have "badge" in name)
-            auto_role_xp = 0
-            badge_roles_found = []
-            for role in member.roles:
-                # Skip level roles - they don't contribute to XP calculation
-                if role.name.startswith("Level "):
-                    continue
-                    
-                role_name_lower = role.name.lower()
-                role_id_str = str(role.id)
-                role_xp_data = self.get_role_xp_and_type(guild_id, role_id_str)
-                # Only apply auto-detection fallback if role doesn't have explicit assignment
-                if not role_xp_data:
-                    # Badge roles give 5 XP each (fallback for unassigned roles)
-                    if "badge" in role_name_lower:
-                        auto_role_xp += 5
-                        badge_roles_found.append(role.name)
-                    # Note: Streak roles now use accumulated XP instead of current roles
-            
-            # Calculate total XP - sum of base XP + all role bonuses + accumulated streak XP
-            # NO level role XP to avoid circular dependency in level calculation
-            total_xp = base_xp + custom_role_xp + auto_role_xp + accumulated_streak_xp
-            
-            # Log badge roles found for debugging
-            if badge_roles_found:
-                print(f"Role XP for {member.display_name}: Badge roles: {badge_roles_found}, Auto XP: {auto_role_xp}")
-            if accumulated_streak_xp > 0:
-                print(f"Accumulated Streak XP for {member.display_name}: {accumulated_streak_xp}")
+            entry = await self.get_member_xp(user_id, guild_id)
+            if entry:
+                # NO level role XP to avoid circular dependency in level calculation
+                return entry.total
             
-            return total_xp
+            # Member not cached in the guild - fall back to base XP only
+            xp_log.debug("Member %s not found in guild %s", user_id, guild_id)
+            user_data = await self.get_user_data(user_id, guild_id)
+            return user_data.get('xp', 0)
             
-        except Exception as e:
-            print(f"Error calculating total XP for user {user_id}: {e}")
-            import traceback
-            traceback.print_exc()
+        except Exception:
+            xp_log.exception("Error calculating total XP for user %s", user_id, extra={"guild_id": guild_id})
             # Fall back to database XP
-            user_data = self.get_user_data(user_id, guild_id)
+            user_data = await self.get_user_data(user_id, guild_id)
             return user_data.get('xp', 0)
     
-    def get_leaderboard(self, guild_id: int, limit: int = 10):
+    def refresh_role_xp(self, guild_id: int, role_ids):
+        """Recompile the role table and recompute cached role XP for holders of the given roles"""
+        self.role_tables.pop(guild_id, None)
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            self.invalidate_guild_xp(guild_id)
+            return
+        role_table = self.get_role_table(guild_id)
+        refreshed = set()
+        for role_id in role_ids:
+            for user_id, member_role_ids in self.members.holders(guild, int(role_id)):
+                if user_id in refreshed:
+                    continue
+                refreshed.add(user_id)
+                custom_role_xp, auto_role_xp = role_table.score(member_role_ids)
+                self.xp_cache.set_role_xp(guild_id, user_id, custom_role_xp, auto_role_xp)
+    
+    def refresh_guild_role_xp(self, guild_id: int):
+        """Recompile the role table and recompute role XP for every cached member of a guild"""
+        self.role_tables.pop(guild_id, None)
+        guild = bot.get_guild(guild_id)
+        if not guild:
+            self.invalidate_guild_xp(guild_id)
+            return
+        role_table = self.get_role_table(guild_id)
+        for user_id in list(self.xp_cache.members(guild_id)):
+            role_ids = self.members.role_ids(guild, user_id)
+            if role_ids is None:
+                self.xp_cache.invalidate_member(guild_id, user_id)
+                continue
+            custom_role_xp, auto_role_xp = role_table.score(role_ids)
+            self.xp_cache.set_role_xp(guild_id, user_id, custom_role_xp, auto_role_xp)
+    
+    def _xp_changed(self, guild_id: int, user_id: int, total_xp: int):
+        """xp_cache listener - keeps a built leaderboard index in step with member totals"""
+        index = self.leaderboards.get(guild_id)
+        if index is not None:
+            index.update(user_id, total_xp)
+    
+    def invalidate_guild_xp(self, guild_id: int):
+        """Forget cached XP and the leaderboard index for a guild (rebuilt on next use)"""
+        self.xp_cache.invalidate_guild(guild_id)
+        self.leaderboards.pop(guild_id, None)
+    
+    def member_left(self, guild_id: int, user_id: int):
+        """Drop a departed member's cached XP - they stay ranked by base XP like before"""
+        entry = self.xp_cache.get(guild_id, user_id)
+        self.xp_cache.invalidate_member(guild_id, user_id)
+        index = self.leaderboards.get(guild_id)
+        if index is not None and entry:
+            index.update(user_id, entry.base)
+    
+    async def get_leaderboard_index(self, guild_id: int) -> LeaderboardIndex:
+        """Get the guild's leaderboard index, building it from one bulk load on first use"""
+        index = self.leaderboards.get(guild_id)
+        if index is not None:
+            return index
+        lock = self._leaderboard_locks.setdefault(guild_id, asyncio.Lock())
+        async with lock:
+            index = self.leaderboards.get(guild_id)
+            if index is None:
+                index = await self._build_leaderboard_index(guild_id)
+            return index
+    
+    @timed_db
+    async def _build_leaderboard_index(self, guild_id: int) -> LeaderboardIndex:
+        """Score every member from a single database snapshot and index them"""
+        users, streaks = await self.db.run(self._load_guild_xp_rows, guild_id)
+        # No awaits from here on: writes that land after the snapshot resolve later and
+        # update the cache entries created below, which forwards them to the new index
+        guild = bot.get_guild(guild_id)
+        role_table = self.get_role_table(guild_id)
+        totals = {}
+        if guild:
+            for user_id, role_ids in self.members.member_roles(guild):
+                entry = self.xp_cache.get(guild_id, user_id)
+                if entry is None:
+                    base_xp, level = users.get(user_id, (0, 1))
+                    custom_role_xp, auto_role_xp = role_table.score(role_ids)
+                    entry = MemberXP(base_xp, custom_role_xp, auto_role_xp, streaks.get(user_id, 0), level)
+                    self.xp_cache.put(guild_id, user_id, entry)
+                totals[user_id] = entry.total
+        # Users who left the server keep their base XP on the board
+        for user_id, (base_xp, level) in users.items():
+            if user_id not in totals:
+                totals[user_id] = base_xp
+        index = LeaderboardIndex.from_totals(totals)
+        self.leaderboards[guild_id] = index
+        return index
+    
+    @staticmethod
+    def _load_guild_xp_rows(connection, guild_id: int):
+        """Read base XP/level and streak totals for a whole guild in one DB job"""
+        users = {user_id: (xp, level) for user_id, xp, level in connection.execute(
+            'SELECT user_id, xp, level FROM users WHERE guild_id = ?', (guild_id,))}
+        streaks = dict(connection.execute(
+            'SELECT user_id, streak_xp FROM streak_xp_totals WHERE guild_id = ?', (guild_id,)))
+        return users, streaks
+    
+    async def get_leaderboard(self, guild_id: int, limit: int = 10):
         """Get top users for leaderboard with total XP including roles"""
-        if not self.db_connection:
+        if not self.db:
             return []
-        cursor = self.db_connection.cursor()
-        cursor.execute('SELECT user_id, xp, level FROM users WHERE guild_id = ? ORDER BY xp DESC', (guild_id,))
-        all_users = cursor.fetchall()
-        
-        # Calculate total XP for each user (including role bonuses)
-        users_with_total_xp = []
-        for user_id, base_xp, level in all_users:
-            total_xp = self.calculate_total_user_xp(user_id, guild_id)
-            new_level = self.calculate_level(total_xp)
-            users_with_total_xp.append((user_id, total_xp, new_level))
-        
-        # Sort by total XP and limit results
-        users_with_total_xp.sort(key=lambda x: x[1], reverse=True)
-        return users_with_total_xp[:limit]
-    
-    def save_settings(self, guild_id: int):
+        index = await self.get_leaderboard_index(guild_id)
+        return [(user_id, total_xp, self.calculate_level(total_xp)) for user_id, total_xp in index.top(limit)]
+    
+    async def get_rank(self, user_id: int, guild_id: int):
+        """Get (rank, ranked_member_count) for a user, rank is None if they have no XP"""
+        if not self.db:
+            return None, 0
+        index = await self.get_leaderboard_index(guild_id)
+        return index.rank(user_id), len(index)
+    
+    @timed_db
+    async def save_settings(self, guild_id: int):
         """Save bot settings to database"""
-        if not self.db_connection:
+        if not self.db:
             return
-        cursor = self.db_connection.cursor()
         role_xp_json = json.dumps(self.role_xp_assignments.get(guild_id, {}))
-        cursor.execute('''
+        await self.db.execute('''
             INSERT OR REPLACE INTO settings 
-            (guild_id, quest_ping_role_id, quest_channel_id, role_xp_assignments) 
-            VALUES (?, ?, ?, ?)
-        ''', (guild_id, self.quest_ping_role_id, self.quest_channel_id, role_xp_json))
-        self.db_connection.commit()
+            (guild_id, quest_ping_role_id, quest_channel_id, role_xp_assignments, announcement_channel_id, digest_window) 
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (guild_id, self.quest_ping_role_id, self.quest_channel_id, role_xp_json,
+              self.notifications.channel_ids.get(guild_id), self.notifications.windows.get(guild_id)))
     
-    def load_settings(self, guild_id: int):
+    @timed_db
+    async def load_settings(self, guild_id: int):
         """Load bot settings from database"""
-        if not self.db_connection:
+        if not self.db:
             return
-        cursor = self.db_connection.cursor()
-        cursor.execute('SELECT quest_ping_role_id, quest_channel_id, role_xp_assignments FROM settings WHERE guild_id = ?', (guild_id,))
-        result = cursor.fetchone()
+        result = await self.db.fetchone('SELECT quest_ping_role_id, quest_channel_id, role_xp_assignments, announcement_channel_id, digest_window FROM settings WHERE guild_id = ?', (guild_id,))
         if result:
-            self.quest_ping_role_id = result[0]
-            self.quest_channel_id = result[1]
-            loaded_assignments = json.loads(result[2])
-            
-            # Migrate old format to new format if needed
-            migrated_assignments = {}
-            for role_id, data in loaded_assignments.items():
-                if isinstance(data, int):
-                    # Old format: role_id -> xp_amount
-                    # Migrate to new format: role_id -> {"xp": xp_amount, "type": "badge"}
-                    # Default to "badge" for backward compatibility
-                    migrated_assignments[role_id] = {"xp": data, "type": "badge"}
-                else:
-                    # New format: role_id -> {"xp": xp_amount, "type": "streak"|"badge"}
-                    migrated_assignments[role_id] = data
-            
-            self.role_xp_assignments[guild_id] = migrated_assignments
+            self._apply_settings(guild_id, result)
+    
+    @timed_db
+    async def get_state(self, key: str) -> Optional[str]:
+        """Read a value the bot remembers between runs"""
+        if not self.db:
+            return None
+        result = await self.db.fetchone('SELECT value FROM bot_state WHERE key = ?', (key,))
+        return result[0] if result else None
+    
+    @timed_db
+    async def set_state(self, key: str, value: str):
+        if not self.db:
+            return
+        await self.db.execute('INSERT OR REPLACE INTO bot_state (key, value) VALUES (?, ?)', (key, value))
+    
+    @timed_db
+    async def load_all_settings(self, guild_ids):
+        """Load settings for many guilds with a single query (applied in the given guild order)"""
+        if not self.db:
+            return
+        rows = await self.db.fetchall('SELECT guild_id, quest_ping_role_id, quest_channel_id, role_xp_assignments, announcement_channel_id, digest_window FROM settings')
+        settings_by_guild = {row[0]: row[1:] for row in rows}
+        for guild_id in guild_ids:
+            if guild_id in settings_by_guild:
+                self._apply_settings(guild_id, settings_by_guild[guild_id])
+    
+    def _apply_settings(self, guild_id: int, result):
+        """Apply one settings row (quest_ping_role_id, quest_channel_id, role_xp_assignments, announcement_channel_id, digest_window)"""
+        self.quest_ping_role_id = result[0]
+        self.quest_channel_id = result[1]
+        self.notifications.configure(guild_id, result[3], result[4])
+        loaded_assignments = json.loads(result[2])
+        
+        # Migrate old format to new format if needed
+        migrated_assignments = {}
+        for role_id, data in loaded_assignments.items():
+            if isinstance(data, int):
+                # Old format: role_id -> xp_amount
+                # Migrate to new format: role_id -> {"xp": xp_amount, "type": "badge"}
+                # Default to "badge" for backward compatibility
+                migrated_assignments[role_id] = {"xp": data, "type": "badge"}
+            else:
+                # New format: role_id -> {"xp": xp_amount, "type": "streak"|"badge"}
+                migrated_assignments[role_id] = data
+        
+        self.role_xp_assignments[guild_id] = migrated_assignments
+        # Role values may have changed since the table was compiled and entries were cached
+        self.role_tables.pop(guild_id, None)
+        self.invalidate_guild_xp(guild_id)
     
-    def record_streak_role_gain(self, user_id: int, guild_id: int, role_id: int, role_name: str, xp_awarded: int):
+    @timed_db
+    async def record_streak_role_gain(self, user_id: int, guild_id: int, role_id: int, role_name: str, xp_awarded: int):
         """Record when a user gains a streak role for accumulation tracking"""
-        if not self.db_connection:
+        if not self.db:
             return
-        cursor = self.db_connection.cursor()
-        cursor.execute('''
+        streak_xp = await self.db.write(self._insert_streak_role_gain, user_id, guild_id, role_id, role_name, xp_awarded)
+        self.xp_cache.set_streak(guild_id, user_id, streak_xp)
+        xp_log.debug("Recorded streak role gain: %s (+%d XP) for user %s", role_name, xp_awarded, user_id, extra={"guild_id": guild_id})
+    
+    @staticmethod
+    def _insert_streak_role_gain(connection, user_id, guild_id, role_id, role_name, xp_awarded) -> int:
+        """Append the gain and bump the user's running total in the same transaction, returns the new total"""
+        connection.execute('''
             INSERT INTO streak_role_gains (user_id, guild_id, role_id, role_name, xp_awarded)
             VALUES (?, ?, ?, ?, ?)
         ''', (user_id, guild_id, role_id, role_name, xp_awarded))
-        self.db_connection.commit()
-        print(f"Recorded streak role gain: {role_name} (+{xp_awarded} XP) for user {user_id}")
-    
-    def get_accumulated_streak_xp(self, user_id: int, guild_id: int) -> int:
+        connection.execute('''
+            INSERT INTO streak_xp_totals (guild_id, user_id, streak_xp) VALUES (?, ?, ?)
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET streak_xp = streak_xp + excluded.streak_xp
+        ''', (guild_id, user_id, xp_awarded))
+        return connection.execute('SELECT streak_xp FROM streak_xp_totals WHERE guild_id = ? AND user_id = ?',
+                                  (guild_id, user_id)).fetchone()[0]
+    
+    @timed_db
+    async def get_accumulated_streak_xp(self, user_id: int, guild_id: int) -> int:
         """Get total accumulated streak XP from all historical role gains"""
-        if not self.db_connection:
+        if not self.db:
             return 0
-        cursor = self.db_connection.cursor()
-        cursor.execute('''
-            SELECT SUM(xp_awarded) FROM streak_role_gains 
-            WHERE user_id = ? AND guild_id = ?
-        ''', (user_id, guild_id))
-        result = cursor.fetchone()
-        return result[0] if result[0] else 0
+        result = await self.db.fetchone('SELECT streak_xp FROM streak_xp_totals WHERE guild_id = ? AND user_id = ?',
+                                        (guild_id, user_id))
+        return result[0] if result else 0
+    
+    @timed_db
+    async def rebuild_streak_xp_totals(self, guild_id: Optional[int] = None) -> int:
+        """Recompute streak_xp_totals from the full streak_role_gains history, returns users rebuilt"""
+        if not self.db:
+            return 0
+        rebuilt_count = await self.db.write(self._rebuild_streak_xp, guild_id)
+        if guild_id is None:
+            self.xp_cache.clear()
+            self.leaderboards.clear()
+        else:
+            self.invalidate_guild_xp(guild_id)
+        return rebuilt_count
+    
+    @staticmethod
+    def _rebuild_streak_xp(connection, guild_id: Optional[int]) -> int:
+        """Replace the totals for one guild (or every guild when guild_id is None)"""
+        if guild_id is None:
+            connection.execute('DELETE FROM streak_xp_totals')
+            cursor = connection.execute('''
+                INSERT INTO streak_xp_totals (guild_id, user_id, streak_xp)
+                SELECT guild_id, user_id, COALESCE(SUM(xp_awarded), 0) FROM streak_role_gains
+                WHERE user_id IS NOT NULL AND guild_id IS NOT NULL
+                GROUP BY guild_id, user_id
+            ''')
+        else:
+            connection.execute('DELETE FROM streak_xp_totals WHERE guild_id = ?', (guild_id,))
+            cursor = connection.execute('''
+                INSERT INTO streak_xp_totals (guild_id, user_id, streak_xp)
+                SELECT guild_id, user_id, COALESCE(SUM(xp_awarded), 0) FROM streak_role_gains
+                WHERE guild_id = ? AND user_id IS NOT NULL
+                GROUP BY guild_id, user_id
+            ''', (guild_id,))
+        return cursor.rowcount
+    
+    @timed_db
+    async def add_quest(self, message_id: int, guild_id: int, channel_id: int, title: str, content: str):
+        """Save a newly posted quest"""
+        if not self.db:
+            return
+        await self.db.execute('INSERT INTO quests (message_id, guild_id, channel_id, title, content) VALUES (?, ?, ?, ?, ?)',
+                              (message_id, guild_id, channel_id, title, content))
+        self.quests.add(message_id, guild_id, title)
+    
+    @timed_db
+    async def remove_quest(self, message_id: int):
+        """Delete a quest by message ID"""
+        if not self.db:
+            return
+        await self.db.write(self._delete_quests, 'message_id', message_id)
+        self.quests.remove(message_id)
+    
+    def get_quest_title(self, message_id: int):
+        """Get the title of a quest message, or None if the message is not a quest"""
+        return self.quests.title(message_id)
+    
+    @timed_db
+    async def complete_quest(self, message_id: int, user_id: int) -> bool:
+        """Record a quest completion, returns False if the user had already completed it"""
+        if not self.db:
+            return False
+        # The unique (message_id, user_id) index makes this a single atomic index probe
+        inserted = await self.db.execute('INSERT OR IGNORE INTO quest_completions (message_id, user_id) VALUES (?, ?)',
+                                         (message_id, user_id))
+        return inserted == 1
+    
+    @timed_db
+    async def get_guild_quests(self, guild_id: int):
+        """Get (message_id, channel_id, title) for every quest in a guild, ordered by title"""
+        if not self.db:
+            return []
+        return await self.db.fetchall('SELECT message_id, channel_id, title FROM quests WHERE guild_id = ? ORDER BY title', (guild_id,))
+    
+    @timed_db
+    async def delete_guild_quests(self, guild_id: int):
+        """Delete every quest in a guild"""
+        if not self.db:
+            return
+        await self.db.write(self._delete_quests, 'guild_id', guild_id)
+        self.quests.remove_guild(guild_id)
+    
+    @staticmethod
+    def _delete_quests(connection, column: str, value: int):
+        """Delete quests matching message_id or guild_id together with their completions"""
+        connection.execute(f'DELETE FROM quest_completions WHERE message_id IN (SELECT message_id FROM quests WHERE {column} = ?)', (value,))
+        connection.execute(f'DELETE FROM quests WHERE {column} = ?', (value,))
+    
+    def get_role_table(self, guild_id: int) -> RoleXPTable:
+        """Get the compiled role XP table for a guild, compiling it on first use"""
+        table = self.role_tables.get(guild_id)
+        if table is None:
+            guild = bot.get_guild(guild_id)
+            table = RoleXPTable(self.role_xp_assignments.get(guild_id, {}), guild.roles if guild else [])
+            self.role_tables[guild_id] = table
+            if guild and self.members.needs_reload(guild_id, table.relevant):
+                self._reload_members(guild)
+        return table
+    
+    def _reload_members(self, guild):
+        """Lean mode: load a guild's members again after new roles became XP-relevant"""
+        if guild.id in self._member_reloads:
+            return
+        self._member_reloads.add(guild.id)
+        
+        async def reload():
+            try:
+                await self.members.load(guild, self.get_role_table(guild.id).relevant)
+                self.invalidate_guild_xp(guild.id)
+                log.info("Reloaded lean member records for %s", guild.name, extra={"guild_id": guild.id})
+            except Exception as e:
+                log.warning("Failed to reload members for %s: %s", guild.name, e, extra={"guild_id": guild.id})
+            finally:
+                self._member_reloads.discard(guild.id)
+        self.spawn(reload())
     
     def get_role_xp_and_type(self, guild_id: int, role_id: str):
         """Get XP amount and type for a role, returns (xp, type) or None if not assigned"""
-        if guild_id not in self.role_xp_assignments:
-            return None
-        role_data = self.role_xp_assignments[guild_id].get(role_id)
-        if role_data:
-            return role_data["xp"], role_data["type"]
-        return None
+        return self.get_role_table(guild_id).lookup(int(role_id))
     
     def assign_role_xp(self, guild_id: int, role_id: str, xp_amount: int, role_type: str):
         """Assign XP and type to a role"""
         if guild_id not in self.role_xp_assignments:
             self.role_xp_assignments[guild_id] = {}
         self.role_xp_assignments[guild_id][role_id] = {"xp": xp_amount, "type": role_type}
+        self.refresh_role_xp(guild_id, [role_id])
 
 quest_bot = QuestBot()
 
+# Sizes read when /metrics is scraped
+REGISTRY.gauge("questbot_xp_cache_entries", "Cached member XP breakdowns", fn=lambda: len(quest_bot.xp_cache))
+REGISTRY.gauge("questbot_role_tables", "Compiled role XP tables", fn=lambda: len(quest_bot.role_tables))
+REGISTRY.gauge("questbot_leaderboard_entries", "Members in built leaderboard indexes", ["guild_id"],
+               fn=lambda: {str(guild_id): len(index) for guild_id, index in quest_bot.leaderboards.items()})
+REGISTRY.gauge("questbot_active_quests", "Active quest messages", fn=lambda: len(quest_bot.quests))
+REGISTRY.counter("questbot_quest_lookups_total", "Quest index lookups by result", ["result"],
+                 fn=lambda: {"hit": quest_bot.quests.hits, "miss": quest_bot.quests.misses})
+REGISTRY.gauge("questbot_lean_members", "Lean member records", fn=lambda: len(quest_bot.members.store) if quest_bot.members.lean else 0)
+REGISTRY.gauge("questbot_cached_members", "Members in discord.py's cache", fn=lambda: sum(len(guild.members) for guild in bot.guilds))
+REGISTRY.gauge("questbot_guilds", "Guilds the bot is in", fn=lambda: len(bot.guilds))
+REGISTRY.gauge("questbot_outbound_queued", "Outbound calls waiting for a slot", fn=lambda: len(quest_bot.outbound))
+REGISTRY.gauge("questbot_outbound_in_flight", "Outbound calls in flight", fn=lambda: quest_bot.outbound.in_flight)
+REGISTRY.gauge("questbot_level_role_pending", "Members with a level role change pending", fn=lambda: len(quest_bot.level_roles))
+REGISTRY.counter("questbot_db_commits_total", "Database group commits", fn=lambda: quest_bot.db.commits)
+REGISTRY.gauge("questbot_asyncio_tasks", "Tasks on the event loop", fn=lambda: len(asyncio.all_tasks()))
+REGISTRY.gauge("questbot_gateway_latency_seconds", "Gateway heartbeat latency", fn=lambda: bot.latency)
+REGISTRY.gauge("questbot_loop_lag_seconds", "Event loop lag at the last sample", fn=lambda: quest_bot.loop_monitor.lag)
+REGISTRY.counter("questbot_slow_callbacks_total", "Event loop steps over the slow callback threshold", fn=lambda: quest_bot.loop_monitor.slow_count)
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.command_started = time.perf_counter()
+
+@bot.after_invoke
+async def observe_prefix_command(ctx):
+    # Hybrid commands run as slash commands are timed by QuestCommandTree instead
+    started = getattr(ctx, 'command_started', None)
+    if started is None or ctx.interaction is not None:
+        return
+    COMMAND_SECONDS.observe(time.perf_counter() - started, ctx.command.qualified_name, "prefix",
+                            "error" if ctx.command_failed else "ok")
+
 @bot.event
-async def on_ready():
-    print(f'{bot.user} has logged in to Discord!')
-    for guild in bot.guilds:
-        quest_bot.load_settings(guild.id)
-        # Create level roles on startup
-        await quest_bot.create_level_roles(guild)
-        # Cache members to improve role reading
-        try:
-            await guild.chunk()
-            print(f"Cached {guild.member_count} members for {guild.name}")
-        except Exception as e:
-            print(f"Failed to cache members for {guild.name}: {e}")
-    # Sync slash commands
+async def on_app_command_completion(interaction, command):
+    observe_slash_command(interaction, command, "ok")
+
+@bot.event
+async def setup_hook():
+    # One persistent view answers the Complete button on every quest message, including
+    # quests posted before a restart
+    quest_bot.quest_view = QuestCompleteView(on_quest_button)
+    bot.add_view(quest_bot.quest_view)
+
+async def prepare_guild(guild, reload: bool = False):
+    """Make sure a guild's level roles exist and its members are cached (reload=True refetches them)"""
+    # Create level roles on startup
+    await quest_bot.create_level_roles(guild)
+    # Cache members to improve role reading
+    if not reload and quest_bot.members.is_loaded(guild):
+        return
     try:
-        synced = await bot.tree.sync()
-        print(f"Synced {len(synced)} slash commands")
+        await quest_bot.members.load(guild, quest_bot.get_role_table(guild.id).relevant)
+        log.info("Cached %s members for %s", guild.member_count, guild.name, extra={"guild_id": guild.id})
     except Exception as e:
-        print(f"Failed to sync slash commands: {e}")
+        log.warning("Failed to cache members for %s: %s", guild.name, e, extra={"guild_id": guild.id})
+    if reload:
+        # Cached XP was scored from roles that may have changed while the members were stale
+        quest_bot.invalidate_guild_xp(guild.id)
+
+async def prepare_guilds(guilds, reload: bool = False):
+    """Prepare guilds concurrently, at most STARTUP_CONCURRENCY at a time"""
+    semaphore = asyncio.Semaphore(STARTUP_CONCURRENCY)
+    
+    async def prepare(guild):
+        async with semaphore:
+            await prepare_guild(guild, reload)
+    
+    await asyncio.gather(*(prepare(guild) for guild in guilds))
+
+async def sync_commands():
+    """Sync slash commands, skipping the rate-limited upload when nothing changed since the last sync"""
+    guild = discord.Object(id=int(SYNC_GUILD_ID)) if SYNC_GUILD_ID else None
+    if guild:
+        bot.tree.copy_global_to(guild=guild)
+    state_key = f"command_fingerprint:{guild.id}" if guild else "command_fingerprint"
+    try:
+        fingerprint = command_fingerprint(bot.tree, bot.application_id, guild)
+        if await quest_bot.get_state(state_key) == fingerprint:
+            log.info("Slash commands unchanged, skipping sync")
+            return
+        synced = await bot.tree.sync(guild=guild)
+        await quest_bot.set_state(state_key, fingerprint)
+        log.info("Synced %d slash commands%s", len(synced), f" to guild {guild.id}" if guild else "")
+    except Exception:
+        log.exception("Failed to sync slash commands")
+
+async def run_startup():
+    """One-time startup: settings in one query, then guilds prepared concurrently (bounded)"""
+    started = time.monotonic()
+    await quest_bot.load_all_settings([guild.id for guild in bot.guilds])
+    await asyncio.gather(sync_commands(), prepare_guilds(bot.guilds))
+    log.info("Prepared %d guild(s) in %.1fs", len(bot.guilds), time.monotonic() - started)
+    # Finish any bulk level role run interrupted by a restart
+    quest_bot.spawn(quest_bot.resume_level_role_runs())
+    quest_bot.spawn(quest_bot.cleanup_empty_users_periodically())
+
+@bot.event
+async def on_ready():
+    log.info("%s has logged in to Discord!", bot.user)
+    # on_ready fires again after every new gateway session (resumed sessions don't fire it).
+    # Settings and the command sync only run once per process, but a new session starts with
+    # empty member caches and no events from while it was down, so guilds are prepared again.
+    if quest_bot.startup_task is None:
+        quest_bot.startup_task = quest_bot.spawn(run_startup())
+    else:
+        quest_bot.spawn(reprepare_guilds())
+
+async def reprepare_guilds():
+    """Reload every guild's members after a new gateway session"""
+    # A session replaced while startup was still running - let it finish first
+    await asyncio.wait([quest_bot.startup_task])
+    started = time.monotonic()
+    await prepare_guilds(bot.guilds, reload=True)
+    log.info("Re-prepared %d guild(s) for the new gateway session in %.1fs", len(bot.guilds), time.monotonic() - started)
 
 @bot.event
-async def on_reaction_add(reaction, user):
-    """Handle quest completion reactions"""
-    if user.bot:
+async def on_guild_join(guild):
+    """Guilds joined after startup get the same preparation"""
+    await quest_bot.load_settings(guild.id)
+    await prepare_guild(guild)
+
+@timed_event
+async def on_quest_button(interaction: discord.Interaction):
+    """Handle the Complete button on a quest - answered privately, nothing is posted in the channel"""
+    title = quest_bot.get_quest_title(interaction.message.id)
+    if not title:
+        await quest_bot.outbound.respond(interaction, "❌ This quest is no longer active.", ephemeral=True)
         return
     
-    # Check if it's a quest completion (✅ emoji)
-    if str(reaction.emoji) == '✅':
-        if not quest_bot.db_connection:
-            return
-        cursor = quest_bot.db_connection.cursor()
-        cursor.execute('SELECT title, completed_users FROM quests WHERE message_id = ?', (reaction.message.id,))
-        quest_data = cursor.fetchone()
+    # Atomically record the completion - False means this user already completed the quest
+    if not await quest_bot.complete_quest(interaction.message.id, interaction.user.id):
+        await quest_bot.outbound.respond(interaction, f"✅ You already completed **{title}**!", ephemeral=True)
+        return
+    
+    # Award 50 XP for quest completion
+    QUESTS_COMPLETED.inc()
+    new_xp, new_level = await quest_bot.update_user_xp(interaction.user.id, interaction.guild_id, 50, source="quest")
+    embed = discord.Embed(
+        title="Quest Completed!",
+        description=f"You completed: **{title}**\n+50 XP (Total: {new_xp} XP, Level {new_level})",
+        color=0x00ff00
+    )
+    await quest_bot.outbound.respond(interaction, embed=embed, ephemeral=True)
+
+def _payload_channel(payload):
+    """Channel a raw reaction happened in, without needing the message cached"""
+    return bot.get_channel(payload.channel_id) or bot.get_partial_messageable(payload.channel_id, guild_id=payload.guild_id)
+
+@bot.event
+@timed_event
+async def on_raw_reaction_add(payload):
+    """Handle ✅ reactions on quests posted before the Complete button (no message cache needed)"""
+    # Check if it's a quest completion (✅ emoji) - payload.member is only set in guilds
+    if str(payload.emoji) != '✅' or payload.member is None or payload.member.bot:
+        return
+    
+    title = quest_bot.get_quest_title(payload.message_id)
+    if not title:
+        return
+    
+    # Atomically record the completion - False means this user already completed the quest
+    if await quest_bot.complete_quest(payload.message_id, payload.user_id):
+        # Award 50 XP for quest completion
+        QUESTS_COMPLETED.inc()
+        new_xp, new_level = await quest_bot.update_user_xp(payload.user_id, payload.guild_id, 50, source="quest")
         
-        if quest_data:
-            title, completed_users_json = quest_data
-            completed_users = json.loads(completed_users_json)
-            
-            if user.id not in completed_users:
-                # Award 50 XP for quest completion
-                new_xp, new_level = quest_bot.update_user_xp(user.id, reaction.message.guild.id, 50)
-                completed_users.append(user.id)
-                
-                # Update quest completion list
-                cursor.execute('UPDATE quests SET completed_users = ? WHERE message_id = ?', 
-                              (json.dumps(completed_users), reaction.message.id))
-                if quest_bot.db_connection:
-                    quest_bot.db_connection.commit()
-                
-                # Send confirmation message
-                embed = discord.Embed(
-                    title="Quest Completed!",
-                    description=f"{user.mention} completed: **{title}**\n+50 XP (Total: {new_xp} XP, Level {new_level})",
-                    color=0x00ff00
-                )
-                await reaction.message.channel.send(embed=embed, delete_after=10)
+        # Send confirmation message
+        embed = discord.Embed(
+            title="Quest Completed!",
+            description=f"{payload.member.mention} completed: **{title}**\n+50 XP (Total: {new_xp} XP, Level {new_level})",
+            color=0x00ff00
+        )
+        await quest_bot.outbound.send(_payload_channel(payload), embed=embed, priority=NOTIFICATION, delete_after=10)
+
+@bot.event
+@timed_event
+async def on_message(message):
+    # Slash-only mode: prefix commands only run in guilds that opted in
+    if SLASH_ONLY and (message.guild is None or message.guild.id not in PREFIX_GUILD_IDS):
+        return
+    await bot.process_commands(message)
+
+@bot.event
+@timed_event
+async def on_raw_reaction_remove(payload):
+    """Put the bot's ✅ back if it gets removed from a quest, so members can still complete it"""
+    # Completions are not revoked when a member removes their own reaction
+    if payload.user_id != bot.user.id or str(payload.emoji) != '✅' or payload.message_id not in quest_bot.quests:
+        return
+    message = _payload_channel(payload).get_partial_message(payload.message_id)
+    try:
+        await quest_bot.outbound.add_reaction(message, '✅')
+    except discord.HTTPException as e:
+        log.warning("Failed to restore quest reaction on %s: %s", payload.message_id, e, extra={"guild_id": payload.guild_id})
 
 async def check_and_update_level_roles(user_id: int, guild_id: int, reason: str = "XP change"):
     """Comprehensive level role check and update function"""
     try:
         # Get current level in database
-        current_data = quest_bot.get_user_data(user_id, guild_id)
-        old_level = current_data['level']
+        old_level = await quest_bot.get_stored_level(user_id, guild_id)
         
         # Calculate actual total XP and new level
-        current_total_xp = quest_bot.calculate_total_user_xp(user_id, guild_id)
+        current_total_xp = await quest_bot.calculate_total_user_xp(user_id, guild_id)
         new_level = quest_bot.calculate_level(current_total_xp)
         
         # Update level in database if changed and trigger level role assignment
         if old_level != new_level:
-            cursor = quest_bot.db_connection.cursor()
-            cursor.execute('UPDATE users SET level = ? WHERE user_id = ? AND guild_id = ?', 
-                          (new_level, user_id, guild_id))
-            quest_bot.db_connection.commit()
-            asyncio.create_task(quest_bot.update_user_level_role(user_id, guild_id, old_level, new_level))
+            await quest_bot.set_user_level(user_id, guild_id, new_level)
+            quest_bot.level_roles.schedule(guild_id, user_id, new_level)
             return old_level, new_level, current_total_xp
         
         return old_level, old_level, current_total_xp
-    except Exception as e:
-        print(f"Error in check_and_update_level_roles: {e}")
+    except Exception:
+        log.exception("Error in check_and_update_level_roles", extra={"guild_id": guild_id, "user_id": user_id})
         return 1, 1, 0
 
 @bot.event
+@timed_event
 async def on_member_update(before, after):
     """Handle role changes for automatic XP assignment"""
-    guild_id = after.guild.id
+    # The bot's own roles decide where it can post notifications
+    if after.id == bot.user.id and before.roles != after.roles:
+        quest_bot.notifications.invalidate(after.guild.id)
+    
+    await handle_role_changes(after.guild, after.id, after.mention,
+                              {role.id for role in before.roles}, {role.id for role in after.roles})
+
+@timed_event
+async def on_socket_raw_receive(msg):
+    """Lean member cache: GUILD_MEMBER_UPDATE for uncached members never reaches on_member_update"""
+    # This runs for every gateway frame, so check the event type before parsing. Gateway JSON is
+    # compact and quotes inside strings are escaped, so only the frame's own "t" can match.
+    if '"t":"GUILD_MEMBER_UPDATE"' not in msg:
+        return
+    data = json.loads(msg)['d']
+    guild = bot.get_guild(int(data['guild_id']))
+    if not guild or not quest_bot.members.store.is_loaded(guild.id):
+        return
+    user = data['user']
+    user_id = int(user['id'])
+    if user_id == bot.user.id:
+        # guild.me is always cached, so the bot's own updates go through on_member_update
+        return
+    name = user['username']
+    display_name = data.get('nick') or user.get('global_name') or name
+    role_ids = {int(role_id) for role_id in data.get('roles', [])}
+    previous = quest_bot.members.store.update(guild.id, user_id, name, display_name, role_ids)
+    if previous is None:
+        # Nothing to diff against - treating every role as new would award them all again
+        return
+    after_ids = set(quest_bot.members.store.get(guild.id, user_id).role_ids)
+    await handle_role_changes(guild, user_id, f"<@{user_id}>", set(previous.role_ids), after_ids)
+
+if LEAN_MEMBER_CACHE:
+    # Raw frames are only dispatched with enable_debug_events, which lean mode turns on
+    bot.add_listener(on_socket_raw_receive)
+
+async def handle_role_changes(guild, user_id: int, mention: str, before_role_ids: set, after_role_ids: set):
+    """Award, record and announce XP for a member's role changes (role IDs before and after)"""
+    guild_id = guild.id
     
     # Check for role changes (additions OR removals)
-    added_roles = set(after.roles) - set(before.roles)
-    removed_roles = set(before.roles) - set(after.roles)
+    added_roles = after_role_ids - before_role_ids
+    removed_roles = before_role_ids - after_role_ids
+    
+    role_table = quest_bot.get_role_table(guild_id)
+    if not any(role_table.is_xp_role(role_id) for role_id in added_roles | removed_roles):
+        return
+    
+    # Keep the cached role XP in step with the new role set before any level checks
+    custom_role_xp, auto_role_xp = role_table.score(after_role_ids)
+    quest_bot.xp_cache.set_role_xp(guild_id, user_id, custom_role_xp, auto_role_xp)
     
     # Handle specific role additions
-    for role in added_roles:
-        role_xp_data = quest_bot.get_role_xp_and_type(guild_id, str(role.id))
+    for role_id in added_roles:
+        role = guild.get_role(role_id)
+        role_name = role.name if role else str(role_id)
+        role_xp_data = role_table.lookup(role_id)
         if role_xp_data:
             xp_reward, role_type = role_xp_data
+            XP_AWARDED.inc(xp_reward, role_type)
             
             # Handle streak roles differently - accumulate each time they're gained
             if role_type == "streak":
-                quest_bot.record_streak_role_gain(after.id, guild_id, role.id, role.name, xp_reward)
+                await quest_bot.record_streak_role_gain(user_id, guild_id, role_id, role_name, xp_reward)
                 
                 # Check for level changes after streak accumulation
-                old_level, new_level, total_xp = await check_and_update_level_roles(after.id, guild_id, "streak role gain")
-                level_text = f" → Level {new_level}!" if old_level != new_level else ""
-                
-                # Send notification for streak role gain
-                embed = discord.Embed(
-                    title="🔥 Streak Role Gained!",
-                    description=f"{after.mention} gained **{role.name}** role!\n+{xp_reward} Streak XP accumulated (Total: {total_xp} XP){level_text}",
-                    color=0xff6600
-                )
+                old_level, new_level, total_xp = await check_and_update_level_roles(user_id, guild_id, "streak role gain")
             else:
                 # Check for level changes after badge role gain
-                old_level, new_level, total_xp = await check_and_update_level_roles(after.id, guild_id, "badge role gain")
-                level_text = f" → Level {new_level}!" if old_level != new_level else ""
-                
-                # Send notification for badge role gain
-                embed = discord.Embed(
-                    title="🏅 Role Gained!",
-                    description=f"{after.mention} gained **{role.name}** role!\n+{xp_reward} XP (Total: {total_xp} XP){level_text}",
-                    color=0x0099ff
-                )
+                old_level, new_level, total_xp = await check_and_update_level_roles(user_id, guild_id, "badge role gain")
             
-            # Try to send to general channel or first available channel
-            for channel in after.guild.text_channels:
-                if hasattr(channel, 'send') and channel.permissions_for(after.guild.me).send_messages:
-                    await channel.send(embed=embed, delete_after=15)
-                    break
-        elif "badge" in role.name.lower():
+            # Announced in the guild's next role gain digest
+            quest_bot.notifications.add(guild, RoleGain(mention, role_name, xp_reward, role_type == "streak",
+                                                        total_xp, new_level if old_level != new_level else None))
+        elif role_id in role_table.auto_badges:
             # Handle unassigned badge roles (fallback +5 XP)
-            old_level, new_level, total_xp = await check_and_update_level_roles(after.id, guild_id, "badge role gain")
-            level_text = f" → Level {new_level}!" if old_level != new_level else ""
-            
-            embed = discord.Embed(
-                title="🏅 Role Gained!",
-                description=f"{after.mention} gained **{role.name}** role!\n+5 XP (Total: {total_xp} XP){level_text}",
-                color=0x0099ff
-            )
-            
-            # Try to send to general channel or first available channel
-            for channel in after.guild.text_channels:
-                if hasattr(channel, 'send') and channel.permissions_for(after.guild.me).send_messages:
-                    await channel.send(embed=embed, delete_after=15)
-                    break
+            XP_AWARDED.inc(5, "badge")
+            old_level, new_level, total_xp = await check_and_update_level_roles(user_id, guild_id, "badge role gain")
+            quest_bot.notifications.add(guild, RoleGain(mention, role_name, 5, False,
+                                                        total_xp, new_level if old_level != new_level else None))
     
     # Check for level changes after any role removals (could lower total XP)
-    if removed_roles:
-        # Check if any removed roles had XP impact
-        has_xp_impact = False
-        for role in removed_roles:
-            role_xp_data = quest_bot.get_role_xp_and_type(guild_id, str(role.id))
-            if role_xp_data or "badge" in role.name.lower():
-                has_xp_impact = True
-                break
-        
-        if has_xp_impact:
-            old_level, new_level, total_xp = await check_and_update_level_roles(after.id, guild_id, "role removal")
-            # Note: We don't send notifications for role removals as they might be sensitive
+    if any(role_table.is_xp_role(role_id) for role_id in removed_roles):
+        await check_and_update_level_roles(user_id, guild_id, "role removal")
+        # Note: We don't send notifications for role removals as they might be sensitive
+
+@bot.event
+async def on_guild_role_create(role):
+    """New roles can be auto-detected badge roles"""
+    quest_bot.role_tables.pop(role.guild.id, None)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    """Renaming a role can turn badge auto-detection on or off"""
+    if before.name != after.name:
+        quest_bot.refresh_role_xp(after.guild.id, [after.id])
+    if before.permissions != after.permissions:
+        quest_bot.notifications.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    """Deleted roles stop counting for every member who held them"""
+    quest_bot.refresh_guild_role_xp(role.guild.id)
+    quest_bot.notifications.invalidate(role.guild.id)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    """Permission overwrite changes can open or close the notification channel"""
+    if before.overwrites != after.overwrites or before.category_id != after.category_id:
+        quest_bot.notifications.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    """The cached notification channel may be gone"""
+    quest_bot.notifications.invalidate(channel.guild.id)
+
+@bot.event
+@timed_event
+async def on_member_join(member):
+    """Lean member cache: start a record for the new member"""
+    if quest_bot.members.lean:
+        quest_bot.members.store.update(member.guild.id, member.id, member.name, member.display_name,
+                                       (role.id for role in member.roles))
+
+@bot.event
+@timed_event
+async def on_raw_member_remove(payload):
+    """Drop cached XP for members who leave (raw, so it also fires for uncached members)"""
+    if quest_bot.members.lean:
+        quest_bot.members.store.remove(payload.guild_id, payload.user.id)
+    quest_bot.member_left(payload.guild_id, payload.user.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    """Drop a guild's member records and cached XP when the bot leaves it"""
+    if quest_bot.members.lean:
+        quest_bot.members.store.remove_guild(guild.id)
+    quest_bot.invalidate_guild_xp(guild.id)
+    quest_bot.notifications.invalidate(guild.id)
 
 @bot.command(name='addquest')
 @commands.has_any_role('staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN')
@@ -557,22 +1213,19 @@ async def add_quest(ctx, title: str, *, content: str):
         color=0xff9900
     )
     embed.add_field(name="Reward", value="50 XP", inline=True)
-    embed.add_field(name="Complete", value="React with ✅", inline=True)
-    embed.set_footer(text="React with ✅ to mark this quest as complete!")
+    embed.add_field(name="Complete", value="Press ✅ Complete", inline=True)
+    embed.set_footer(text="Press the ✅ Complete button to mark this quest as complete!")
     
     # Send to quest channel if set, otherwise current channel
     channel_id = quest_bot.quest_channel_id
     if channel_id:
         channel = bot.get_channel(channel_id)
         if channel:
-            quest_message = await channel.send(embed=embed)
+            quest_message = await quest_bot.outbound.send(channel, embed=embed, view=quest_bot.quest_view, priority=QUEST)
         else:
-            quest_message = await ctx.send(embed=embed)
+            quest_message = await quest_bot.outbound.send(ctx, embed=embed, view=quest_bot.quest_view, priority=QUEST)
     else:
-        quest_message = await ctx.send(embed=embed)
-    
-    # Add checkmark reaction
-    await quest_message.add_reaction('✅')
+        quest_message = await quest_bot.outbound.send(ctx, embed=embed, view=quest_bot.quest_view, priority=QUEST)
     
     # Ping quest role - first check manual setting, then auto-find @Quests role
     quest_role = None
@@ -584,18 +1237,14 @@ async def add_quest(ctx, title: str, *, content: str):
         quest_role = discord.utils.get(ctx.guild.roles, name="Quests")
     
     if quest_role:
-        ping_msg = await quest_message.channel.send(f"{quest_role.mention} New quest available!")
+        ping_msg = await quest_bot.outbound.send(quest_message.channel, f"{quest_role.mention} New quest available!", priority=QUEST)
         await asyncio.sleep(2)
-        await ping_msg.delete()
+        await quest_bot.outbound.delete(ping_msg, QUEST)
     
     # Save quest to database
-    if quest_bot.db_connection:
-        cursor = quest_bot.db_connection.cursor()
-        cursor.execute('INSERT INTO quests (message_id, guild_id, channel_id, title, content) VALUES (?, ?, ?, ?, ?)',
-                      (quest_message.id, ctx.guild.id, quest_message.channel.id, title, content))
-        quest_bot.db_connection.commit()
+    await quest_bot.add_quest(quest_message.id, ctx.guild.id, quest_message.channel.id, title, content)
     
-    await ctx.message.delete()
+    await quest_bot.outbound.delete(ctx.message, QUEST)
 
 @bot.command(name='removequest')
 @commands.has_any_role('staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN')
@@ -603,21 +1252,18 @@ async def remove_quest(ctx, message_id: int):
     """Remove a quest by message ID"""
     try:
         # Remove from database
-        if quest_bot.db_connection:
-            cursor = quest_bot.db_connection.cursor()
-            cursor.execute('DELETE FROM quests WHERE message_id = ?', (message_id,))
-            quest_bot.db_connection.commit()
+        await quest_bot.remove_quest(message_id)
         
         # Try to delete the message
         try:
             message = await ctx.fetch_message(message_id)
-            await message.delete()
+            await quest_bot.outbound.delete(message, QUEST)
         except:
             pass
         
-        await ctx.send("✅ Quest removed successfully!", delete_after=5)
+        await quest_bot.outbound.send(ctx, "✅ Quest removed successfully!", delete_after=5)
     except Exception as e:
-        await ctx.send("❌ Failed to remove quest. Make sure the message ID is correct.", delete_after=5)
+        await quest_bot.outbound.send(ctx, "❌ Failed to remove quest. Make sure the message ID is correct.", delete_after=5)
 
 @bot.command(name='questping')
 @commands.has_permissions(manage_roles=True)
@@ -626,10 +1272,10 @@ async def set_quest_ping(ctx, role_id: int):
     role = ctx.guild.get_role(role_id)
     if role:
         quest_bot.quest_ping_role_id = role_id
-        quest_bot.save_settings(ctx.guild.id)
-        await ctx.send(f"✅ Quest ping role set to: {role.mention}", delete_after=5)
+        await quest_bot.save_settings(ctx.guild.id)
+        await quest_bot.outbound.send(ctx, f"✅ Quest ping role set to: {role.mention}", delete_after=5)
     else:
-        await ctx.send("❌ Role not found!", delete_after=5)
+        await quest_bot.outbound.send(ctx, "❌ Role not found!", delete_after=5)
 
 @bot.command(name='questchannel')
 @commands.has_permissions(manage_channels=True)
@@ -638,10 +1284,33 @@ async def set_quest_channel(ctx, channel_id: int):
     channel = bot.get_channel(channel_id)
     if channel:
         quest_bot.quest_channel_id = channel_id
-        quest_bot.save_settings(ctx.guild.id)
-        await ctx.send(f"✅ Quest channel set to: {channel.mention}", delete_after=5)
+        await quest_bot.save_settings(ctx.guild.id)
+        await quest_bot.outbound.send(ctx, f"✅ Quest channel set to: {channel.mention}", delete_after=5)
+    else:
+        await quest_bot.outbound.send(ctx, "❌ Channel not found!", delete_after=5)
+
+@bot.command(name='announcechannel')
+@commands.has_permissions(manage_channels=True)
+async def set_announce_channel(ctx, channel_id: int):
+    """Set the channel for role gain notifications"""
+    channel = ctx.guild.get_channel(channel_id)
+    if channel:
+        quest_bot.notifications.configure(ctx.guild.id, channel_id, quest_bot.notifications.windows.get(ctx.guild.id))
+        await quest_bot.save_settings(ctx.guild.id)
+        await quest_bot.outbound.send(ctx, f"✅ Announcement channel set to: {channel.mention}", delete_after=5)
     else:
-        await ctx.send("❌ Channel not found!", delete_after=5)
+        await quest_bot.outbound.send(ctx, "❌ Channel not found!", delete_after=5)
+
+@bot.command(name='digestwindow')
+@commands.has_permissions(manage_channels=True)
+async def set_digest_window(ctx, seconds: float):
+    """Set how long role gains are collected into one notification"""
+    if not 0 <= seconds <= MAX_DIGEST_WINDOW:
+        await quest_bot.outbound.send(ctx, f"❌ Window must be between 0 and {MAX_DIGEST_WINDOW:g} seconds!", delete_after=5)
+        return
+    quest_bot.notifications.configure(ctx.guild.id, quest_bot.notifications.channel_ids.get(ctx.guild.id), seconds)
+    await quest_bot.save_settings(ctx.guild.id)
+    await quest_bot.outbound.send(ctx, f"✅ Role gain notifications are now sent every {seconds:g} seconds", delete_after=5)
 
 @bot.command(name='addXP')
 @commands.has_any_role('staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN')
@@ -654,13 +1323,13 @@ async def add_xp(ctx, member: discord.Member, amount: int):
             description=f"XP must be added in increments of 5.\nTry: 5, 10, 15, 20, 25, 50, etc.",
             color=0xff0000
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
-    new_xp, new_level = quest_bot.update_user_xp(member.id, ctx.guild.id, amount)
+    new_xp, new_level = await quest_bot.update_user_xp(member.id, ctx.guild.id, amount)
     
     # Get total XP including role bonuses (same as leaderboard calculation)
-    total_xp = quest_bot.calculate_total_user_xp(member.id, ctx.guild.id)
+    total_xp = await quest_bot.calculate_total_user_xp(member.id, ctx.guild.id)
     total_level = quest_bot.calculate_level(total_xp)
     
     embed = discord.Embed(
@@ -668,7 +1337,7 @@ async def add_xp(ctx, member: discord.Member, amount: int):
         description=f"Added {amount} XP to {member.mention}\nNew Total: {total_xp:,} XP (Level {total_level})",
         color=0x00ff00
     )
-    await ctx.send(embed=embed)
+    await quest_bot.outbound.send(ctx, embed=embed)
 
 @bot.command(name='removeXP')
 @commands.has_any_role('staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN')
@@ -681,13 +1350,13 @@ async def remove_xp(ctx, member: discord.Member, amount: int):
             description=f"XP must be removed in increments of 5.\nTry: 5, 10, 15, 20, 25, 50, etc.",
             color=0xff0000
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
-    new_xp, new_level = quest_bot.update_user_xp(member.id, ctx.guild.id, -amount)
+    new_xp, new_level = await quest_bot.update_user_xp(member.id, ctx.guild.id, -amount)
     
     # Get total XP including role bonuses (same as leaderboard calculation)
-    total_xp = quest_bot.calculate_total_user_xp(member.id, ctx.guild.id)
+    total_xp = await quest_bot.calculate_total_user_xp(member.id, ctx.guild.id)
     total_level = quest_bot.calculate_level(total_xp)
     
     embed = discord.Embed(
@@ -695,7 +1364,7 @@ async def remove_xp(ctx, member: discord.Member, amount: int):
         description=f"Removed {amount} XP from {member.mention}\nNew Total: {total_xp:,} XP (Level {total_level})",
         color=0xff0000
     )
-    await ctx.send(embed=embed)
+    await quest_bot.outbound.send(ctx, embed=embed)
 
 @bot.command(name='setXP')
 @commands.has_any_role('staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN')
@@ -708,7 +1377,7 @@ async def set_xp(ctx, member: discord.Member, amount: int):
             description=f"XP must be set in increments of 5.\nTry: 0, 5, 10, 15, 20, 25, 50, etc.",
             color=0xff0000
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
     # Ensure amount is not negative
@@ -718,18 +1387,18 @@ async def set_xp(ctx, member: discord.Member, amount: int):
             description="XP cannot be set to a negative value.\nMinimum: 0 XP",
             color=0xff0000
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
     # Set XP directly by calculating the difference from current XP
-    current_data = quest_bot.get_user_data(member.id, ctx.guild.id)
+    current_data = await quest_bot.get_user_data(member.id, ctx.guild.id)
     current_xp = current_data['xp']
     xp_difference = amount - current_xp
     
-    new_xp, new_level = quest_bot.update_user_xp(member.id, ctx.guild.id, xp_difference)
+    new_xp, new_level = await quest_bot.update_user_xp(member.id, ctx.guild.id, xp_difference)
     
     # Get total XP including role bonuses (same as leaderboard calculation)
-    total_xp = quest_bot.calculate_total_user_xp(member.id, ctx.guild.id)
+    total_xp = await quest_bot.calculate_total_user_xp(member.id, ctx.guild.id)
     total_level = quest_bot.calculate_level(total_xp)
     
     embed = discord.Embed(
@@ -737,7 +1406,7 @@ async def set_xp(ctx, member: discord.Member, amount: int):
         description=f"Set {member.mention}'s base XP to {amount}\nTotal XP: {total_xp:,} (Level {total_level})",
         color=0x0099ff
     )
-    await ctx.send(embed=embed)
+    await quest_bot.outbound.send(ctx, embed=embed)
 
 @bot.command(name='assignbadgeXP')
 @commands.has_permissions(manage_roles=True)
@@ -756,7 +1425,7 @@ async def assign_badge_xp(ctx, xp_amount: int, *roles: discord.Role):
             description="Please specify which roles should be badge roles.\n\n**Usage:** `-assignbadgeXP 5 @role1 @role2`\n\n*The system will remember that these roles are badge roles for XP tracking.*",
             color=0xff0000
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
     # List found badge roles and assign XP
@@ -776,7 +1445,7 @@ async def assign_badge_xp(ctx, xp_amount: int, *roles: discord.Role):
             current_xp, current_type = existing_data
             role_list += f"• **{role.name}** - Already assigned {current_xp} {current_type.title()} XP (skipped)\n"
     
-    quest_bot.save_settings(guild_id)
+    await quest_bot.save_settings(guild_id)
     
     mode_text = "auto-detected" if detection_mode == "auto" else "specified"
     embed = discord.Embed(
@@ -788,7 +1457,7 @@ async def assign_badge_xp(ctx, xp_amount: int, *roles: discord.Role):
     if role_list:
         embed.add_field(name="Badge Roles", value=role_list[:1024], inline=False)
     
-    await ctx.send(embed=embed)
+    await quest_bot.outbound.send(ctx, embed=embed)
 
 @bot.command(name='assignstreakXP')
 @commands.has_permissions(manage_roles=True)
@@ -807,7 +1476,7 @@ async def assign_streak_xp(ctx, xp_amount: int, *roles: discord.Role):
             description="Please specify which roles should be streak roles.\n\n**Usage:** `-assignstreakXP 10 @1week @2weeks @1month`\n\n*The system will remember that these roles are streak roles for XP tracking.*",
             color=0xff0000
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
     # List found streak roles and assign XP
@@ -827,7 +1496,7 @@ async def assign_streak_xp(ctx, xp_amount: int, *roles: discord.Role):
             current_xp, current_type = existing_data
             role_list += f"• **{role.name}** - Already assigned {current_xp} {current_type.title()} XP (skipped)\n"
     
-    quest_bot.save_settings(guild_id)
+    await quest_bot.save_settings(guild_id)
     
     mode_text = "auto-detected" if detection_mode == "auto" else "specified"
     embed = discord.Embed(
@@ -839,7 +1508,7 @@ async def assign_streak_xp(ctx, xp_amount: int, *roles: discord.Role):
     if role_list:
         embed.add_field(name="Streak Roles", value=role_list[:1024], inline=False)
     
-    await ctx.send(embed=embed)
+    await quest_bot.outbound.send(ctx, embed=embed)
 
 @bot.command(name='unassignroleXP')
 @commands.has_permissions(manage_roles=True)
@@ -853,7 +1522,7 @@ async def unassign_role_xp(ctx, *roles: discord.Role):
             description="Please specify one or more roles to unassign XP from.\n\n**Usage:** `-unassignroleXP @role1 @role2 @role3`",
             color=0xff0000
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
     # Check if guild has any role assignments
@@ -863,7 +1532,7 @@ async def unassign_role_xp(ctx, *roles: discord.Role):
             description="No roles in this server have XP assignments to remove.",
             color=0xff9900
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
     role_assignments = quest_bot.role_xp_assignments[guild_id]
@@ -893,7 +1562,8 @@ async def unassign_role_xp(ctx, *roles: discord.Role):
     
     # Save changes to database
     if unassigned_count > 0:
-        quest_bot.save_settings(guild_id)
+        await quest_bot.save_settings(guild_id)
+        quest_bot.refresh_role_xp(guild_id, [role.id for role in roles])
     
     embed = discord.Embed(
         title="🗑️ Role XP Unassignment",
@@ -904,9 +1574,30 @@ async def unassign_role_xp(ctx, *roles: discord.Role):
     if role_list:
         embed.add_field(name="Results", value=role_list[:1024], inline=False)
     
-    await ctx.send(embed=embed)
+    await quest_bot.outbound.send(ctx, embed=embed)
+
+@bot.tree.command(name="unassignrolexp", description="Remove the XP assignment from a role")
+@app_commands.describe(role="Role to remove the XP assignment from")
+async def slash_unassign_role_xp(interaction: discord.Interaction, role: discord.Role):
+    if not interaction.user.guild_permissions.manage_roles:
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Roles permission to use this command!", ephemeral=True)
+        return
+    await unassign_role_xp(await commands.Context.from_interaction(interaction), role)
 
-@bot.command(name='checkroleXP')
+@bot.command(name='rebuildstreakXP')
+@commands.has_permissions(manage_roles=True)
+async def rebuild_streak_xp(ctx):
+    """Recompute every member's accumulated streak XP from the streak gain history"""
+    rebuilt_count = await quest_bot.rebuild_streak_xp_totals(ctx.guild.id)
+    embed = discord.Embed(
+        title="🔥 Streak XP Rebuilt",
+        description=f"Recomputed accumulated streak XP for **{rebuilt_count}** member(s) from their streak role history.",
+        color=0x00ff00
+    )
+    await quest_bot.outbound.send(ctx, embed=embed)
+
+@bot.hybrid_command(name='checkrolexp', aliases=['checkroleXP'])
+@app_commands.describe(role="Role to check")
 async def check_role_xp(ctx, role: discord.Role):
     """Display the XP amount assigned to a role"""
     guild_id = ctx.guild.id
@@ -918,7 +1609,7 @@ async def check_role_xp(ctx, role: discord.Role):
             description=f"Role **{role.name}** has no XP assignment.\n\nUse `-assignroleXP @{role.name} <amount>` to assign XP to this role.",
             color=0xff9900
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
     role_assignments = quest_bot.role_xp_assignments[guild_id]
@@ -931,7 +1622,7 @@ async def check_role_xp(ctx, role: discord.Role):
             description=f"Role **{role.name}** has no XP assignment.\n\nUse `-assignroleXP @{role.name} <amount>` to assign XP to this role.",
             color=0xff9900
         )
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         return
     
     # Display the role's XP assignment
@@ -963,14 +1654,13 @@ async def check_role_xp(ctx, role: discord.Role):
             value=f"**Role:** {role.mention}\n**XP Value:** {assignment} XP\n**Role ID:** {role.id}",
             inline=False
         )
-    await ctx.send(embed=embed)
+    await quest_bot.outbound.send(ctx, embed=embed)
 
 @bot.command(name='leaderboard')
 async def leaderboard(ctx):
     """Display the XP leaderboard"""
     try:
-        leaderboard_data = quest_bot.get_leaderboard(ctx.guild.id, 10)
-        print(f"Leaderboard data retrieved: {leaderboard_data}")  # Debug print
+        leaderboard_data = await quest_bot.get_leaderboard(ctx.guild.id, 10)
         
         if not leaderboard_data:
             embed = discord.Embed(
@@ -983,7 +1673,7 @@ async def leaderboard(ctx):
             for level, xp in LEVEL_THRESHOLDS.items():
                 level_info += f"Level {level}: {xp:,} XP\n"
             embed.add_field(name="Level System", value=level_info, inline=False)
-            await ctx.send(embed=embed)
+            await quest_bot.outbound.send(ctx, embed=embed)
             return
         
         embed = discord.Embed(
@@ -999,19 +1689,20 @@ async def leaderboard(ctx):
             medal = medals[i] if i < 3 else f"#{i+1}"
             
             # Try multiple methods to get user info
-            user = ctx.guild.get_member(user_id)
-            if not user:
+            names = quest_bot.members.names(ctx.guild, user_id)
+            if not names:
                 user = bot.get_user(user_id)
+                names = (user.name, getattr(user, 'display_name', user.name)) if user else None
             
-            # Calculate total XP including role-based XP
-            total_xp = quest_bot.calculate_total_user_xp(user_id, ctx.guild.id)
+            # Leaderboard rows already carry total XP including role-based XP
+            total_xp = xp
             
-            if user:
+            if names:
                 # Format username without pinging - use @ but escape it
-                username = f"@{user.name}"
-                display_name = getattr(user, 'display_name', user.name)
-                if display_name != user.name:
-                    username = f"@{user.name} ({display_name})"
+                name, display_name = names
+                username = f"@{name}"
+                if display_name != name:
+                    username = f"@{name} ({display_name})"
                 
                 embed.add_field(
                     name=f"{medal} Level {level}",
@@ -1052,27 +1743,41 @@ async def leaderboard(ctx):
             level_info += f"Level {level}: {xp_req:,} XP\n"
         
         embed.add_field(name="Level System", value=level_info, inline=False)
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         
-    except Exception as e:
-        print(f"Error in leaderboard command: {e}")
-        await ctx.send("❌ Could not retrieve leaderboard data. Please try again later.", delete_after=5)
+    except Exception:
+        log.exception("Error in leaderboard command")
+        await quest_bot.outbound.send(ctx, "❌ Could not retrieve leaderboard data. Please try again later.", delete_after=5)
 
-@bot.command(name='allquests')
+@bot.command(name='rank')
+@commands.guild_only()
+async def rank(ctx, member: discord.Member = None):
+    """Show a member's leaderboard position"""
+    target_member = member or ctx.author
+    position, ranked_count = await quest_bot.get_rank(target_member.id, ctx.guild.id)
+    total_xp = await quest_bot.calculate_total_user_xp(target_member.id, ctx.guild.id)
+    
+    if position is None:
+        description = f"{target_member.mention} is not ranked yet - complete quests to get on the leaderboard!"
+    else:
+        description = f"{target_member.mention} is ranked **#{position:,}** of {ranked_count:,}\n{total_xp:,} XP (Level {quest_bot.calculate_level(total_xp)})"
+    
+    embed = discord.Embed(title="🏆 Leaderboard Rank", description=description, color=0xffd700)
+    await quest_bot.outbound.send(ctx, embed=embed)
+
+@bot.hybrid_command(name='allquests')
 @commands.guild_only()
 async def all_quests(ctx):
     """List all current quests by name"""
-    if not quest_bot.db_connection:
-        await ctx.send("❌ Database connection error!")
+    if not quest_bot.db:
+        await quest_bot.outbound.send(ctx, "❌ Database connection error!")
         return
     
     try:
-        cursor = quest_bot.db_connection.cursor()
-        cursor.execute('SELECT title, message_id, channel_id FROM quests WHERE guild_id = ? ORDER BY title', (ctx.guild.id,))
-        quests = cursor.fetchall()
+        quests = await quest_bot.get_guild_quests(ctx.guild.id)
         
         if not quests:
-            await ctx.send("📝 No active quests found! Use `-addquest` to create one.")
+            await quest_bot.outbound.send(ctx, "📝 No active quests found! Use `-addquest` to create one.")
             return
         
         embed = discord.Embed(
@@ -1082,7 +1787,7 @@ async def all_quests(ctx):
         )
         
         quest_list = []
-        for i, (title, message_id, channel_id) in enumerate(quests, 1):
+        for i, (message_id, channel_id, title) in enumerate(quests, 1):
             channel = bot.get_channel(channel_id)
             channel_mention = channel.mention if channel else "#unknown-channel"
             # Create direct message link
@@ -1100,28 +1805,26 @@ async def all_quests(ctx):
                 embed.add_field(name=field_name, value="\n".join(chunk), inline=False)
         
         embed.set_footer(text=f"Total: {len(quests)} active quest(s)")
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         
-    except Exception as e:
-        print(f"Error fetching quests: {e}")
-        await ctx.send("❌ Error retrieving quests!")
+    except Exception:
+        log.exception("Error fetching quests")
+        await quest_bot.outbound.send(ctx, "❌ Error retrieving quests!")
 
-@bot.command(name='deleteallquests')
+@bot.hybrid_command(name='deleteallquests')
 @commands.has_permissions(manage_messages=True)
 async def delete_all_quests(ctx):
     """Delete all current quests (admin only)"""
-    if not quest_bot.db_connection:
-        await ctx.send("❌ Database connection error!")
+    if not quest_bot.db:
+        await quest_bot.outbound.send(ctx, "❌ Database connection error!")
         return
     
     try:
         # Get all quests for this guild first
-        cursor = quest_bot.db_connection.cursor()
-        cursor.execute('SELECT message_id, channel_id, title FROM quests WHERE guild_id = ?', (ctx.guild.id,))
-        quests = cursor.fetchall()
+        quests = await quest_bot.get_guild_quests(ctx.guild.id)
         
         if not quests:
-            await ctx.send("📝 No quests to delete!")
+            await quest_bot.outbound.send(ctx, "📝 No quests to delete!")
             return
         
         # Send confirmation message
@@ -1131,23 +1834,23 @@ async def delete_all_quests(ctx):
             color=0xff0000
         )
         
-        confirmation_msg = await ctx.send(embed=embed)
-        await confirmation_msg.add_reaction('✅')
-        await confirmation_msg.add_reaction('❌')
+        confirmation_msg = await quest_bot.outbound.send(ctx, embed=embed)
+        await quest_bot.outbound.add_reaction(confirmation_msg, '✅')
+        await quest_bot.outbound.add_reaction(confirmation_msg, '❌')
         
-        def check(reaction, user):
-            return user == ctx.author and str(reaction.emoji) in ['✅', '❌'] and reaction.message.id == confirmation_msg.id
+        def check(payload):
+            return payload.user_id == ctx.author.id and str(payload.emoji) in ['✅', '❌'] and payload.message_id == confirmation_msg.id
         
         try:
-            reaction, user = await bot.wait_for('reaction_add', timeout=30.0, check=check)
+            payload = await bot.wait_for('raw_reaction_add', timeout=30.0, check=check)
             
-            if str(reaction.emoji) == '❌':
-                await confirmation_msg.edit(embed=discord.Embed(
+            if str(payload.emoji) == '❌':
+                await quest_bot.outbound.edit_message(confirmation_msg, embed=discord.Embed(
                     title="❌ Cancelled",
                     description="Quest deletion cancelled.",
                     color=0x808080
                 ))
-                await confirmation_msg.clear_reactions()
+                await quest_bot.outbound.clear_reactions(confirmation_msg)
                 return
             
             # Delete quest messages from Discord (attempt)
@@ -1157,15 +1860,14 @@ async def delete_all_quests(ctx):
                     channel = bot.get_channel(channel_id)
                     if channel:
                         message = await channel.fetch_message(message_id)
-                        await message.delete()
+                        await quest_bot.outbound.delete(message, QUEST)
                         deleted_messages += 1
                 except:
                     # Continue even if message deletion fails
                     pass
             
             # Delete all quests from database
-            cursor.execute('DELETE FROM quests WHERE guild_id = ?', (ctx.guild.id,))
-            quest_bot.db_connection.commit()
+            await quest_bot.delete_guild_quests(ctx.guild.id)
             
             # Update confirmation message
             embed = discord.Embed(
@@ -1174,8 +1876,8 @@ async def delete_all_quests(ctx):
                            f"Removed **{deleted_messages}** quest message(s) from Discord.",
                 color=0x00ff00
             )
-            await confirmation_msg.edit(embed=embed)
-            await confirmation_msg.clear_reactions()
+            await quest_bot.outbound.edit_message(confirmation_msg, embed=embed)
+            await quest_bot.outbound.clear_reactions(confirmation_msg)
             
         except asyncio.TimeoutError:
             embed = discord.Embed(
@@ -1183,19 +1885,20 @@ async def delete_all_quests(ctx):
                 description="Confirmation timed out. No quests were deleted.",
                 color=0x808080
             )
-            await confirmation_msg.edit(embed=embed)
-            await confirmation_msg.clear_reactions()
+            await quest_bot.outbound.edit_message(confirmation_msg, embed=embed)
+            await quest_bot.outbound.clear_reactions(confirmation_msg)
     
-    except Exception as e:
-        print(f"Error deleting all quests: {e}")
-        await ctx.send("❌ Error deleting quests!")
+    except Exception:
+        log.exception("Error deleting all quests")
+        await quest_bot.outbound.send(ctx, "❌ Error deleting quests!")
 
 @bot.command(name='questbot')
 async def questbot_ping(ctx):
     """Ping the bot to check if it's online"""
-    await ctx.send("online")
+    await quest_bot.outbound.send(ctx, "online")
 
-@bot.command(name='checkXP')
+@bot.hybrid_command(name='checkxp', aliases=['checkXP'])
+@app_commands.describe(member="Member to check (defaults to you)")
 async def check_xp(ctx, member: discord.Member = None):
     """Check your current XP and level progress"""
     try:
@@ -1206,53 +1909,34 @@ async def check_xp(ctx, member: discord.Member = None):
         guild = ctx.guild
         guild_id = guild.id
         
-        # Use the same XP calculation method as leaderboard for consistency
-        current_xp = quest_bot.calculate_total_user_xp(target_member.id, guild_id)
+        # Use the same cached XP breakdown as the leaderboard for consistency
+        breakdown = await quest_bot.get_member_xp(target_member.id, guild_id)
+        if breakdown:
+            current_xp = breakdown.total
+            base_xp = breakdown.base
+            badge_xp = breakdown.custom + breakdown.badge
+            streak_xp = breakdown.streak
+        else:
+            user_data = await quest_bot.get_user_data(target_member.id, guild_id)
+            current_xp = base_xp = user_data.get('xp', 0)
+            badge_xp = 0
+            streak_xp = await quest_bot.get_accumulated_streak_xp(target_member.id, guild_id)
         current_level = quest_bot.calculate_level(current_xp)
         
-        # Get base XP and role breakdown for detailed display
-        user_data = quest_bot.get_user_data(target_member.id, guild_id)
-        base_xp = user_data.get('xp', 0)
-        
-        # Calculate XP from different role sources for detailed breakdown
+        # Level role XP is display-only (it never counts towards the total)
         level_role_xp = 0
-        badge_xp = 0
-        
-        # Get accumulated streak XP from historical role gains (independent of member cache)
-        streak_xp = quest_bot.get_accumulated_streak_xp(target_member.id, guild_id)
-        
         try:
-            guild_member = guild.get_member(target_member.id)
-            if guild_member:
-                # Level role XP
-                for role in guild_member.roles:
-                    if role.name.startswith("Level "):
-                        try:
-                            level_num = int(role.name.split("Level ")[1])
-                            if 1 <= level_num <= 10:
-                                level_role_xp = max(level_role_xp, LEVEL_THRESHOLDS.get(level_num, 0))
-                        except:
-                            continue
-                
-                # Calculate XP from current badge roles only
-                for role in guild_member.roles:
-                    role_id_str = str(role.id)
-                    role_name_lower = role.name.lower()
-                    
-                    # Check if this role has assigned XP and type
-                    role_xp_data = quest_bot.get_role_xp_and_type(guild_id, role_id_str)
-                    if role_xp_data:
-                        xp_amount, role_type = role_xp_data
-                        # Only process badge roles (not streak roles)
-                        if role_type == "badge":
-                            badge_xp += xp_amount
-                    else:
-                        # Fallback to auto-detection for unassigned roles with "badge" in name
-                        if "badge" in role_name_lower:
-                            badge_xp += 5  # Default fallback value
+            for role_id in quest_bot.members.role_ids(guild, target_member.id) or ():
+                role = guild.get_role(role_id)
+                if role and role.name.startswith("Level "):
+                    try:
+                        level_num = int(role.name.split("Level ")[1])
+                        if 1 <= level_num <= 10:
+                            level_role_xp = max(level_role_xp, LEVEL_THRESHOLDS.get(level_num, 0))
+                    except:
+                        continue
         except Exception as role_error:
-            print(f"Error processing roles in checkXP: {role_error}")
-            pass
+            log.warning("Error processing roles in checkXP: %s", role_error)
         
         # Calculate XP needed for next level
         next_level = min(current_level + 1, 10)  # Cap at level 10
@@ -1321,15 +2005,13 @@ async def check_xp(ctx, member: discord.Member = None):
         
         embed.set_footer(text="Complete quests and gain roles to earn XP!")
         
-        await ctx.send(embed=embed)
+        await quest_bot.outbound.send(ctx, embed=embed)
         
     except Exception as e:
-        import traceback
-        print(f"Error in checkXP command: {e}")
-        print(f"Traceback: {traceback.format_exc()}")
-        await ctx.send(f"❌ Could not retrieve XP data. Error: {str(e)[:100]}...", delete_after=10)
+        log.exception("Error in checkXP command")
+        await quest_bot.outbound.send(ctx, f"❌ Could not retrieve XP data. Error: {str(e)[:100]}...", delete_after=10)
 
-@bot.command(name='commands')
+@bot.hybrid_command(name='commands')
 async def show_commands(ctx):
     """Display all available bot commands organized by permission level"""
     embed = discord.Embed(
@@ -1341,12 +2023,13 @@ async def show_commands(ctx):
     # User Commands (Everyone can use)
     user_commands = """
     `-leaderboard` - Display XP rankings
+    `-rank [@member]` - Show your or someone's leaderboard position
     `-checkXP [@member]` - Check your or someone's XP with detailed breakdown (base, badge, streak, level role)
     `-allquests` - List all current quests with clickable links
     `-questbot` - Ping bot to check if online
     `-commands` - Show this command list
     
-    **Slash equivalents:** `/leaderboard`, `/questbot`
+    **Slash equivalents:** `/leaderboard`, `/rank`, `/checkxp`, `/allquests`, `/questbot`, `/commands`
     """
     
     # Staff Commands (Staff/Admin roles required)
@@ -1359,12 +2042,16 @@ async def show_commands(ctx):
     `-assignstreakXP <amount> [@role1] [@role2]...` - Assign XP to streak roles (auto-detects or specify roles; accumulates each time gained)
     `-unassignroleXP [@role1] [@role2]...` - Remove XP assignment from multiple roles
     `-checkroleXP <role>` - Display XP amount assigned to a role
+    `-rebuildstreakXP` - Recompute accumulated streak XP from streak role history
+    
+    **Slash equivalents:** `/addxp`, `/removexp`, `/setxp`, `/assignbadgexp`, `/assignstreakxp`, `/unassignrolexp`, `/checkrolexp`, `/rebuildstreakxp`
+    """
     
-    **Quest Management:**
+    staff_quest_commands = """
     `-addquest <title> <content>` - Create new quest embed
     `-removequest <message_id>` - Delete quest by message ID
     
-    **Slash equivalents:** `/addxp`, `/removexp`, `/setxp`, `/assignbadgexp`, `/assignstreakxp`, `/addquest`, `/removequest`
+    **Slash equivalents:** `/addquest`, `/removequest`
     """
     
     # Admin Commands (Manage permissions required) 
@@ -1372,12 +2059,15 @@ async def show_commands(ctx):
     `-deleteallquests` - Delete all current quests
     `-questping <role_id>` - Set quest ping role
     `-questchannel <channel_id>` - Set quest channel
+    `-announcechannel <channel_id>` - Set role gain notification channel
+    `-digestwindow <seconds>` - Batch role gain notifications into one post per window
     
-    **Slash equivalents:** `/questping`, `/questchannel`, `/createlevelroles`, `/assignlevelroles`
+    **Slash equivalents:** `/deleteallquests`, `/questping`, `/questchannel`, `/announcechannel`, `/digestwindow`, `/createlevelroles`, `/assignlevelroles`, `/botdiag`
     """
     
     embed.add_field(name="👥 User Commands", value=user_commands, inline=False)
     embed.add_field(name="🛡️ Staff Commands", value=staff_commands, inline=False)  
+    embed.add_field(name="📜 Staff Quest Commands", value=staff_quest_commands, inline=False)
     embed.add_field(name="⚙️ Admin Commands", value=admin_commands, inline=False)
     
     embed.add_field(
@@ -1388,12 +2078,12 @@ async def show_commands(ctx):
     
     embed.set_footer(text="Use either - or / commands • Both work the same way!")
     
-    await ctx.send(embed=embed)
+    await quest_bot.outbound.send(ctx, embed=embed)
 
 # Slash Commands
 @bot.tree.command(name="questbot", description="Ping the bot to check if it's online")
 async def slash_questbot_ping(interaction: discord.Interaction):
-    await interaction.response.send_message("online")
+    await quest_bot.outbound.respond(interaction, "online")
 
 @bot.tree.command(name="addquest", description="Create a new quest embed")
 @app_commands.describe(title="Quest title", content="Quest description")
@@ -1401,7 +2091,7 @@ async def slash_add_quest(interaction: discord.Interaction, title: str, content:
     # Check if user has staff role
     staff_roles = ['staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN']
     if not any(role.name in staff_roles for role in interaction.user.roles):
-        await interaction.response.send_message("❌ You need the @staff role to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need the @staff role to use this command!", ephemeral=True)
         return
     
     embed = discord.Embed(
@@ -1410,24 +2100,21 @@ async def slash_add_quest(interaction: discord.Interaction, title: str, content:
         color=0xff9900
     )
     embed.add_field(name="Reward", value="50 XP", inline=True)
-    embed.add_field(name="Complete", value="React with ✅", inline=True)
-    embed.set_footer(text="React with ✅ to mark this quest as complete!")
+    embed.add_field(name="Complete", value="Press ✅ Complete", inline=True)
+    embed.set_footer(text="Press the ✅ Complete button to mark this quest as complete!")
     
     # Send to quest channel if set, otherwise current channel
     channel_id = quest_bot.quest_channel_id
     if channel_id:
         channel = bot.get_channel(channel_id)
         if channel and hasattr(channel, 'send'):
-            quest_message = await channel.send(embed=embed)
+            quest_message = await quest_bot.outbound.send(channel, embed=embed, view=quest_bot.quest_view, priority=QUEST)
         else:
-            quest_message = await interaction.followup.send(embed=embed)
+            quest_message = await quest_bot.outbound.followup(interaction, embed=embed, view=quest_bot.quest_view)
     else:
-        await interaction.response.send_message(embed=embed)
+        await quest_bot.outbound.respond(interaction, embed=embed, view=quest_bot.quest_view)
         quest_message = await interaction.original_response()
     
-    # Add checkmark reaction
-    await quest_message.add_reaction('✅')
-    
     # Ping quest role - first check manual setting, then auto-find @Quests role
     quest_role = None
     if quest_bot.quest_ping_role_id:
@@ -1438,19 +2125,15 @@ async def slash_add_quest(interaction: discord.Interaction, title: str, content:
         quest_role = discord.utils.get(interaction.guild.roles, name="Quests")
     
     if quest_role:
-        ping_msg = await quest_message.channel.send(f"{quest_role.mention} New quest available!")
+        ping_msg = await quest_bot.outbound.send(quest_message.channel, f"{quest_role.mention} New quest available!", priority=QUEST)
         await asyncio.sleep(2)
-        await ping_msg.delete()
+        await quest_bot.outbound.delete(ping_msg, QUEST)
     
     # Save quest to database
-    if quest_bot.db_connection:
-        cursor = quest_bot.db_connection.cursor()
-        cursor.execute('INSERT INTO quests (message_id, guild_id, channel_id, title, content) VALUES (?, ?, ?, ?, ?)',
-                      (quest_message.id, interaction.guild.id, quest_message.channel.id, title, content))
-        quest_bot.db_connection.commit()
+    await quest_bot.add_quest(quest_message.id, interaction.guild.id, quest_message.channel.id, title, content)
     
     if not channel_id or not channel or not hasattr(channel, 'send'):
-        await interaction.response.send_message("✅ Quest created!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "✅ Quest created!", ephemeral=True)
 
 @bot.tree.command(name="removequest", description="Remove a quest by message ID")
 @app_commands.describe(message_id="ID of the quest message to remove")
@@ -1458,49 +2141,68 @@ async def slash_remove_quest(interaction: discord.Interaction, message_id: str):
     # Check if user has staff role
     staff_roles = ['staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN']
     if not any(role.name in staff_roles for role in interaction.user.roles):
-        await interaction.response.send_message("❌ You need the @staff role to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need the @staff role to use this command!", ephemeral=True)
         return
     
     try:
         msg_id = int(message_id)
         # Remove from database
-        if quest_bot.db_connection:
-            cursor = quest_bot.db_connection.cursor()
-            cursor.execute('DELETE FROM quests WHERE message_id = ?', (msg_id,))
-            quest_bot.db_connection.commit()
+        await quest_bot.remove_quest(msg_id)
         
         # Try to delete the message
         try:
             message = await interaction.channel.fetch_message(msg_id)
-            await message.delete()
+            await quest_bot.outbound.delete(message, QUEST)
         except:
             pass
         
-        await interaction.response.send_message("✅ Quest removed successfully!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "✅ Quest removed successfully!", ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message("❌ Failed to remove quest. Make sure the message ID is correct.", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ Failed to remove quest. Make sure the message ID is correct.", ephemeral=True)
 
 @bot.tree.command(name="questping", description="Set the role to ping for new quests")
 @app_commands.describe(role="Role to ping for quests")
 async def slash_set_quest_ping(interaction: discord.Interaction, role: discord.Role):
     if not interaction.user.guild_permissions.manage_roles:
-        await interaction.response.send_message("❌ You need Manage Roles permission to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Roles permission to use this command!", ephemeral=True)
         return
     
     quest_bot.quest_ping_role_id = role.id
-    quest_bot.save_settings(interaction.guild.id)
-    await interaction.response.send_message(f"✅ Quest ping role set to: {role.mention}", ephemeral=True)
+    await quest_bot.save_settings(interaction.guild.id)
+    await quest_bot.outbound.respond(interaction, f"✅ Quest ping role set to: {role.mention}", ephemeral=True)
 
 @bot.tree.command(name="questchannel", description="Set the channel for quest embeds")
 @app_commands.describe(channel="Channel for quest embeds")
 async def slash_set_quest_channel(interaction: discord.Interaction, channel: discord.TextChannel):
     if not interaction.user.guild_permissions.manage_channels:
-        await interaction.response.send_message("❌ You need Manage Channels permission to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Channels permission to use this command!", ephemeral=True)
         return
     
     quest_bot.quest_channel_id = channel.id
-    quest_bot.save_settings(interaction.guild.id)
-    await interaction.response.send_message(f"✅ Quest channel set to: {channel.mention}", ephemeral=True)
+    await quest_bot.save_settings(interaction.guild.id)
+    await quest_bot.outbound.respond(interaction, f"✅ Quest channel set to: {channel.mention}", ephemeral=True)
+
+@bot.tree.command(name="announcechannel", description="Set the channel for role gain notifications")
+@app_commands.describe(channel="Channel for role gain notifications")
+async def slash_set_announce_channel(interaction: discord.Interaction, channel: discord.TextChannel):
+    if not interaction.user.guild_permissions.manage_channels:
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Channels permission to use this command!", ephemeral=True)
+        return
+    
+    quest_bot.notifications.configure(interaction.guild.id, channel.id, quest_bot.notifications.windows.get(interaction.guild.id))
+    await quest_bot.save_settings(interaction.guild.id)
+    await quest_bot.outbound.respond(interaction, f"✅ Announcement channel set to: {channel.mention}", ephemeral=True)
+
+@bot.tree.command(name="digestwindow", description="Set how long role gains are collected into one notification")
+@app_commands.describe(seconds="Seconds to collect role gains before posting (0 posts right away)")
+async def slash_set_digest_window(interaction: discord.Interaction, seconds: app_commands.Range[float, 0.0, MAX_DIGEST_WINDOW]):
+    if not interaction.user.guild_permissions.manage_channels:
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Channels permission to use this command!", ephemeral=True)
+        return
+    
+    quest_bot.notifications.configure(interaction.guild.id, quest_bot.notifications.channel_ids.get(interaction.guild.id), seconds)
+    await quest_bot.save_settings(interaction.guild.id)
+    await quest_bot.outbound.respond(interaction, f"✅ Role gain notifications are now sent every {seconds:g} seconds", ephemeral=True)
 
 @bot.tree.command(name="addxp", description="Add XP to a member")
 @app_commands.describe(member="Member to add XP to", amount="Amount of XP to add")
@@ -1508,13 +2210,13 @@ async def slash_add_xp(interaction: discord.Interaction, member: discord.Member,
     # Check if user has staff role
     staff_roles = ['staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN']
     if not any(role.name in staff_roles for role in interaction.user.roles):
-        await interaction.response.send_message("❌ You need the @staff role to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need the @staff role to use this command!", ephemeral=True)
         return
     
-    new_xp, new_level = quest_bot.update_user_xp(member.id, interaction.guild.id, amount)
+    new_xp, new_level = await quest_bot.update_user_xp(member.id, interaction.guild.id, amount)
     
     # Get total XP including role bonuses (same as leaderboard calculation)
-    total_xp = quest_bot.calculate_total_user_xp(member.id, interaction.guild.id)
+    total_xp = await quest_bot.calculate_total_user_xp(member.id, interaction.guild.id)
     total_level = quest_bot.calculate_level(total_xp)
     
     embed = discord.Embed(
@@ -1522,7 +2224,7 @@ async def slash_add_xp(interaction: discord.Interaction, member: discord.Member,
         description=f"Added {amount} XP to {member.mention}\nNew Total: {total_xp:,} XP (Level {total_level})",
         color=0x00ff00
     )
-    await interaction.response.send_message(embed=embed)
+    await quest_bot.outbound.respond(interaction, embed=embed)
 
 @bot.tree.command(name="removexp", description="Remove XP from a member")
 @app_commands.describe(member="Member to remove XP from", amount="Amount of XP to remove")
@@ -1530,13 +2232,13 @@ async def slash_remove_xp(interaction: discord.Interaction, member: discord.Memb
     # Check if user has staff role
     staff_roles = ['staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN']
     if not any(role.name in staff_roles for role in interaction.user.roles):
-        await interaction.response.send_message("❌ You need the @staff role to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need the @staff role to use this command!", ephemeral=True)
         return
     
-    new_xp, new_level = quest_bot.update_user_xp(member.id, interaction.guild.id, -amount)
+    new_xp, new_level = await quest_bot.update_user_xp(member.id, interaction.guild.id, -amount)
     
     # Get total XP including role bonuses (same as leaderboard calculation)
-    total_xp = quest_bot.calculate_total_user_xp(member.id, interaction.guild.id)
+    total_xp = await quest_bot.calculate_total_user_xp(member.id, interaction.guild.id)
     total_level = quest_bot.calculate_level(total_xp)
     
     embed = discord.Embed(
@@ -1544,7 +2246,7 @@ async def slash_remove_xp(interaction: discord.Interaction, member: discord.Memb
         description=f"Removed {amount} XP from {member.mention}\nNew Total: {total_xp:,} XP (Level {total_level})",
         color=0xff0000
     )
-    await interaction.response.send_message(embed=embed)
+    await quest_bot.outbound.respond(interaction, embed=embed)
 
 @bot.tree.command(name="setxp", description="Set a member's XP to a specific amount")
 @app_commands.describe(member="Member to set XP for", amount="Amount of XP to set")
@@ -1552,12 +2254,12 @@ async def slash_set_xp(interaction: discord.Interaction, member: discord.Member,
     # Check if user has staff role
     staff_roles = ['staff', 'Staff', 'STAFF', 'admin', 'Admin', 'ADMIN']
     if not any(role.name in staff_roles for role in interaction.user.roles):
-        await interaction.response.send_message("❌ You need the @staff role to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need the @staff role to use this command!", ephemeral=True)
         return
     
     # Enforce 5 XP increments
     if amount % 5 != 0:
-        await interaction.response.send_message(
+        await quest_bot.outbound.respond(interaction, 
             "❌ **Invalid XP Amount**\nXP must be set in increments of 5.\nTry: 0, 5, 10, 15, 20, 25, 50, etc.",
             ephemeral=True
         )
@@ -1565,21 +2267,21 @@ async def slash_set_xp(interaction: discord.Interaction, member: discord.Member,
     
     # Ensure amount is not negative
     if amount < 0:
-        await interaction.response.send_message(
+        await quest_bot.outbound.respond(interaction, 
             "❌ **Invalid XP Amount**\nXP cannot be set to a negative value.\nMinimum: 0 XP",
             ephemeral=True
         )
         return
     
     # Set XP directly by calculating the difference from current XP
-    current_data = quest_bot.get_user_data(member.id, interaction.guild.id)
+    current_data = await quest_bot.get_user_data(member.id, interaction.guild.id)
     current_xp = current_data['xp']
     xp_difference = amount - current_xp
     
-    new_xp, new_level = quest_bot.update_user_xp(member.id, interaction.guild.id, xp_difference)
+    new_xp, new_level = await quest_bot.update_user_xp(member.id, interaction.guild.id, xp_difference)
     
     # Get total XP including role bonuses (same as leaderboard calculation)
-    total_xp = quest_bot.calculate_total_user_xp(member.id, interaction.guild.id)
+    total_xp = await quest_bot.calculate_total_user_xp(member.id, interaction.guild.id)
     total_level = quest_bot.calculate_level(total_xp)
     
     embed = discord.Embed(
@@ -1587,7 +2289,7 @@ async def slash_set_xp(interaction: discord.Interaction, member: discord.Member,
         description=f"Set {member.mention}'s base XP to {amount}\nTotal XP: {total_xp:,} (Level {total_level})",
         color=0x0099ff
     )
-    await interaction.response.send_message(embed=embed)
+    await quest_bot.outbound.respond(interaction, embed=embed)
 
 @bot.tree.command(name="assignbadgexp", description="Assign XP value to badge roles - auto-detects or specify role")
 @app_commands.describe(
@@ -1596,7 +2298,7 @@ async def slash_set_xp(interaction: discord.Interaction, member: discord.Member,
 )
 async def slash_assign_badge_xp(interaction: discord.Interaction, xp_amount: int, role: discord.Role = None):
     if not interaction.user.guild_permissions.manage_roles:
-        await interaction.response.send_message("❌ You need Manage Roles permission to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Roles permission to use this command!", ephemeral=True)
         return
     
     guild_id = interaction.guild.id
@@ -1617,9 +2319,9 @@ async def slash_assign_badge_xp(interaction: discord.Interaction, xp_amount: int
     
     if not badge_roles:
         if detection_mode == "auto":
-            await interaction.response.send_message("❌ **No Badge Roles Found**\nNo roles with 'badge' in the name were found in this server.\n\n**Manual Selection:** Use the `role` parameter to specify a role.", ephemeral=True)
+            await quest_bot.outbound.respond(interaction, "❌ **No Badge Roles Found**\nNo roles with 'badge' in the name were found in this server.\n\n**Manual Selection:** Use the `role` parameter to specify a role.", ephemeral=True)
         else:
-            await interaction.response.send_message("❌ **No Role Specified**\nNo valid role was provided for XP assignment.", ephemeral=True)
+            await quest_bot.outbound.respond(interaction, "❌ **No Role Specified**\nNo valid role was provided for XP assignment.", ephemeral=True)
         return
     
     # List found badge roles and assign XP
@@ -1632,14 +2334,14 @@ async def slash_assign_badge_xp(interaction: discord.Interaction, xp_amount: int
         
         # Check if already assigned
         if role_id_str not in role_assignments:
-            quest_bot.role_xp_assignments[guild_id][role_id_str] = xp_amount
+            quest_bot.assign_role_xp(guild_id, role_id_str, xp_amount, "badge")
             assigned_count += 1
             role_list += f"• **{target_role.name}** - {xp_amount} XP\n"
         else:
             current_xp = role_assignments[role_id_str]
             role_list += f"• **{target_role.name}** - Already assigned {current_xp} XP (skipped)\n"
     
-    quest_bot.save_settings(guild_id)
+    await quest_bot.save_settings(guild_id)
     
     mode_text = "auto-detected" if detection_mode == "auto" else "specified"
     embed = discord.Embed(
@@ -1651,7 +2353,7 @@ async def slash_assign_badge_xp(interaction: discord.Interaction, xp_amount: int
     if role_list:
         embed.add_field(name="Badge Roles", value=role_list[:1024], inline=False)
     
-    await interaction.response.send_message(embed=embed)
+    await quest_bot.outbound.respond(interaction, embed=embed)
 
 @bot.tree.command(name="assignstreakxp", description="Assign XP value to streak roles - auto-detects or specify role")
 @app_commands.describe(
@@ -1660,7 +2362,7 @@ async def slash_assign_badge_xp(interaction: discord.Interaction, xp_amount: int
 )
 async def slash_assign_streak_xp(interaction: discord.Interaction, xp_amount: int, role: discord.Role = None):
     if not interaction.user.guild_permissions.manage_roles:
-        await interaction.response.send_message("❌ You need Manage Roles permission to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Roles permission to use this command!", ephemeral=True)
         return
     
     guild_id = interaction.guild.id
@@ -1681,9 +2383,9 @@ async def slash_assign_streak_xp(interaction: discord.Interaction, xp_amount: in
     
     if not streak_roles:
         if detection_mode == "auto":
-            await interaction.response.send_message("❌ **No Streak Roles Found**\nNo roles with 'streak' in the name were found in this server.\n\n**Manual Selection:** Use the `role` parameter to specify a role.", ephemeral=True)
+            await quest_bot.outbound.respond(interaction, "❌ **No Streak Roles Found**\nNo roles with 'streak' in the name were found in this server.\n\n**Manual Selection:** Use the `role` parameter to specify a role.", ephemeral=True)
         else:
-            await interaction.response.send_message("❌ **No Role Specified**\nNo valid role was provided for XP assignment.", ephemeral=True)
+            await quest_bot.outbound.respond(interaction, "❌ **No Role Specified**\nNo valid role was provided for XP assignment.", ephemeral=True)
         return
     
     # List found streak roles and assign XP
@@ -1696,14 +2398,14 @@ async def slash_assign_streak_xp(interaction: discord.Interaction, xp_amount: in
         
         # Check if already assigned
         if role_id_str not in role_assignments:
-            quest_bot.role_xp_assignments[guild_id][role_id_str] = xp_amount
+            quest_bot.assign_role_xp(guild_id, role_id_str, xp_amount, "streak")
             assigned_count += 1
             role_list += f"• **{target_role.name}** - {xp_amount} XP\n"
         else:
             current_xp = role_assignments[role_id_str]
             role_list += f"• **{target_role.name}** - Already assigned {current_xp} XP (skipped)\n"
     
-    quest_bot.save_settings(guild_id)
+    await quest_bot.save_settings(guild_id)
     
     mode_text = "auto-detected" if detection_mode == "auto" else "specified"
     embed = discord.Embed(
@@ -1715,13 +2417,12 @@ async def slash_assign_streak_xp(interaction: discord.Interaction, xp_amount: in
     if role_list:
         embed.add_field(name="Streak Roles", value=role_list[:1024], inline=False)
     
-    await interaction.response.send_message(embed=embed)
+    await quest_bot.outbound.respond(interaction, embed=embed)
 
 @bot.tree.command(name="leaderboard", description="Display the XP leaderboard")
 async def slash_leaderboard(interaction: discord.Interaction):
     try:
-        leaderboard_data = quest_bot.get_leaderboard(interaction.guild.id, 10)
-        print(f"Slash leaderboard data retrieved: {leaderboard_data}")  # Debug print
+        leaderboard_data = await quest_bot.get_leaderboard(interaction.guild.id, 10)
         
         if not leaderboard_data:
             embed = discord.Embed(
@@ -1734,7 +2435,7 @@ async def slash_leaderboard(interaction: discord.Interaction):
             for level, xp in LEVEL_THRESHOLDS.items():
                 level_info += f"Level {level}: {xp:,} XP\n"
             embed.add_field(name="Level System", value=level_info, inline=False)
-            await interaction.response.send_message(embed=embed)
+            await quest_bot.outbound.respond(interaction, embed=embed)
             return
         
         embed = discord.Embed(
@@ -1750,19 +2451,20 @@ async def slash_leaderboard(interaction: discord.Interaction):
             medal = medals[i] if i < 3 else f"#{i+1}"
             
             # Try multiple methods to get user info
-            user = interaction.guild.get_member(user_id)
-            if not user:
+            names = quest_bot.members.names(interaction.guild, user_id)
+            if not names:
                 user = bot.get_user(user_id)
+                names = (user.name, getattr(user, 'display_name', user.name)) if user else None
             
-            # Calculate total XP including role-based XP
-            total_xp = quest_bot.calculate_total_user_xp(user_id, interaction.guild.id)
+            # Leaderboard rows already carry total XP including role-based XP
+            total_xp = xp
             
-            if user:
+            if names:
                 # Format username without pinging - use @ but escape it
-                username = f"@{user.name}"
-                display_name = getattr(user, 'display_name', user.name)
-                if display_name != user.name:
-                    username = f"@{user.name} ({display_name})"
+                name, display_name = names
+                username = f"@{name}"
+                if display_name != name:
+                    username = f"@{name} ({display_name})"
                 
                 embed.add_field(
                     name=f"{medal} Level {level}",
@@ -1803,75 +2505,196 @@ async def slash_leaderboard(interaction: discord.Interaction):
             level_info += f"Level {level}: {xp_req:,} XP\n"
         
         embed.add_field(name="Level System", value=level_info, inline=False)
-        await interaction.response.send_message(embed=embed)
+        await quest_bot.outbound.respond(interaction, embed=embed)
         
-    except Exception as e:
-        print(f"Error in slash leaderboard command: {e}")
-        await interaction.response.send_message("❌ Could not retrieve leaderboard data. Please try again later.", ephemeral=True)
+    except Exception:
+        log.exception("Error in slash leaderboard command")
+        await quest_bot.outbound.respond(interaction, "❌ Could not retrieve leaderboard data. Please try again later.", ephemeral=True)
+
+@bot.tree.command(name="rank", description="Show your (or another member's) leaderboard position")
+@app_commands.describe(member="Optional: Member to look up")
+async def slash_rank(interaction: discord.Interaction, member: discord.Member = None):
+    target_member = member or interaction.user
+    position, ranked_count = await quest_bot.get_rank(target_member.id, interaction.guild.id)
+    total_xp = await quest_bot.calculate_total_user_xp(target_member.id, interaction.guild.id)
+    
+    if position is None:
+        description = f"{target_member.mention} is not ranked yet - complete quests to get on the leaderboard!"
+    else:
+        description = f"{target_member.mention} is ranked **#{position:,}** of {ranked_count:,}\n{total_xp:,} XP (Level {quest_bot.calculate_level(total_xp)})"
+    
+    embed = discord.Embed(title="🏆 Leaderboard Rank", description=description, color=0xffd700)
+    await quest_bot.outbound.respond(interaction, embed=embed)
 
 @bot.tree.command(name="createlevelroles", description="Manually create all level roles (Level 1-10)")
 async def slash_create_level_roles(interaction: discord.Interaction):
     if not interaction.user.guild_permissions.manage_roles:
-        await interaction.response.send_message("❌ You need Manage Roles permission to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Roles permission to use this command!", ephemeral=True)
         return
     
     await interaction.response.defer(ephemeral=True)
     await quest_bot.create_level_roles(interaction.guild)
-    await interaction.followup.send("✅ Level roles created/verified for Levels 1-10!", ephemeral=True)
+    await quest_bot.outbound.followup(interaction, "✅ Level roles created/verified for Levels 1-10!", ephemeral=True)
+
+@bot.tree.command(name="rebuildstreakxp", description="Recompute accumulated streak XP from the streak role history")
+async def slash_rebuild_streak_xp(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.manage_roles:
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Roles permission to use this command!", ephemeral=True)
+        return
+    
+    await interaction.response.defer(ephemeral=True)
+    rebuilt_count = await quest_bot.rebuild_streak_xp_totals(interaction.guild.id)
+    await quest_bot.outbound.followup(interaction, f"✅ Recomputed accumulated streak XP for {rebuilt_count} member(s)!", ephemeral=True)
 
 @bot.tree.command(name="assignlevelroles", description="Assign level roles to all users based on their current XP")
 async def slash_assign_level_roles(interaction: discord.Interaction):
     if not interaction.user.guild_permissions.manage_roles:
-        await interaction.response.send_message("❌ You need Manage Roles permission to use this command!", ephemeral=True)
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Roles permission to use this command!", ephemeral=True)
         return
     
     await interaction.response.defer(ephemeral=True)
+    status_message = await quest_bot.outbound.followup(interaction, "⏳ Checking level roles...", ephemeral=True, wait=True)
+    last_update = {'time': 0.0}
+    
+    async def progress(checked, total, changed):
+        # Throttle edits - the followup shares the interaction's rate limit
+        now = asyncio.get_running_loop().time()
+        if checked < total and now - last_update['time'] < 5:
+            return
+        last_update['time'] = now
+        try:
+            await quest_bot.outbound.edit_message(status_message, content=f"⏳ Checked {checked:,}/{total:,} members, updated {changed:,} level role(s)...")
+        except discord.HTTPException:
+            pass  # Interaction token expired - the run itself keeps going
     
-    # Get all users from database
-    leaderboard_data = quest_bot.get_leaderboard(interaction.guild.id, 1000)  # Get all users
+    try:
+        result = await quest_bot.assign_all_level_roles(interaction.guild, progress)
+    except Exception:
+        log.exception("Error assigning level roles", extra={"guild_id": interaction.guild.id})
+        try:
+            await quest_bot.outbound.edit_message(status_message, content="❌ Level role assignment failed - run the command again to resume where it stopped.")
+        except discord.HTTPException:
+            pass
+        return
+    if result is None:
+        await quest_bot.outbound.edit_message(status_message, content="⏳ A level role assignment is already running for this server.")
+        return
     
-    assigned_count = 0
-    for user_id, xp, level in leaderboard_data:
-        member = interaction.guild.get_member(user_id)
-        if member:
-            # Remove any existing level roles
-            level_roles = [role for role in member.roles if role.name.startswith("Level ")]
-            if level_roles:
-                await member.remove_roles(*level_roles, reason="Reassigning level roles")
-            
-            # Add correct level role
-            level_role_name = f"Level {level}"
-            level_role = discord.utils.get(interaction.guild.roles, name=level_role_name)
-            if level_role:
-                await member.add_roles(level_role, reason=f"Assigned {level_role_name} based on XP")
-                assigned_count += 1
+    checked, changed = result
+    try:
+        await quest_bot.outbound.edit_message(status_message, content=f"✅ Checked {checked:,} members and updated level roles for {changed:,} based on their current XP!")
+    except discord.HTTPException:
+        pass
+
+@bot.tree.command(name="botdiag", description="Show event loop lag and the slowest recent handlers")
+async def slash_bot_diag(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.manage_guild:
+        await quest_bot.outbound.respond(interaction, "❌ You need Manage Server permission to use this command!", ephemeral=True)
+        return
     
-    await interaction.followup.send(f"✅ Assigned level roles to {assigned_count} users based on their current XP!", ephemeral=True)
+    diag = quest_bot.loop_monitor.snapshot()
+    embed = discord.Embed(
+        title="🩺 Bot Diagnostics",
+        description=f"Loop lag: **{diag['lag'] * 1000:.0f}ms** (max {diag['max_lag'] * 1000:.0f}ms recently)\n"
+                    f"Gateway latency: **{bot.latency * 1000:.0f}ms**\n"
+                    f"Slow callbacks (over {diag['slow_threshold'] * 1000:.0f}ms): **{diag['slow_count']}** since start",
+        color=0x0099ff
+    )
+    now = time.time()
+    for record in diag['slow_callbacks'][:5]:
+        # The innermost frames point at the blocking call
+        where = "".join(record['stack'][-2:]).strip() or "no stack captured"
+        embed.add_field(
+            name=f"{record['duration'] * 1000:.0f}ms - {int(now - record['when'])}s ago"[:256],
+            value=f"`{record['name'][:200]}`\n```{where[-700:]}```",
+            inline=False
+        )
+    await quest_bot.outbound.respond(interaction, embed=embed, ephemeral=True)
 
 # Error handling
 @bot.event
 async def on_command_error(ctx, error):
+    if ctx.interaction is not None:
+        # Failed hybrid commands run as slash commands skip the tree's completion and error hooks
+        observe_slash_command(ctx.interaction, ctx.interaction.command, "error")
     if isinstance(error, commands.MissingPermissions):
-        await ctx.send("❌ You don't have permission to use this command!", delete_after=5)
+        await quest_bot.outbound.send(ctx, "❌ You don't have permission to use this command!", delete_after=5)
     elif isinstance(error, commands.MissingRole):
-        await ctx.send("❌ You need the @staff role to use this command!", delete_after=5)
+        await quest_bot.outbound.send(ctx, "❌ You need the @staff role to use this command!", delete_after=5)
     elif isinstance(error, commands.BadArgument):
-        await ctx.send("❌ Invalid argument provided!", delete_after=5)
+        await quest_bot.outbound.send(ctx, "❌ Invalid argument provided!", delete_after=5)
     else:
-        await ctx.send("❌ An error occurred while processing the command!", delete_after=5)
+        await quest_bot.outbound.send(ctx, "❌ An error occurred while processing the command!", delete_after=5)
+
+async def check_gateway():
+    if bot.is_closed():
+        return False, "closed"
+    if not bot.is_ready():
+        return False, "not connected"
+    return True, f"latency {bot.latency * 1000:.0f}ms"
+
+async def check_database():
+    # A no-op write still has to go through a group commit
+    await quest_bot.db.execute("DELETE FROM bot_state WHERE key = 'readiness_probe'")
+    return True, "writable"
+
+async def check_loop_lag():
+    lag = quest_bot.loop_monitor.lag
+    return lag < LOOP_LAG_THRESHOLD, f"{lag * 1000:.0f}ms"
+
+async def serve_metrics(request):
+    return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+async def serve_loop_diag(request):
+    return web.json_response(quest_bot.loop_monitor.snapshot())
+
+def request_shutdown():
+    """SIGTERM handler - post pending role gain digests while still connected, then log out"""
+    if quest_bot.shutdown_task is None:
+        quest_bot.shutdown_task = asyncio.create_task(shutdown())
+
+async def shutdown():
+    await quest_bot.notifications.close()
+    await bot.close()
+
+async def main():
+    # Metrics and stack traces stay off the public port (see DIAG_HOST/DIAG_PORT)
+    quest_bot.web.add_route("GET", "/metrics", serve_metrics, private=True)
+    quest_bot.web.add_route("GET", "/debug/loop", serve_loop_diag, private=True)
+    quest_bot.web.add_check("gateway", check_gateway)
+    quest_bot.web.add_check("database", check_database)
+    quest_bot.web.add_check("loop_lag", check_loop_lag)
+    
+    async with bot:
+        # SIGTERM (e.g. from the host on redeploy) closes the bot like a normal logout
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, request_shutdown)
+        except NotImplementedError:
+            pass  # Windows
+        quest_bot.loop_monitor.start()
+        await quest_bot.web.start()
+        try:
+            await bot.start(TOKEN)
+        finally:
+            await quest_bot.web.stop()
+            await quest_bot.close()
+            quest_bot.loop_monitor.stop()
 
 if __name__ == "__main__":
-    import os
-    
     # Get token from environment variable
     TOKEN = os.getenv('DISCORD_BOT_TOKEN')
     
     if not TOKEN:
-        print("Error: DISCORD_BOT_TOKEN environment variable not set!")
-        print("Please set your Discord bot token as an environment variable.")
+        log.error("DISCORD_BOT_TOKEN environment variable not set! Please set your Discord bot token as an environment variable.")
+        log_listener.stop()
         exit(1)
-
-    webserver.keep_alive()
     
-    # Run the bot
-    bot.run(TOKEN)
+    # Run the bot and the web server on one event loop
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    
+    # Flush and stop the database thread after the bot disconnects
+    quest_bot.db.close()
+    log_listener.stop()
@@ -0,0 +1,13 @@
+import hashlib
+import json
+from typing import Optional
+
+import discord
+
+
+def command_fingerprint(tree, application_id: Optional[int], guild: Optional[discord.abc.Snowflake] = None) -> str:
+    """Hash of everything a sync would upload (names, descriptions, options, permissions)"""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+                     key=lambda command: (command.get("type", 1), command["name"]))
+    data = json.dumps({"application_id": application_id, "commands": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
@@ -0,0 +1,188 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+# Maximum number of database jobs that may be waiting on the DB thread at once.
+# Callers awaiting a slot simply yield to the event loop instead of piling up work.
+DEFAULT_MAX_PENDING = 1000
+
+# Group commit: writes are collected into one transaction that is committed once
+# the oldest write has waited FLUSH_INTERVAL seconds or MAX_BATCH writes are pending.
+# Reads and raw jobs commit the pending batch first, so they never see (or end) a
+# transaction other callers are still waiting on.
+DEFAULT_FLUSH_INTERVAL = 0.005
+DEFAULT_MAX_BATCH = 200
+
+# Job kinds
+_READ = 0
+_WRITE = 1
+_RAW = 2
+
+
+class Database:
+    """Async repository layer that runs every SQLite call on one dedicated thread"""
+
+    def __init__(self, path: str, max_pending: int = DEFAULT_MAX_PENDING,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL, max_batch: int = DEFAULT_MAX_BATCH):
+        self.path = path
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.commits = 0
+        self._jobs = queue.Queue()
+        self._slots = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="questbot-db", daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        """Open the connection in autocommit mode so the worker controls transactions itself"""
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        # WAL lets readers proceed during a commit; NORMAL sync only fsyncs at checkpoints, so
+        # the last commits before a power loss (not a crash of the bot) can be rolled back.
+        # That's acceptable for XP - "committed" below means committed, not fsynced.
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _worker(self):
+        """DB thread main loop - owns the sqlite3 connection for its whole lifetime"""
+        connection = self._connect()
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if not batch else max(0.0, deadline - time.monotonic())
+                try:
+                    job = self._jobs.get(timeout=timeout)
+                except queue.Empty:
+                    self._flush(connection, batch)
+                    batch = []
+                    continue
+                if job is None:
+                    break
+                kind, fn, args, future = job
+                if not future.set_running_or_notify_cancel():
+                    continue
+                if kind != _WRITE:
+                    if batch:
+                        self._flush(connection, batch)
+                        batch = []
+                    try:
+                        future.set_result(fn(connection, *args))
+                    except BaseException as e:
+                        future.set_exception(e)
+                    continue
+
+                # Each write runs inside a savepoint so a failing statement only undoes itself
+                if not connection.in_transaction:
+                    connection.execute('BEGIN')
+                connection.execute('SAVEPOINT job')
+                try:
+                    result = fn(connection, *args)
+                    connection.execute('RELEASE job')
+                except BaseException as e:
+                    connection.execute('ROLLBACK TO job')
+                    connection.execute('RELEASE job')
+                    future.set_exception(e)
+                    continue
+                batch.append((future, result))
+                if len(batch) == 1:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) >= self.max_batch:
+                    self._flush(connection, batch)
+                    batch = []
+        finally:
+            self._flush(connection, batch)
+            connection.close()
+
+    def _flush(self, connection, batch):
+        """Commit the open transaction and resolve every write waiting on it"""
+        try:
+            if connection.in_transaction:
+                connection.execute('COMMIT')
+                self.commits += 1
+        except BaseException as e:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            for future, _ in batch:
+                future.set_exception(e)
+            return
+        for future, result in batch:
+            future.set_result(result)
+
+    def _submit(self, kind: int, fn: Callable, args: tuple) -> Future:
+        if self._closed:
+            raise RuntimeError("Database is closed")
+        future = Future()
+        self._jobs.put((kind, fn, args, future))
+        return future
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Queue fn(connection, *args) on the DB thread and return a concurrent Future
+
+        Raw jobs run outside any group commit and may manage their own transactions.
+        """
+        return self._submit(_RAW, fn, args)
+
+    def run_sync(self, fn: Callable, *args) -> Any:
+        """Run a job and block until it finishes (startup/shutdown only, never inside handlers)"""
+        return self.submit(fn, *args).result()
+
+    async def _await(self, kind: int, fn: Callable, args: tuple) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            return await asyncio.wrap_future(self._submit(kind, fn, args))
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run fn(connection, *args) on the DB thread without blocking the event loop"""
+        return await self._await(_RAW, fn, args)
+
+    async def write(self, fn: Callable, *args) -> Any:
+        """Run fn(connection, *args) as part of the next group commit and wait until it is committed"""
+        return await self._await(_WRITE, fn, args)
+
+    async def fetchone(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        """Run a read query and return the first row"""
+        return await self._await(_READ, _fetchone, (sql, params))
+
+    async def fetchall(self, sql: str, params: tuple = ()) -> list:
+        """Run a read query and return every row"""
+        return await self._await(_READ, _fetchall, (sql, params))
+
+    async def execute(self, sql: str, params: tuple = ()) -> int:
+        """Run a single write statement and wait for its commit, returns the affected row count"""
+        return await self._await(_WRITE, _execute, (sql, params))
+
+    async def executemany(self, sql: str, seq_of_params: list) -> int:
+        """Run a write statement for every parameter tuple and wait for the commit"""
+        return await self._await(_WRITE, _executemany, (sql, seq_of_params))
+
+    def close(self):
+        """Stop the DB thread after it drains and commits every queued job"""
+        if self._closed:
+            return
+        self._closed = True
+        self._jobs.put(None)
+        self._thread.join()
+
+
+def _fetchone(connection, sql, params):
+    return connection.execute(sql, params).fetchone()
+
+
+def _fetchall(connection, sql, params):
+    return connection.execute(sql, params).fetchall()
+
+
+def _execute(connection, sql, params):
+    return connection.execute(sql, params).rowcount
+
+
+def _executemany(connection, sql, seq_of_params):
+    return connection.executemany(sql, seq_of_params).rowcount
@@ -0,0 +1,164 @@
+import random
+from typing import Dict, List, Optional, Tuple
+
+# 2^24 members per guild before the skip list degrades - far above Discord's guild limits
+MAX_LEVELS = 24
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next = [None] * levels
+        # width[i] = how many positions next[i] skips ahead (including the target)
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """Sorted container with O(log n) insert/remove/rank and O(k) in-order iteration"""
+
+    def __init__(self, max_levels: int = MAX_LEVELS):
+        self.max_levels = max_levels
+        self.size = 0
+        self._head = _Node(None, max_levels)
+
+    def __len__(self):
+        return self.size
+
+    def _random_levels(self) -> int:
+        levels = 1
+        while levels < self.max_levels and random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def load_sorted(self, keys: list):
+        """Build an empty list from already sorted keys in O(n)"""
+        if self.size:
+            raise ValueError("load_sorted requires an empty skip list")
+        last = [self._head] * self.max_levels
+        last_position = [0] * self.max_levels
+        for position, key in enumerate(keys, 1):
+            levels = self._random_levels()
+            node = _Node(key, levels)
+            for level in range(levels):
+                previous = last[level]
+                previous.next[level] = node
+                previous.width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+        for level in range(self.max_levels):
+            last[level].width[level] = len(keys) + 1 - last_position[level]
+        self.size = len(keys)
+
+    def insert(self, key):
+        chain = [None] * self.max_levels
+        steps_at_level = [0] * self.max_levels
+        node = self._head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_levels()
+        new_node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            previous = chain[level]
+            new_node.next[level] = previous.next[level]
+            previous.next[level] = new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.max_levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain = [None] * self.max_levels
+        node = self._head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        levels = len(target.next)
+        for level in range(levels):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(levels, self.max_levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key) -> Optional[int]:
+        """1-based position of key, or None if it is not present"""
+        position = 0
+        node = self._head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].key <= key:
+                position += node.width[level]
+                node = node.next[level]
+        return position if node is not self._head and node.key == key else None
+
+    def first(self, count: int) -> list:
+        """The smallest count keys in order"""
+        keys = []
+        node = self._head.next[0]
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class LeaderboardIndex:
+    """Per-guild ranking of members by total XP (highest first, ties broken by user ID)"""
+
+    def __init__(self):
+        self._totals: Dict[int, int] = {}
+        self._order = IndexableSkipList()
+
+    def __len__(self):
+        return len(self._totals)
+
+    @classmethod
+    def from_totals(cls, totals: Dict[int, int]) -> 'LeaderboardIndex':
+        """Build an index for many members at once (O(n log n) sort, no per-member inserts)"""
+        index = cls()
+        index._totals = {user_id: total_xp for user_id, total_xp in totals.items() if total_xp > 0}
+        index._order.load_sorted(sorted((-total_xp, user_id) for user_id, total_xp in index._totals.items()))
+        return index
+
+    def update(self, user_id: int, total_xp: int):
+        """Record a member's new total - members with 0 XP are not ranked"""
+        old_total = self._totals.get(user_id)
+        if old_total == total_xp:
+            return
+        if old_total is not None:
+            self._order.remove((-old_total, user_id))
+        if total_xp > 0:
+            self._order.insert((-total_xp, user_id))
+            self._totals[user_id] = total_xp
+        else:
+            self._totals.pop(user_id, None)
+
+    def remove(self, user_id: int):
+        self.update(user_id, 0)
+
+    def total(self, user_id: int) -> int:
+        return self._totals.get(user_id, 0)
+
+    def top(self, count: int) -> List[Tuple[int, int]]:
+        """[(user_id, total_xp)] for the top count members in O(count)"""
+        return [(user_id, -negative_total) for negative_total, user_id in self._order.first(count)]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """1-based leaderboard position in O(log n), or None if the member has no XP"""
+        total_xp = self._totals.get(user_id)
+        if total_xp is None:
+            return None
+        return self._order.rank((-total_xp, user_id))
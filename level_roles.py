@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+import discord
+
+from outbound import BULK, NOTIFICATION
+
+log = logging.getLogger("questbot.level_roles")
+
+# How long a member's level change waits for newer changes before it is applied.
+# Quest bursts that move a member through several levels collapse into one edit.
+DEFAULT_SETTLE_DELAY = 0.5
+
+# Bulk reconciliation: members checked per resumable checkpoint, and role edits queued at
+# once. Bulk edits go out at the lowest outbound priority, so quest replies and single-member
+# level changes overtake them.
+BULK_CHUNK_SIZE = 50
+BULK_CONCURRENCY = 3
+
+
+def level_role_name(level: int) -> str:
+    return f"Level {level}"
+
+
+def is_level_role(role) -> bool:
+    return role.name.startswith("Level ")
+
+
+class LevelRoleReconciler:
+    """Per-member level role jobs - only the latest target level is applied, in one member.edit call"""
+
+    def __init__(self, bot, outbound, members, create_level_roles: Callable, settle_delay: float = DEFAULT_SETTLE_DELAY):
+        self.bot = bot
+        self.outbound = outbound
+        self.members = members
+        self.create_level_roles = create_level_roles
+        self.settle_delay = settle_delay
+        self._targets: Dict[Tuple[int, int], int] = {}
+        self._tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def schedule(self, guild_id: int, user_id: int, level: int):
+        """Request that a member ends up with exactly the given level role (supersedes pending requests)"""
+        key = (guild_id, user_id)
+        self._targets[key] = level
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def _run(self, key: Tuple[int, int]):
+        try:
+            while key in self._targets:
+                await asyncio.sleep(self.settle_delay)
+                level = self._targets.pop(key)
+                await self.apply(key[0], key[1], level)
+        finally:
+            self._tasks.pop(key, None)
+
+    async def apply(self, guild_id: int, user_id: int, level: int) -> bool:
+        """Give a member exactly one level role with a single API call, returns True if roles changed"""
+        try:
+            guild = self.bot.get_guild(guild_id)
+            if not guild:
+                log.debug("Guild %s not found", guild_id)
+                return False
+
+            if self.members.role_ids(guild, user_id) is None:
+                log.debug("Member %s not found in guild %s", user_id, guild_id)
+                return False
+
+            new_role_name = level_role_name(level)
+            new_role = discord.utils.get(guild.roles, name=new_role_name)
+            if not new_role:
+                # Create the role if it doesn't exist
+                log.info("Creating missing level roles", extra={"guild_id": guild_id})
+                await self.create_level_roles(guild)
+                new_role = discord.utils.get(guild.roles, name=new_role_name)
+                if not new_role:
+                    log.error("Failed to create %s", new_role_name, extra={"guild_id": guild_id})
+                    return False
+
+            return await self._set_level_role(guild, user_id, new_role)
+        except Exception:
+            log.exception("Error updating user level role", extra={"guild_id": guild_id, "user_id": user_id})
+        return False
+
+    async def _set_level_role(self, guild, user_id: int, new_role, priority: int = NOTIFICATION) -> bool:
+        """Replace a member's level roles with new_role in one member.edit call (no-op if already correct)
+
+        member.edit(roles=...) replaces every role, so the list is worked out when the queued edit
+        runs - one computed earlier would undo role changes made while it waited.
+        """
+        async def edit():
+            member = await self.members.current(guild, user_id)
+            if not member:
+                return None
+            current_roles = [role for role in member.roles if not role.is_default()]
+            desired_roles = [role for role in current_roles if not is_level_role(role)] + [new_role]
+            if set(desired_roles) == set(current_roles):
+                return None
+            await member.edit(roles=desired_roles, reason=f"Reached {new_role.name}")
+            return member, [role.name for role in current_roles if is_level_role(role) and role != new_role]
+
+        try:
+            edited = await self.outbound.call(priority, guild.id, f"guild:{guild.id}:members", edit)
+        except discord.Forbidden as e:
+            log.warning("Bot lacks permission to manage roles: %s - make sure the bot role is higher than the Level roles in server settings", e,
+                        extra={"guild_id": guild.id})
+            return False
+        if not edited:
+            return False
+        member, removed_roles = edited
+        log.debug("%s: Removed %s → Added %s", member.display_name, removed_roles, new_role.name,
+                  extra={"guild_id": guild.id, "user_id": user_id})
+        return True
+
+    async def reconcile_members(self, guild, desired_levels: Dict[int, int], start_after: int = 0,
+                                checkpoint: Optional[Callable[[int, int, int], Awaitable]] = None,
+                                progress: Optional[Callable[[int, int, int], Awaitable]] = None,
+                                concurrency: int = BULK_CONCURRENCY) -> Tuple[int, int]:
+        """Give every member in desired_levels (user_id -> level) their level role, returns (checked, changed)
+
+        Members are visited in user ID order and only those whose level roles differ are edited.
+        checkpoint(last_user_id, checked, changed) is awaited after every chunk so an interrupted run
+        can resume by passing that ID back as start_after; progress(checked, total, changed) reports
+        along the way.
+        """
+        level_role_by_level = {level: discord.utils.get(guild.roles, name=level_role_name(level)) for level in range(1, 11)}
+        if not all(level_role_by_level.values()):
+            await self.create_level_roles(guild)
+            level_role_by_level = {level: discord.utils.get(guild.roles, name=level_role_name(level)) for level in range(1, 11)}
+
+        level_role_ids = {role.id for role in level_role_by_level.values() if role}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fix(user_id, role):
+            async with semaphore:
+                try:
+                    # Lean member mode fetches the full member only when an edit is needed
+                    return await self._set_level_role(guild, user_id, role, BULK)
+                except Exception:
+                    log.exception("Error assigning level role to user %s", user_id, extra={"guild_id": guild.id})
+                    return False
+
+        user_ids = sorted(user_id for user_id in desired_levels if user_id > start_after)
+        checked = 0
+        changed = 0
+        for start in range(0, len(user_ids), BULK_CHUNK_SIZE):
+            chunk = user_ids[start:start + BULK_CHUNK_SIZE]
+            jobs = []
+            for user_id in chunk:
+                role_ids = self.members.role_ids(guild, user_id)
+                role = level_role_by_level.get(desired_levels[user_id])
+                if role_ids is None or not role:
+                    continue
+                if role_ids & level_role_ids != {role.id}:
+                    jobs.append(fix(user_id, role))
+            if jobs:
+                changed += sum(await asyncio.gather(*jobs))
+            checked += len(chunk)
+            if checkpoint:
+                await checkpoint(chunk[-1], checked, changed)
+            if progress:
+                await progress(checked, len(user_ids), changed)
+        return checked, changed
@@ -0,0 +1,107 @@
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Tuple
+
+# Level for every logger not listed in LOG_LEVELS
+DEFAULT_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Per-logger levels, e.g. "questbot.xp=DEBUG,discord.gateway=WARNING"
+LOGGER_LEVELS = os.getenv('LOG_LEVELS', '')
+# Noisy debug sites: each call site may log this many records per interval, the rest are counted and dropped
+DEBUG_SAMPLE_BURST = 20
+DEBUG_SAMPLE_INTERVAL = 60.0
+
+# LogRecord attributes that aren't user supplied extra={...} fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line - time, level, logger, message, extra={...} fields and any traceback"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class DebugSampler(logging.Filter):
+    """Rate limits DEBUG records per call site
+
+    A site that goes over its burst is silenced until the interval ends; the next record
+    it gets through carries the number dropped in between as "suppressed".
+    """
+
+    def __init__(self, burst: int = DEBUG_SAMPLE_BURST, interval: float = DEBUG_SAMPLE_INTERVAL):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # (logger, file, line) -> [window start, records let through, records dropped]
+        self._sites: Dict[Tuple[str, str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= self.interval:
+            dropped = site[2] if site else 0
+            site = self._sites[key] = [now, 0, 0]
+            if dropped:
+                record.suppressed = dropped
+        if site[1] >= self.burst:
+            site[2] += 1
+            return False
+        site[1] += 1
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge args and render the traceback now - objects in args may change once the record
+        # is on the queue - but leave the JSON encoding to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging() -> QueueListener:
+    """Route all logging through a queue to a background thread that writes JSON lines to stdout
+
+    Returns the started listener; stop() it on shutdown to flush what's still queued.
+    """
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(DebugSampler())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(DEFAULT_LEVEL)
+    for entry in LOGGER_LEVELS.split(','):
+        if '=' in entry:
+            name, level = entry.split('=', 1)
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
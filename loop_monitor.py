@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+log = logging.getLogger("questbot.loop")
+
+# How often the loop is sampled
+DEFAULT_INTERVAL = 0.5
+# Callbacks (task steps, timers) running longer than this are recorded as slow
+DEFAULT_SLOW_THRESHOLD = 0.1
+# Slow callbacks kept for /botdiag, oldest dropped first
+DEFAULT_HISTORY = 50
+# Lag samples kept for the recent maximum (a minute at the default interval)
+LAG_SAMPLES = 120
+# Innermost frames kept per recorded stack
+STACK_LIMIT = 12
+
+
+class SlowCallback:
+    """One event loop step that held the loop for longer than the threshold"""
+    __slots__ = ('when', 'duration', 'name', 'stack')
+
+    def __init__(self, when: float, duration: float, name: str, stack: List[str]):
+        self.when = when          # wall clock time the step finished
+        self.duration = duration
+        self.name = name          # task name and coroutine, or the callback
+        self.stack = stack        # where the loop was stuck, innermost frame last
+
+    def to_dict(self) -> dict:
+        return {"when": self.when, "duration": self.duration, "name": self.name, "stack": self.stack}
+
+
+def _describe(handle: asyncio.Handle) -> str:
+    callback = handle._callback
+    task = getattr(callback, '__self__', None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        coro_name = getattr(coro, '__qualname__', repr(coro))
+        # discord.py names event tasks after the event, e.g. "discord.py: on_member_update"
+        name = task.get_name()
+        return coro_name if name.startswith('Task-') else f"{name} ({coro_name})"
+    return getattr(callback, '__qualname__', repr(callback))
+
+
+def _task_stack(handle: asyncio.Handle) -> List[str]:
+    """Where a task's coroutine is suspended now - the best we have if the watchdog missed the step"""
+    task = getattr(handle._callback, '__self__', None)
+    if not isinstance(task, asyncio.Task):
+        return []
+    frames = task.get_stack(limit=STACK_LIMIT)
+    return traceback.format_list(traceback.StackSummary.extract((frame, frame.f_lineno) for frame in frames))
+
+
+class LoopLagMonitor:
+    """Samples event loop lag and traces slow callbacks
+
+    Lag is how much later than asked a sleep(interval) wakes up. Slow callbacks are caught by
+    timing every Handle the loop runs; a watchdog thread grabs the loop thread's stack while a
+    step is still running past the threshold, so the record shows the blocking call itself.
+
+    The timing wraps asyncio.Handle._run, which is private: if this Python doesn't have it only
+    lag is sampled, and stop() puts the original back.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, slow_threshold: float = DEFAULT_SLOW_THRESHOLD,
+                 history: int = DEFAULT_HISTORY):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.lag = 0.0
+        self.lag_samples: Deque[float] = deque(maxlen=LAG_SAMPLES)
+        self.slow: Deque[SlowCallback] = deque(maxlen=history)
+        self.slow_count = 0
+        self._task: Optional[asyncio.Task] = None
+        self._original_run = None
+        self._patched_run = None
+        self._loop_thread_id = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        # (step number, start time) of the step running right now, replaced as one object so the
+        # watchdog thread never pairs one step's start with another's number
+        self._step = 0
+        self._current: Optional[Tuple[int, float]] = None
+        # (step number, stack) captured by the watchdog for a step still running
+        self._step_stack: Optional[Tuple[int, List[str]]] = None
+
+    @property
+    def max_lag(self) -> float:
+        """Worst lag among the recent samples"""
+        return max(self.lag_samples, default=0.0)
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        self._loop_thread_id = threading.get_ident()
+        if not self._install():
+            log.warning("asyncio.Handle._run is not available - slow callbacks will not be traced")
+            return
+        self._stopping.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="questbot-loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._original_run:
+            # Only undo our own wrapper - something patched over it keeps its change
+            if asyncio.Handle.__dict__.get('_run') is self._patched_run:
+                asyncio.Handle._run = self._original_run
+            self._original_run = None
+            self._patched_run = None
+        self._stopping.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - started - self.interval)
+            self.lag_samples.append(self.lag)
+
+    def _install(self) -> bool:
+        """Time every callback the loop runs (TimerHandle inherits Handle._run), False if it can't"""
+        original_run = asyncio.Handle.__dict__.get('_run')
+        if not callable(original_run):
+            return False
+        self._original_run = original_run
+        monitor = self
+
+        def _run(handle):
+            if threading.get_ident() != monitor._loop_thread_id:
+                return original_run(handle)
+            monitor._step += 1
+            step = monitor._step
+            started = time.perf_counter()
+            monitor._current = (step, started)
+            try:
+                return original_run(handle)
+            finally:
+                duration = time.perf_counter() - started
+                monitor._current = None
+                if duration >= monitor.slow_threshold:
+                    monitor._record(handle, step, duration)
+
+        asyncio.Handle._run = self._patched_run = _run
+        return True
+
+    def _record(self, handle: asyncio.Handle, step: int, duration: float):
+        captured = self._step_stack
+        stack = captured[1] if captured and captured[0] == step else _task_stack(handle)
+        self.slow.append(SlowCallback(time.time(), duration, _describe(handle), stack))
+        self.slow_count += 1
+
+    def _watch(self):
+        """Watchdog thread: capture the loop thread's stack while a step runs past the threshold"""
+        captured_step = None
+        while not self._stopping.wait(self.slow_threshold / 2):
+            current = self._current
+            if current is None:
+                continue
+            step, started = current
+            if step == captured_step or time.perf_counter() - started < self.slow_threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)[-STACK_LIMIT:]
+            # The frame belongs to this step only if it was still running after the frame was taken;
+            # the step number on the stack also keeps _record from pinning it on a later step
+            if self._current is current:
+                self._step_stack = (step, stack)
+                captured_step = step
+
+    def snapshot(self) -> dict:
+        """Current lag and the recorded slow callbacks, newest first"""
+        return {
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "slow_threshold": self.slow_threshold,
+            "slow_count": self.slow_count,
+            "slow_callbacks": [record.to_dict() for record in reversed(self.slow)],
+        }
@@ -0,0 +1,149 @@
+from array import array
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import discord
+
+
+_NO_ROLES = array('Q')
+
+
+class LeanMember:
+    """What the bot keeps about a member in lean mode - names and XP-relevant role IDs"""
+    __slots__ = ('name', 'nick', 'role_ids')
+
+    def __init__(self, name: str, nick: Optional[str], role_ids: array):
+        self.name = name
+        self.nick = nick          # only set when the display name differs from the username
+        self.role_ids = role_ids  # sorted array of the member's XP-relevant role IDs
+
+    @property
+    def display_name(self) -> str:
+        return self.nick or self.name
+
+
+class LeanMemberStore:
+    """Per-guild compact member records, filtered to the role IDs that matter for XP
+
+    relevant(guild_id) is the role ID set a guild was loaded with. If a guild's XP-relevant
+    roles grow beyond it (new assignment, new badge role) the guild has to be loaded again.
+    """
+
+    def __init__(self):
+        self._guilds: Dict[int, Dict[int, LeanMember]] = {}
+        self._relevant: Dict[int, FrozenSet[int]] = {}
+
+    def __len__(self):
+        return sum(len(members) for members in self._guilds.values())
+
+    def is_loaded(self, guild_id: int) -> bool:
+        return guild_id in self._guilds
+
+    def relevant(self, guild_id: int) -> FrozenSet[int]:
+        return self._relevant.get(guild_id, frozenset())
+
+    def _record(self, guild_id: int, name: str, display_name: str, role_ids: Iterable[int]) -> LeanMember:
+        relevant = self._relevant.get(guild_id, frozenset())
+        kept = sorted(role_id for role_id in role_ids if role_id in relevant)
+        return LeanMember(name, display_name if display_name != name else None, array('Q', kept) if kept else _NO_ROLES)
+
+    def load(self, guild_id: int, relevant: FrozenSet[int], members: Iterable[discord.Member]):
+        """Replace a guild's records from full Member objects (e.g. guild.chunk(cache=False))"""
+        self._relevant[guild_id] = relevant
+        self._guilds[guild_id] = {member.id: self._record(guild_id, member.name, member.display_name, (role.id for role in member.roles))
+                                  for member in members}
+
+    def update(self, guild_id: int, user_id: int, name: str, display_name: str, role_ids: Iterable[int]) -> Optional[LeanMember]:
+        """Store a member's new state, returns the previous record (None if unknown)"""
+        members = self._guilds.get(guild_id)
+        if members is None:
+            return None
+        previous = members.get(user_id)
+        members[user_id] = self._record(guild_id, name, display_name, role_ids)
+        return previous
+
+    def remove(self, guild_id: int, user_id: int):
+        members = self._guilds.get(guild_id)
+        if members:
+            members.pop(user_id, None)
+
+    def remove_guild(self, guild_id: int):
+        self._guilds.pop(guild_id, None)
+        self._relevant.pop(guild_id, None)
+
+    def get(self, guild_id: int, user_id: int) -> Optional[LeanMember]:
+        members = self._guilds.get(guild_id)
+        return members.get(user_id) if members else None
+
+    def members(self, guild_id: int) -> Dict[int, LeanMember]:
+        return self._guilds.get(guild_id, {})
+
+
+class MemberDirectory:
+    """Member lookups the XP code needs, served from discord.py's member cache or a LeanMemberStore"""
+
+    def __init__(self, lean: bool = False):
+        self.store = LeanMemberStore() if lean else None
+
+    @property
+    def lean(self) -> bool:
+        return self.store is not None
+
+    def is_loaded(self, guild) -> bool:
+        """Whether the guild's member data is available (chunked, or loaded into the lean store)"""
+        return self.store.is_loaded(guild.id) if self.store is not None else guild.chunked
+
+    async def load(self, guild, relevant: FrozenSet[int]):
+        """Fetch every member of a guild - cached by discord.py, or kept as lean records in lean mode"""
+        if self.store is None:
+            await guild.chunk()
+            return
+        self.store.load(guild.id, relevant, await guild.chunk(cache=False))
+
+    def needs_reload(self, guild_id: int, relevant: FrozenSet[int]) -> bool:
+        """True if a lean guild was loaded without some of its now XP-relevant roles"""
+        return self.store is not None and self.store.is_loaded(guild_id) and not relevant <= self.store.relevant(guild_id)
+
+    def role_ids(self, guild, user_id: int) -> Optional[FrozenSet[int]]:
+        """IDs of the member's roles (only XP-relevant ones in lean mode), or None if not a member"""
+        if self.store is not None:
+            record = self.store.get(guild.id, user_id)
+            return frozenset(record.role_ids) if record else None
+        member = guild.get_member(user_id)
+        return frozenset(role.id for role in member.roles) if member else None
+
+    def member_roles(self, guild) -> Iterable[Tuple[int, FrozenSet[int]]]:
+        """(user_id, role_ids) for every known member of a guild"""
+        if self.store is not None:
+            return [(user_id, frozenset(record.role_ids)) for user_id, record in self.store.members(guild.id).items()]
+        return [(member.id, frozenset(role.id for role in member.roles)) for member in guild.members]
+
+    def holders(self, guild, role_id: int) -> List[Tuple[int, FrozenSet[int]]]:
+        """(user_id, role_ids) for every member holding a role"""
+        if self.store is not None:
+            return [(user_id, frozenset(record.role_ids)) for user_id, record in self.store.members(guild.id).items()
+                    if role_id in record.role_ids]
+        role = guild.get_role(role_id)
+        return [(member.id, frozenset(r.id for r in member.roles)) for member in role.members] if role else []
+
+    def names(self, guild, user_id: int) -> Optional[Tuple[str, str]]:
+        """(username, display name) of a member, or None if not a member"""
+        if self.store is not None:
+            record = self.store.get(guild.id, user_id)
+            return (record.name, record.display_name) if record else None
+        member = guild.get_member(user_id)
+        return (member.name, member.display_name) if member else None
+
+    async def current(self, guild, user_id: int) -> Optional[discord.Member]:
+        """An up-to-date full Member for a role edit - cached when possible, fetched in lean mode
+
+        Call it from inside the outbound job making the edit, so the roles are read right before
+        they are written.
+        """
+        member = guild.get_member(user_id)
+        if member or self.store is None or self.store.get(guild.id, user_id) is None:
+            return member
+        try:
+            return await guild.fetch_member(user_id)
+        except discord.NotFound:
+            self.store.remove(guild.id, user_id)
+            return None
@@ -0,0 +1,190 @@
+import json
+import logging
+from typing import Callable, List, Optional
+
+log = logging.getLogger("questbot.migrations")
+
+# Rows copied per transaction when a migration rebuilds a large table.
+# Each chunk commits on its own so the write lock is only held briefly.
+DEFAULT_CHUNK_SIZE = 5000
+
+
+class Migration:
+    """One schema change - optional chunked prepare step plus a transactional apply step"""
+
+    def __init__(self, version: int, description: str, apply: Callable,
+                 prepare: Optional[Callable] = None):
+        self.version = version
+        self.description = description
+        self.apply = apply
+        self.prepare = prepare
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, description: str, prepare: Optional[Callable] = None):
+    """Register the decorated function as the apply step of a schema migration"""
+    def decorator(fn):
+        MIGRATIONS.append(Migration(version, description, fn, prepare))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return decorator
+
+
+def get_schema_version(connection) -> int:
+    """Return the current schema version (0 for databases that predate versioning)"""
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    result = connection.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return result[0] if result[0] is not None else 0
+
+
+def apply_migrations(connection, chunk_size: int = DEFAULT_CHUNK_SIZE) -> List[int]:
+    """Apply every pending migration in order, returns the versions applied
+
+    The connection must be in autocommit mode (isolation_level=None). Each migration's
+    prepare step may commit in chunks; its apply step and the version bump share one
+    transaction, so a crash leaves the schema at the previous version and the migration
+    simply re-runs on the next start.
+    """
+    current_version = get_schema_version(connection)
+    applied = []
+    for pending in MIGRATIONS:
+        if pending.version <= current_version:
+            continue
+        log.info("Applying schema migration %d: %s", pending.version, pending.description)
+        if pending.prepare:
+            pending.prepare(connection, chunk_size)
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            pending.apply(connection)
+            connection.execute('INSERT INTO schema_version (version) VALUES (?)', (pending.version,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        current_version = pending.version
+        applied.append(pending.version)
+    return applied
+
+
+def _copy_users_in_chunks(connection, chunk_size: int):
+    """Copy legacy users rows into users_v2 a chunk at a time (safe to resume after a crash)"""
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS users_v2 (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            xp INTEGER NOT NULL DEFAULT 0,
+            level INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''')
+    last_rowid = -1
+    while True:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute('''
+                SELECT rowid, guild_id, user_id, COALESCE(xp, 0), COALESCE(level, 1) FROM users
+                WHERE rowid > ? AND guild_id IS NOT NULL AND user_id IS NOT NULL
+                ORDER BY rowid LIMIT ?
+            ''', (last_rowid, chunk_size)).fetchall()
+            connection.executemany('INSERT OR IGNORE INTO users_v2 (guild_id, user_id, xp, level) VALUES (?, ?, ?, ?)',
+                                   [row[1:] for row in rows])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        if len(rows) < chunk_size:
+            break
+        last_rowid = rows[-1][0]
+
+
+@migration(1, "key users on (guild_id, user_id) and add leaderboard/streak indexes", prepare=_copy_users_in_chunks)
+def _rebuild_users_per_guild(connection):
+    # The bot is the only writer and migrations run before it connects, so the
+    # chunked copy is complete - only the swap needs the exclusive lock
+    connection.execute('DROP TABLE users')
+    connection.execute('ALTER TABLE users_v2 RENAME TO users')
+    connection.execute('CREATE INDEX IF NOT EXISTS idx_users_guild_xp ON users (guild_id, xp DESC)')
+    connection.execute('CREATE INDEX IF NOT EXISTS idx_streak_role_gains_guild_user ON streak_role_gains (guild_id, user_id)')
+
+
+@migration(2, "add level_role_jobs for resumable /assignlevelroles runs")
+def _add_level_role_jobs(connection):
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS level_role_jobs (
+            guild_id INTEGER PRIMARY KEY,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            checked INTEGER NOT NULL DEFAULT 0,
+            changed INTEGER NOT NULL DEFAULT 0,
+            started_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+@migration(3, "add announcement channel and digest window settings")
+def _add_notification_settings(connection):
+    connection.execute('ALTER TABLE settings ADD COLUMN announcement_channel_id INTEGER')
+    connection.execute('ALTER TABLE settings ADD COLUMN digest_window REAL')
+
+
+@migration(4, "add bot_state for values the bot remembers between runs")
+def _add_bot_state(connection):
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+
+
+@migration(5, "move quest completions from quests.completed_users into quest_completions")
+def _add_quest_completions(connection):
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS quest_completions (
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            completed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    connection.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_quest_completions_message_user
+        ON quest_completions (message_id, user_id)
+    ''')
+    legacy_rows = connection.execute("SELECT message_id, completed_users FROM quests "
+                                     "WHERE completed_users IS NOT NULL AND completed_users != '[]'").fetchall()
+    for message_id, completed_users_json in legacy_rows:
+        try:
+            completed_users = json.loads(completed_users_json)
+        except (TypeError, ValueError):
+            completed_users = []
+        connection.executemany('INSERT OR IGNORE INTO quest_completions (message_id, user_id) VALUES (?, ?)',
+                               [(message_id, user_id) for user_id in completed_users])
+        connection.execute("UPDATE quests SET completed_users = '[]' WHERE message_id = ?", (message_id,))
+    if legacy_rows:
+        log.info("Migrated completions for %d quest(s) into quest_completions", len(legacy_rows))
+
+
+@migration(6, "add streak_xp_totals, the running per-user sum of streak_role_gains")
+def _add_streak_xp_totals(connection):
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS streak_xp_totals (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            streak_xp INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''')
+    # Backfill from the gain history unless the table was already being kept up to date
+    if connection.execute('SELECT 1 FROM streak_xp_totals LIMIT 1').fetchone() is None:
+        connection.execute('''
+            INSERT INTO streak_xp_totals (guild_id, user_id, streak_xp)
+            SELECT guild_id, user_id, COALESCE(SUM(xp_awarded), 0) FROM streak_role_gains
+            WHERE user_id IS NOT NULL AND guild_id IS NOT NULL
+            GROUP BY guild_id, user_id
+        ''')
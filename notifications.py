@@ -0,0 +1,165 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+import discord
+
+from outbound import NOTIFICATION
+
+log = logging.getLogger("questbot.notifications")
+
+# Seconds role gains are collected before a guild's digest is posted
+DEFAULT_DIGEST_WINDOW = 5.0
+MAX_DIGEST_WINDOW = 300.0
+# How long a digest stays up, like the single notifications it replaces
+DIGEST_DELETE_AFTER = 15
+# Keep digest descriptions under Discord's 4096 character embed limit
+MAX_DIGEST_CHARS = 3900
+
+
+class RoleGain:
+    """One XP-bearing role gained by a member, waiting to be announced"""
+    __slots__ = ('mention', 'role_name', 'xp', 'streak', 'total_xp', 'new_level')
+
+    def __init__(self, mention: str, role_name: str, xp: int, streak: bool, total_xp: int, new_level: Optional[int]):
+        self.mention = mention
+        self.role_name = role_name
+        self.xp = xp
+        self.streak = streak
+        self.total_xp = total_xp
+        self.new_level = new_level  # set only when the gain moved the member to a new level
+
+
+def _single_embed(gain: RoleGain) -> discord.Embed:
+    level_text = f" → Level {gain.new_level}!" if gain.new_level else ""
+    if gain.streak:
+        return discord.Embed(
+            title="🔥 Streak Role Gained!",
+            description=f"{gain.mention} gained **{gain.role_name}** role!\n+{gain.xp} Streak XP accumulated (Total: {gain.total_xp} XP){level_text}",
+            color=0xff6600
+        )
+    return discord.Embed(
+        title="🏅 Role Gained!",
+        description=f"{gain.mention} gained **{gain.role_name}** role!\n+{gain.xp} XP (Total: {gain.total_xp} XP){level_text}",
+        color=0x0099ff
+    )
+
+
+def _digest_embed(gains: List[RoleGain]) -> discord.Embed:
+    lines = []
+    length = 0
+    for shown, gain in enumerate(gains):
+        level_text = f" → Level {gain.new_level}!" if gain.new_level else ""
+        if gain.streak:
+            line = f"🔥 {gain.mention} gained **{gain.role_name}** (+{gain.xp} Streak XP, Total: {gain.total_xp} XP){level_text}"
+        else:
+            line = f"🏅 {gain.mention} gained **{gain.role_name}** (+{gain.xp} XP, Total: {gain.total_xp} XP){level_text}"
+        if length + len(line) + 1 > MAX_DIGEST_CHARS:
+            lines.append(f"…and {len(gains) - shown} more")
+            break
+        lines.append(line)
+        length += len(line) + 1
+    return discord.Embed(
+        title=f"🏅 {len(gains)} Roles Gained!",
+        description="\n".join(lines),
+        color=0xff6600 if all(gain.streak for gain in gains) else 0x0099ff
+    )
+
+
+class RoleGainDigest:
+    """Per-guild role gain announcements, batched into one embed per digest window
+
+    The destination channel is resolved once per guild and cached - the configured
+    announcement channel if the bot can post there, otherwise the first text channel it
+    can post in. The cache is only dropped when permissions or the configuration change.
+    """
+
+    def __init__(self, outbound, default_window: float = DEFAULT_DIGEST_WINDOW):
+        self.outbound = outbound
+        self.default_window = default_window
+        self.channel_ids: Dict[int, int] = {}
+        self.windows: Dict[int, float] = {}
+        self._destinations: Dict[int, Optional[discord.abc.Messageable]] = {}
+        self._pending: Dict[int, List[RoleGain]] = {}
+        # guild_id -> (guild, task) for digests waiting for their window to close
+        self._waiting: Dict[int, Tuple[discord.Guild, asyncio.Task]] = {}
+        # Every digest task, including ones already sending
+        self._tasks: Set[asyncio.Task] = set()
+
+    def configure(self, guild_id: int, channel_id: Optional[int], window: Optional[float]):
+        """Set a guild's announcement channel and digest window (None = fallback / default)"""
+        if channel_id:
+            self.channel_ids[guild_id] = channel_id
+        else:
+            self.channel_ids.pop(guild_id, None)
+        if window is not None:
+            self.windows[guild_id] = window
+        else:
+            self.windows.pop(guild_id, None)
+        self.invalidate(guild_id)
+
+    def window(self, guild_id: int) -> float:
+        return self.windows.get(guild_id, self.default_window)
+
+    def invalidate(self, guild_id: int):
+        """Forget the resolved channel (call when channel or role permissions change)"""
+        self._destinations.pop(guild_id, None)
+
+    def destination(self, guild) -> Optional[discord.abc.Messageable]:
+        if guild.id in self._destinations:
+            return self._destinations[guild.id]
+        channel = None
+        channel_id = self.channel_ids.get(guild.id)
+        if channel_id:
+            configured = guild.get_channel(channel_id)
+            if configured and configured.permissions_for(guild.me).send_messages:
+                channel = configured
+        if channel is None:
+            # Try to send to general channel or first available channel
+            for candidate in guild.text_channels:
+                if candidate.permissions_for(guild.me).send_messages:
+                    channel = candidate
+                    break
+        self._destinations[guild.id] = channel
+        return channel
+
+    def add(self, guild, gain: RoleGain):
+        """Queue a role gain; the guild's digest goes out when its window closes"""
+        pending = self._pending.get(guild.id)
+        if pending is not None:
+            pending.append(gain)
+            return
+        self._pending[guild.id] = [gain]
+        task = asyncio.create_task(self._flush_later(guild))
+        self._waiting[guild.id] = (guild, task)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, guild):
+        await asyncio.sleep(self.window(guild.id))
+        if self._waiting.get(guild.id, (None, None))[1] is asyncio.current_task():
+            del self._waiting[guild.id]
+        await self.flush(guild)
+
+    async def close(self):
+        """Post every pending digest now and wait for the sends (call before the bot disconnects)"""
+        waiting = list(self._waiting.values())
+        self._waiting.clear()
+        for _, task in waiting:
+            task.cancel()
+        await asyncio.gather(*(self.flush(guild) for guild, _ in waiting), *self._tasks, return_exceptions=True)
+
+    async def flush(self, guild):
+        gains = self._pending.pop(guild.id, None)
+        if not gains:
+            return
+        channel = self.destination(guild)
+        if channel is None:
+            return
+        embed = _single_embed(gains[0]) if len(gains) == 1 else _digest_embed(gains)
+        try:
+            await self.outbound.send(channel, embed=embed, priority=NOTIFICATION, delete_after=DIGEST_DELETE_AFTER)
+        except discord.HTTPException as e:
+            # Most likely lost access to the channel - resolve it again next time
+            log.warning("Failed to send role gain notification in %s: %s", guild.name, e, extra={"guild_id": guild.id})
+            self.invalidate(guild.id)
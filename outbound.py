@@ -0,0 +1,192 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+import discord
+
+from metrics import REGISTRY
+
+# Priority classes, most urgent first
+INTERACTION = 0   # command replies and interaction responses
+QUEST = 1         # quest posts, their reactions and pings
+NOTIFICATION = 2  # role gained / quest completed announcements and single-member role edits
+BULK = 3          # bulk level role reconciliation
+
+# Outbound calls in flight at once, and how many of those slots only INTERACTION calls may use
+# so a user-facing reply never waits behind notifications or bulk jobs
+DEFAULT_CONCURRENCY = 8
+INTERACTION_RESERVE = 2
+
+CALL_SECONDS = REGISTRY.histogram("questbot_outbound_call_seconds", "Outbound Discord API call duration by route", ["route"])
+WAIT_SECONDS = REGISTRY.histogram("questbot_outbound_wait_seconds", "Time outbound calls spent queued by priority class", ["priority"])
+_PRIORITY_NAMES = {INTERACTION: "interaction", QUEST: "quest", NOTIFICATION: "notification", BULK: "bulk"}
+
+
+def route_kind(route: str) -> str:
+    """A route without its IDs (channel:123:send -> channel:send), so metrics stay low-cardinality"""
+    return ":".join(part for part in route.split(":") if not part.isdigit())
+
+
+class _Job:
+    __slots__ = ('priority', 'route', 'fn', 'args', 'kwargs', 'future', 'queued')
+
+    def __init__(self, priority: int, route: str, fn, args, kwargs, future: asyncio.Future):
+        self.priority = priority
+        self.route = route
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.queued = time.perf_counter()
+
+
+class OutboundScheduler:
+    """Orders outbound Discord API calls by priority class, with fair queuing across guilds
+
+    Each call names a route that approximates the Discord rate limit bucket it hits
+    (channel sends, member edits per guild, ...). Only one call per route is in flight at a
+    time, so a route that discord.py is holding for a rate limit ties up a single slot and
+    every other route keeps moving. Within a priority class guilds take turns.
+
+    Buckets aren't read from the X-RateLimit-Bucket headers: discord.py already tracks them
+    and sleeps out the limits itself, so serializing per route is all the scheduler adds.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, interaction_reserve: int = INTERACTION_RESERVE):
+        self.concurrency = concurrency
+        self.interaction_reserve = interaction_reserve
+        # priority -> guild_id -> queued jobs; guild order is the round robin order
+        self._queues: Dict[int, OrderedDict] = {priority: OrderedDict() for priority in (INTERACTION, QUEST, NOTIFICATION, BULK)}
+        self._busy_routes = set()
+        self.in_flight = 0
+        # Running calls and delayed deletes - referenced so they aren't collected mid-flight
+        self._tasks = set()
+
+    def __len__(self):
+        return sum(len(jobs) for guilds in self._queues.values() for jobs in guilds.values())
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def close(self):
+        """Cancel running calls and pending delayed deletes (queued calls are never started)"""
+        for task in list(self._tasks):
+            task.cancel()
+
+    def call(self, priority: int, guild_id: Optional[int], route: str, fn, *args, **kwargs) -> asyncio.Future:
+        """Queue fn(*args, **kwargs) and return a future for its result"""
+        future = asyncio.get_running_loop().create_future()
+        guilds = self._queues[priority]
+        guilds.setdefault(guild_id or 0, deque()).append(_Job(priority, route, fn, args, kwargs, future))
+        self._pump()
+        return future
+
+    def _next_job(self, priority: int) -> Optional[_Job]:
+        """Pop the first runnable job of a priority class, rotating the guild it came from to the back"""
+        guilds = self._queues[priority]
+        for guild_id in list(guilds):
+            jobs = guilds[guild_id]
+            for job in list(jobs):
+                if job.future.done():
+                    # Caller gave up (cancelled) while the job was queued
+                    jobs.remove(job)
+                    continue
+                if job.route in self._busy_routes:
+                    continue
+                jobs.remove(job)
+                if jobs:
+                    guilds.move_to_end(guild_id)
+                else:
+                    del guilds[guild_id]
+                return job
+            if not jobs:
+                del guilds[guild_id]
+        return None
+
+    def _pump(self):
+        """Start queued jobs while there are free slots"""
+        while self.in_flight < self.concurrency:
+            job = None
+            for priority in self._queues:
+                if priority != INTERACTION and self.in_flight >= self.concurrency - self.interaction_reserve:
+                    break
+                job = self._next_job(priority)
+                if job:
+                    break
+            if not job:
+                return
+            self.in_flight += 1
+            self._busy_routes.add(job.route)
+            self._spawn(self._run(job))
+
+    async def _run(self, job: _Job):
+        started = time.perf_counter()
+        WAIT_SECONDS.observe(started - job.queued, _PRIORITY_NAMES[job.priority])
+        try:
+            result = await job.fn(*job.args, **job.kwargs)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            CALL_SECONDS.observe(time.perf_counter() - started, route_kind(job.route))
+            self.in_flight -= 1
+            self._busy_routes.discard(job.route)
+            self._pump()
+
+    # Helpers for the calls the bot makes
+
+    async def send(self, destination, *args, priority: int = INTERACTION, delete_after: Optional[float] = None, **kwargs):
+        """destination.send(...) - delete_after cleanup is scheduled here rather than by discord.py"""
+        channel = getattr(destination, 'channel', destination)
+        guild = getattr(channel, 'guild', None)
+        message = await self.call(priority, guild.id if guild else None, f"channel:{channel.id}:send",
+                                  destination.send, *args, **kwargs)
+        if delete_after is not None:
+            self._spawn(self.delete(message, priority=NOTIFICATION, delay=delete_after))
+        return message
+
+    async def delete(self, message, priority: int = NOTIFICATION, delay: Optional[float] = None):
+        """message.delete() after an optional delay - delayed deletes ignore errors like delete_after does"""
+        if delay:
+            await asyncio.sleep(delay)
+        guild = getattr(message, 'guild', None)
+        try:
+            await self.call(priority, guild.id if guild else None, f"channel:{message.channel.id}:delete", message.delete)
+        except discord.HTTPException:
+            if delay is None:
+                raise
+
+    async def edit_message(self, message, priority: int = INTERACTION, **kwargs):
+        guild = getattr(message, 'guild', None)
+        return await self.call(priority, guild.id if guild else None, f"channel:{message.channel.id}:edit",
+                               message.edit, **kwargs)
+
+    async def add_reaction(self, message, emoji, priority: int = QUEST):
+        guild = getattr(message, 'guild', None)
+        return await self.call(priority, guild.id if guild else None, f"channel:{message.channel.id}:reactions",
+                               message.add_reaction, emoji)
+
+    async def clear_reactions(self, message, priority: int = INTERACTION):
+        guild = getattr(message, 'guild', None)
+        return await self.call(priority, guild.id if guild else None, f"channel:{message.channel.id}:reactions",
+                               message.clear_reactions)
+
+    async def respond(self, interaction, *args, **kwargs):
+        """interaction.response.send_message(...)"""
+        return await self.call(INTERACTION, interaction.guild_id, f"interaction:{interaction.id}",
+                               interaction.response.send_message, *args, **kwargs)
+
+    async def followup(self, interaction, *args, **kwargs):
+        """interaction.followup.send(...)"""
+        return await self.call(INTERACTION, interaction.guild_id, f"interaction:{interaction.id}",
+                               interaction.followup.send, *args, **kwargs)
@@ -0,0 +1,43 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class ActiveQuestIndex:
+    """In-memory set of active quest messages, so reactions on other messages never reach the database
+
+    Loaded from the quests table at startup and kept current by add/remove/delete-all.
+    hits counts lookups for quest messages, misses counts lookups for anything else.
+    """
+
+    def __init__(self):
+        # message_id -> (guild_id, title)
+        self._quests: Dict[int, Tuple[int, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._quests)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._quests
+
+    def load(self, rows: Iterable[Tuple[int, int, str]]):
+        """Replace the index with (message_id, guild_id, title) rows"""
+        self._quests = {message_id: (guild_id, title) for message_id, guild_id, title in rows}
+
+    def add(self, message_id: int, guild_id: int, title: str):
+        self._quests[message_id] = (guild_id, title)
+
+    def remove(self, message_id: int):
+        self._quests.pop(message_id, None)
+
+    def remove_guild(self, guild_id: int):
+        self._quests = {message_id: quest for message_id, quest in self._quests.items() if quest[0] != guild_id}
+
+    def title(self, message_id: int) -> Optional[str]:
+        """Title of an active quest message, or None (counted as a hit or miss)"""
+        quest = self._quests.get(message_id)
+        if quest is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return quest[1]
@@ -0,0 +1,18 @@
+from typing import Awaitable, Callable
+
+import discord
+
+# Fixed custom_id so one registered view answers the button on every quest message, across restarts
+COMPLETE_BUTTON_ID = "questbot:quest:complete"
+
+
+class QuestCompleteView(discord.ui.View):
+    """Persistent "Complete" button attached to quest messages"""
+
+    def __init__(self, on_complete: Callable[[discord.Interaction], Awaitable]):
+        super().__init__(timeout=None)
+        self.on_complete = on_complete
+
+    @discord.ui.button(label="Complete", emoji="✅", style=discord.ButtonStyle.success, custom_id=COMPLETE_BUTTON_ID)
+    async def complete(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.on_complete(interaction)
@@ -0,0 +1,58 @@
+from typing import Dict, Iterable, Optional, Tuple
+
+# XP given by an unassigned role with "badge" in its name
+AUTO_BADGE_XP = 5
+
+
+class RoleXPTable:
+    """Compiled role XP lookup for one guild, keyed by integer role IDs
+
+    Built from the guild's role_xp_assignments plus its current roles so that scoring a
+    member is a single set intersection instead of a dict lookup and name check per role.
+    """
+    __slots__ = ('assignments', 'weights', 'auto_badges', 'relevant')
+
+    def __init__(self, assignments: Dict[str, dict], roles: Iterable):
+        # role_id -> (xp, type) for every explicit assignment
+        self.assignments: Dict[int, Tuple[int, str]] = {}
+        for role_id, data in assignments.items():
+            if isinstance(data, dict):
+                self.assignments[int(role_id)] = (data.get("xp", 0), data.get("type", "badge"))
+            else:
+                self.assignments[int(role_id)] = (data, "badge")
+
+        # role_id -> (custom_xp, auto_badge_xp) for every role that counts towards total XP.
+        # Level roles never count (circular dependency) and streak roles use accumulated XP.
+        self.weights: Dict[int, Tuple[int, int]] = {}
+        level_role_ids = set()
+        auto_badges = set()
+        for role in roles:
+            if role.name.startswith("Level "):
+                level_role_ids.add(role.id)
+            elif role.id not in self.assignments and "badge" in role.name.lower():
+                auto_badges.add(role.id)
+                self.weights[role.id] = (0, AUTO_BADGE_XP)
+        for role_id, (xp_amount, role_type) in self.assignments.items():
+            if role_type != "streak" and role_id not in level_role_ids:
+                self.weights[role_id] = (xp_amount, 0)
+        self.auto_badges = frozenset(auto_badges)
+        # Every role whose gain or loss the bot reacts to (XP roles and level roles)
+        self.relevant = frozenset(self.assignments.keys() | auto_badges | level_role_ids)
+
+    def lookup(self, role_id: int) -> Optional[Tuple[int, str]]:
+        """Return (xp, type) for an explicitly assigned role, or None"""
+        return self.assignments.get(role_id)
+
+    def is_xp_role(self, role_id: int) -> bool:
+        """True if gaining or losing this role can change a member's XP"""
+        return role_id in self.assignments or role_id in self.auto_badges
+
+    def score(self, role_ids) -> Tuple[int, int]:
+        """Return (custom_role_xp, auto_badge_xp) for a member holding the given role IDs"""
+        custom_role_xp = 0
+        auto_role_xp = 0
+        for role_id in self.weights.keys() & role_ids:
+            custom, badge = self.weights[role_id]
+            custom_role_xp += custom
+            auto_role_xp += badge
+        return custom_role_xp, auto_role_xp
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from database import Database
+
+
+def _create_tables(connection):
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.execute('CREATE TABLE quests (id INTEGER PRIMARY KEY)')
+    connection.execute('''
+        CREATE TABLE completions (
+            quest_id INTEGER REFERENCES quests (id) DEFERRABLE INITIALLY DEFERRED,
+            user_id INTEGER NOT NULL
+        )
+    ''')
+
+
+def _insert_twice(connection, quest_id):
+    connection.execute('INSERT INTO quests (id) VALUES (?)', (quest_id,))
+    connection.execute('INSERT INTO quests (id) VALUES (?)', (quest_id,))
+
+
+class GroupCommitTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        # A long flush interval keeps every write below in the same batch
+        self.db = Database(os.path.join(self.workdir.name, 'test.db'), flush_interval=0.5)
+        self.db.run_sync(_create_tables)
+
+    def tearDown(self):
+        self.db.close()
+        self.workdir.cleanup()
+
+    async def quest_ids(self):
+        return [row[0] for row in await self.db.fetchall('SELECT id FROM quests ORDER BY id')]
+
+    async def test_writes_share_one_commit(self):
+        commits = self.db.commits
+        await asyncio.gather(*(self.db.execute('INSERT INTO quests (id) VALUES (?)', (i,)) for i in range(5)))
+        self.assertEqual(self.db.commits, commits + 1)
+        self.assertEqual(await self.quest_ids(), [0, 1, 2, 3, 4])
+
+    async def test_failing_write_only_undoes_itself(self):
+        results = await asyncio.gather(
+            self.db.execute('INSERT INTO quests (id) VALUES (1)'),
+            self.db.write(_insert_twice, 2),
+            self.db.execute('INSERT INTO quests (id) VALUES (3)'),
+            return_exceptions=True,
+        )
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], sqlite3.IntegrityError)
+        self.assertEqual(results[2], 1)
+        # The first insert of the failing job was rolled back with it
+        self.assertEqual(await self.quest_ids(), [1, 3])
+
+    async def test_failed_commit_fails_the_whole_batch(self):
+        results = await asyncio.gather(
+            self.db.execute('INSERT INTO quests (id) VALUES (1)'),
+            # Deferred foreign keys are only checked at COMMIT
+            self.db.execute('INSERT INTO completions (quest_id, user_id) VALUES (99, 10)'),
+            return_exceptions=True,
+        )
+        self.assertIsInstance(results[0], sqlite3.IntegrityError)
+        self.assertIsInstance(results[1], sqlite3.IntegrityError)
+        self.assertEqual(await self.quest_ids(), [])
+        # The connection is usable again after the rollback
+        await self.db.execute('INSERT INTO quests (id) VALUES (2)')
+        self.assertEqual(await self.quest_ids(), [2])
+
+    async def test_read_commits_pending_writes_first(self):
+        write = asyncio.ensure_future(self.db.execute('INSERT INTO quests (id) VALUES (7)'))
+        await asyncio.sleep(0.05)
+        self.assertFalse(write.done())
+        self.assertEqual(await self.quest_ids(), [7])
+        self.assertTrue(write.done())
+
+
+if __name__ == '__main__':
+    unittest.main()
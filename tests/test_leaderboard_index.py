@@ -0,0 +1,68 @@
+import random
+import unittest
+
+from leaderboard_index import IndexableSkipList, LeaderboardIndex
+
+
+class IndexableSkipListTest(unittest.TestCase):
+    def assert_matches(self, skip_list, expected):
+        self.assertEqual(len(skip_list), len(expected))
+        self.assertEqual(skip_list.first(len(expected) + 1), expected)
+        for position, key in enumerate(expected, 1):
+            self.assertEqual(skip_list.rank(key), position)
+
+    def test_random_inserts_and_removes_keep_ranks(self):
+        rng = random.Random(7)
+        skip_list = IndexableSkipList()
+        expected = []
+        for _ in range(2000):
+            if expected and rng.random() < 0.4:
+                key = rng.choice(expected)
+                skip_list.remove(key)
+                expected.remove(key)
+            else:
+                key = rng.randrange(10_000)
+                if key in expected:
+                    continue
+                skip_list.insert(key)
+                expected.append(key)
+                expected.sort()
+        self.assert_matches(skip_list, expected)
+
+    def test_load_sorted_then_update(self):
+        skip_list = IndexableSkipList()
+        skip_list.load_sorted(list(range(0, 200, 2)))
+        skip_list.insert(51)
+        skip_list.remove(0)
+        self.assert_matches(skip_list, sorted(set(range(2, 200, 2)) | {51}))
+
+    def test_load_sorted_requires_empty_list(self):
+        skip_list = IndexableSkipList()
+        skip_list.insert(1)
+        with self.assertRaises(ValueError):
+            skip_list.load_sorted([2, 3])
+
+    def test_missing_keys(self):
+        skip_list = IndexableSkipList()
+        self.assertIsNone(skip_list.rank(5))
+        skip_list.insert(5)
+        self.assertIsNone(skip_list.rank(4))
+        self.assertIsNone(skip_list.rank(6))
+        with self.assertRaises(KeyError):
+            skip_list.remove(4)
+
+
+class LeaderboardIndexTest(unittest.TestCase):
+    def test_ranks_by_xp_then_user_id(self):
+        index = LeaderboardIndex.from_totals({10: 50, 11: 80, 12: 50})
+        self.assertEqual(index.top(3), [(11, 80), (10, 50), (12, 50)])
+        index.update(12, 100)
+        self.assertEqual(index.rank(12), 1)
+        self.assertEqual(index.rank(10), 3)
+        index.remove(11)
+        self.assertIsNone(index.rank(11))
+        self.assertEqual(index.top(5), [(12, 100), (10, 50)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import unittest
+
+from benchmarks.fakes import FakeGuild, FakeMember
+from level_roles import LevelRoleReconciler, level_role_name
+from members import MemberDirectory
+from outbound import OutboundScheduler
+
+SETTLE_DELAY = 0.02
+
+
+class FakeBot:
+    def __init__(self, *guilds):
+        self.guilds = {guild.id: guild for guild in guilds}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+
+class LevelRoleReconcilerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.guild = FakeGuild(1, "Test guild")
+        self.level_roles = {level: self.guild.add_role(100 + level, level_role_name(level)) for level in range(1, 4)}
+        self.other_role = self.guild.add_role(200, "Artist")
+        self.member = FakeMember(10, self.guild, [self.guild.default_role, self.other_role, self.level_roles[1]])
+        self.guild.add_member(self.member)
+        self.outbound = OutboundScheduler()
+        self.created = []
+        self.reconciler = LevelRoleReconciler(FakeBot(self.guild), self.outbound, MemberDirectory(),
+                                              self.create_level_roles, settle_delay=SETTLE_DELAY)
+
+    async def asyncTearDown(self):
+        self.outbound.close()
+
+    async def create_level_roles(self, guild):
+        self.created.append(guild.id)
+        for level in range(1, 11):
+            if not any(role.name == level_role_name(level) for role in guild.roles):
+                guild.add_role(100 + level, level_role_name(level))
+
+    async def settle(self):
+        while len(self.reconciler):
+            await asyncio.sleep(SETTLE_DELAY)
+
+    def role_names(self):
+        return sorted(role.name for role in self.member.roles if not role.is_default())
+
+    async def test_burst_is_coalesced_into_one_edit(self):
+        for level in (2, 3, 2, 3):
+            self.reconciler.schedule(self.guild.id, self.member.id, level)
+        self.assertEqual(len(self.reconciler), 1)
+        await self.settle()
+        self.assertEqual(self.guild.role_edits, 1)
+        self.assertEqual(self.role_names(), ["Artist", "Level 3"])
+
+    async def test_later_change_is_applied_after_the_first(self):
+        self.reconciler.schedule(self.guild.id, self.member.id, 2)
+        await asyncio.sleep(SETTLE_DELAY * 1.5)
+        self.reconciler.schedule(self.guild.id, self.member.id, 3)
+        await self.settle()
+        self.assertEqual(self.role_names(), ["Artist", "Level 3"])
+
+    async def test_current_level_needs_no_edit(self):
+        self.reconciler.schedule(self.guild.id, self.member.id, 1)
+        await self.settle()
+        self.assertEqual(self.guild.role_edits, 0)
+
+    async def test_missing_level_role_is_created(self):
+        self.reconciler.schedule(self.guild.id, self.member.id, 5)
+        await self.settle()
+        self.assertEqual(self.created, [self.guild.id])
+        self.assertEqual(self.role_names(), ["Artist", "Level 5"])
+
+    async def test_unknown_member_is_skipped(self):
+        self.assertFalse(await self.reconciler.apply(self.guild.id, 99, 2))
+        self.assertFalse(await self.reconciler.apply(2, self.member.id, 2))
+        self.assertEqual(self.guild.role_edits, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import sqlite3
+import unittest
+
+from migrations import MIGRATIONS, apply_migrations, get_schema_version
+
+# The schema every pre-versioning database was created with
+LEGACY_SCHEMA = '''
+    CREATE TABLE users (
+        user_id INTEGER PRIMARY KEY,
+        guild_id INTEGER,
+        xp INTEGER DEFAULT 0,
+        level INTEGER DEFAULT 1,
+        UNIQUE(user_id, guild_id)
+    );
+    CREATE TABLE quests (
+        message_id INTEGER PRIMARY KEY,
+        guild_id INTEGER,
+        channel_id INTEGER,
+        title TEXT,
+        content TEXT,
+        completed_users TEXT DEFAULT '[]'
+    );
+    CREATE TABLE settings (
+        guild_id INTEGER PRIMARY KEY,
+        quest_ping_role_id INTEGER,
+        quest_channel_id INTEGER,
+        role_xp_assignments TEXT DEFAULT '{}'
+    );
+    CREATE TABLE streak_role_gains (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        guild_id INTEGER,
+        role_id INTEGER,
+        role_name TEXT,
+        xp_awarded INTEGER,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+'''
+
+
+class LegacyDatabaseMigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:', isolation_level=None)
+        self.connection.executescript(LEGACY_SCHEMA)
+        self.connection.executemany('INSERT INTO users (user_id, guild_id, xp, level) VALUES (?, ?, ?, ?)',
+                                    [(10, 1, 120, 2), (11, 1, 30, 1), (12, 1, None, None), (13, None, 50, 1)])
+        self.connection.executemany('INSERT INTO quests (message_id, guild_id, title, completed_users) VALUES (?, ?, ?, ?)',
+                                    [(500, 1, "Daily", '[10, 11]'), (501, 1, "Weekly", '[]'), (502, 1, "Broken", 'not json')])
+        self.connection.executemany('INSERT INTO streak_role_gains (user_id, guild_id, role_id, xp_awarded) VALUES (?, ?, ?, ?)',
+                                    [(10, 1, 900, 25), (10, 1, 901, 15), (11, 1, 900, 5)])
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_applies_every_migration(self):
+        applied = apply_migrations(self.connection, chunk_size=2)
+        self.assertEqual(applied, [m.version for m in MIGRATIONS])
+        self.assertEqual(get_schema_version(self.connection), MIGRATIONS[-1].version)
+        self.assertEqual(apply_migrations(self.connection), [])
+
+    def test_users_keyed_per_guild(self):
+        apply_migrations(self.connection, chunk_size=2)
+        rows = self.connection.execute('SELECT guild_id, user_id, xp, level FROM users ORDER BY user_id').fetchall()
+        # Rows without a guild are dropped and missing XP/levels get the defaults
+        self.assertEqual(rows, [(1, 10, 120, 2), (1, 11, 30, 1), (1, 12, 0, 1)])
+        self.connection.execute('INSERT INTO users (guild_id, user_id) VALUES (2, 10)')
+
+    def test_quest_completions_moved_out_of_quests(self):
+        apply_migrations(self.connection)
+        completions = self.connection.execute('SELECT message_id, user_id FROM quest_completions ORDER BY user_id').fetchall()
+        self.assertEqual(completions, [(500, 10), (500, 11)])
+        completed_users = self.connection.execute('SELECT completed_users FROM quests WHERE message_id = 500').fetchone()
+        self.assertEqual(completed_users, ('[]',))
+
+    def test_streak_totals_backfilled(self):
+        apply_migrations(self.connection)
+        totals = self.connection.execute('SELECT guild_id, user_id, streak_xp FROM streak_xp_totals ORDER BY user_id').fetchall()
+        self.assertEqual(totals, [(1, 10, 40), (1, 11, 5)])
+
+    def test_failed_migration_rolls_back(self):
+        self.connection.execute('ALTER TABLE settings ADD COLUMN digest_window REAL')
+        with self.assertRaises(sqlite3.OperationalError):
+            apply_migrations(self.connection)
+        # Migration 3 failed, so the version stays at 2 and its partial changes are undone
+        self.assertEqual(get_schema_version(self.connection), 2)
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(settings)')]
+        self.assertNotIn('announcement_channel_id', columns)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,82 @@
-from flask import Flask
-from threading import Thread
+import asyncio
+import logging
 import os
+from typing import Awaitable, Callable, Dict, List, Tuple
 
-app = Flask('')
-@app.route('/')
-def home():
-    return "Discord bot ok"
+from aiohttp import web
 
-def run():
-    port = int(os.environ.get("PORT", 3000))
-    print(f"Web server is starting on port {port}...")
-    app.run(host="0.0.0.0", port=port)
+log = logging.getLogger("questbot.web")
 
-def keep_alive():
-    t = Thread(target=run)
-    t.start()
+# A readiness check that hasn't answered by then counts as failed
+CHECK_TIMEOUT = 2.0
+# Private routes (metrics, stack traces) are only served here - localhost unless DIAG_HOST says otherwise
+DEFAULT_DIAG_HOST = "127.0.0.1"
+DEFAULT_DIAG_PORT = 9091
+
+ReadinessCheck = Callable[[], Awaitable[Tuple[bool, str]]]
+
+
+class WebServer:
+    """HTTP endpoints served from the bot's own event loop
+
+    / and /healthz answer as long as the loop is serving requests. /readyz runs every
+    registered readiness check and returns 503 unless all of them pass. Routes added with
+    private=True go on a second site bound to the diagnostics host and port instead.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = None, diag_host: str = None, diag_port: int = None):
+        self.host = host
+        self.port = port if port is not None else int(os.environ.get("PORT", 3000))
+        self.diag_host = diag_host or os.environ.get("DIAG_HOST", DEFAULT_DIAG_HOST)
+        self.diag_port = diag_port if diag_port is not None else int(os.environ.get("DIAG_PORT", DEFAULT_DIAG_PORT))
+        self.app = web.Application()
+        self.app.router.add_get('/', self.home)
+        self.app.router.add_get('/healthz', self.home)
+        self.app.router.add_get('/readyz', self.ready)
+        self.diag_app = web.Application()
+        self._checks: Dict[str, ReadinessCheck] = {}
+        self._runners: List[web.AppRunner] = []
+
+    def add_check(self, name: str, check: ReadinessCheck):
+        """Register an async check returning (ok, detail) for /readyz"""
+        self._checks[name] = check
+
+    def add_route(self, method: str, path: str, handler, private: bool = False):
+        """Serve a route on the public port, or only on the diagnostics site with private=True"""
+        (self.diag_app if private else self.app).router.add_route(method, path, handler)
+
+    async def home(self, request):
+        return web.Response(text="Discord bot ok")
+
+    async def _run_check(self, check: ReadinessCheck) -> Tuple[bool, str]:
+        try:
+            return await asyncio.wait_for(check(), CHECK_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False, f"no answer within {CHECK_TIMEOUT:g}s"
+        except Exception as e:
+            return False, str(e)
+
+    async def ready(self, request):
+        names = list(self._checks)
+        results = await asyncio.gather(*(self._run_check(self._checks[name]) for name in names))
+        checks = {name: {"ok": ok, "detail": detail} for name, (ok, detail) in zip(names, results)}
+        ready = all(ok for ok, _ in results)
+        return web.json_response({"ready": ready, "checks": checks}, status=200 if ready else 503)
+
+    async def _serve(self, app: web.Application, host: str, port: int):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        self._runners.append(runner)
+        await web.TCPSite(runner, host, port).start()
+
+    async def start(self):
+        await self._serve(self.app, self.host, self.port)
+        log.info("Web server is starting on port %d...", self.port)
+        if self.diag_app.router.routes():
+            await self._serve(self.diag_app, self.diag_host, self.diag_port)
+            log.info("Diagnostics are served on %s:%d", self.diag_host, self.diag_port)
+
+    async def stop(self):
+        """Stop accepting connections and let in-flight requests finish"""
+        while self._runners:
+            await self._runners.pop().cleanup()
@@ -0,0 +1,128 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class MemberXP:
+    """Cached XP components for one member of one guild"""
+    __slots__ = ('base', 'custom', 'badge', 'streak', 'level')
+
+    def __init__(self, base: int = 0, custom: int = 0, badge: int = 0, streak: int = 0, level: int = 1):
+        self.base = base        # quest completions and manual additions (users.xp)
+        self.custom = custom    # explicitly assigned non-streak role XP
+        self.badge = badge      # auto-detected "badge" roles without an assignment (5 XP each)
+        self.streak = streak    # accumulated streak role XP (streak_xp_totals)
+        self.level = level      # level last stored in the database (users.level)
+
+    @property
+    def total(self) -> int:
+        return self.base + self.custom + self.badge + self.streak
+
+
+class TotalXPCache:
+    """Per-guild in-memory cache of member XP components, kept current by gateway events
+
+    Writes only update entries that exist, so a member being loaded from the database is
+    tracked from begin_load to end_load: if any write for them lands in between, the loaded
+    values may predate it and end_load refuses to cache them.
+    """
+
+    def __init__(self, on_change: Optional[Callable[[int, int, int], None]] = None):
+        self._guilds: Dict[int, Dict[int, MemberXP]] = {}
+        # (guild_id, user_id) -> [loads in flight, writes seen] for members being loaded
+        self._loads: Dict[Tuple[int, int], List[int]] = {}
+        # Called with (guild_id, user_id, total_xp) whenever a cached member's total may have changed
+        self.on_change = on_change
+
+    def _changed(self, guild_id: int, user_id: int, entry: MemberXP):
+        if self.on_change:
+            self.on_change(guild_id, user_id, entry.total)
+
+    def __len__(self):
+        return sum(len(members) for members in self._guilds.values())
+
+    def _written(self, guild_id: int, user_id: int):
+        load = self._loads.get((guild_id, user_id))
+        if load:
+            load[1] += 1
+
+    def begin_load(self, guild_id: int, user_id: int) -> int:
+        """Start tracking writes for a member about to be loaded, returns the token for end_load"""
+        load = self._loads.setdefault((guild_id, user_id), [0, 0])
+        load[0] += 1
+        return load[1]
+
+    def end_load(self, guild_id: int, user_id: int, token: int, entry: Optional[MemberXP]) -> Optional[MemberXP]:
+        """Finish a load: returns the cached entry, storing entry if no write raced it (None if one did)
+
+        Must be called once for every begin_load, with entry=None if the load failed.
+        """
+        key = (guild_id, user_id)
+        load = self._loads[key]
+        load[0] -= 1
+        raced = load[1] != token
+        if not load[0]:
+            del self._loads[key]
+        cached = self.get(guild_id, user_id)
+        if cached:
+            # Another load got there first; writes since then have been applied to it
+            return cached
+        if entry is None or raced:
+            return None
+        self.put(guild_id, user_id, entry)
+        return entry
+
+    def get(self, guild_id: int, user_id: int) -> Optional[MemberXP]:
+        members = self._guilds.get(guild_id)
+        return members.get(user_id) if members else None
+
+    def put(self, guild_id: int, user_id: int, entry: MemberXP):
+        self._guilds.setdefault(guild_id, {})[user_id] = entry
+        self._changed(guild_id, user_id, entry)
+
+    def members(self, guild_id: int) -> Dict[int, MemberXP]:
+        """Cached entries for a guild (read-only view for callers)"""
+        return self._guilds.get(guild_id, {})
+
+    def set_base(self, guild_id: int, user_id: int, base: int):
+        self._written(guild_id, user_id)
+        entry = self.get(guild_id, user_id)
+        if entry:
+            entry.base = base
+            self._changed(guild_id, user_id, entry)
+
+    def set_level(self, guild_id: int, user_id: int, level: int):
+        self._written(guild_id, user_id)
+        entry = self.get(guild_id, user_id)
+        if entry:
+            entry.level = level
+
+    def set_streak(self, guild_id: int, user_id: int, streak: int):
+        self._written(guild_id, user_id)
+        entry = self.get(guild_id, user_id)
+        if entry:
+            entry.streak = streak
+            self._changed(guild_id, user_id, entry)
+
+    def set_role_xp(self, guild_id: int, user_id: int, custom: int, badge: int):
+        self._written(guild_id, user_id)
+        entry = self.get(guild_id, user_id)
+        if entry:
+            entry.custom = custom
+            entry.badge = badge
+            self._changed(guild_id, user_id, entry)
+
+    def invalidate_member(self, guild_id: int, user_id: int):
+        self._written(guild_id, user_id)
+        members = self._guilds.get(guild_id)
+        if members:
+            members.pop(user_id, None)
+
+    def invalidate_guild(self, guild_id: int):
+        for key, load in self._loads.items():
+            if key[0] == guild_id:
+                load[1] += 1
+        self._guilds.pop(guild_id, None)
+
+    def clear(self):
+        for load in self._loads.values():
+            load[1] += 1
+        self._guilds.clear()